@@ -1,16 +1,28 @@
+import array
 import asyncio
-import struct
+import bisect
+import builtins
+import collections
+import json
 import logging
 import uuid
 import os
 import re
 import functools
+import heapq
+import itertools
 import time
 import asyncpg
 import aiosqlite
 import sqlite3
 import random
+import shutil
+import signal
+import socket
+import struct
+import tempfile
 import aioconsole
+import mn_codec
 
 print("-------------------------------------")
 print(" Mystic Nights Private Server v1.0.0 ")
@@ -18,23 +30,65 @@ print("-------------------------------------")
 
 # ========== CONFIG ==========
 # HOST = '211.233.10.5' # ISO ORIGINAL IP
-HOST = '207.148.21.93'
-TCP_PORT = 18000
-SERVER_PORT = 18001
+# MN_HOST / MN_TCP_PORT / MN_SERVER_PORT override these (e.g. for a local benchmark run)
+HOST = os.environ.get("MN_HOST", '207.148.21.93')
+TCP_PORT = int(os.environ.get("MN_TCP_PORT", 18000))
+SERVER_PORT = int(os.environ.get("MN_SERVER_PORT", 18001))
 # CLIENT_GAMEPLAY_PORT = 3658
 DB_POOL = None
-# DEBUG FLAG SHOULD BE 0 IN PRODUCTION 
-DEBUG = 0 
-### ECHO WATCHER
-WATCHER_SLEEP_TIME = 1
+# DEBUG FLAG SHOULD BE 0 IN PRODUCTION (MN_DEBUG overrides it)
+DEBUG = int(os.environ.get("MN_DEBUG", 0))
+### ECHO KEEPALIVE
+WATCHER_SLEEP_TIME = 1  # Recheck interval for sessions in a countdown
 ECHO_TIMEOUT = 20
 ECHO_RESPONSE_WAIT = 5
 ###
+# Seconds a quick join waits for the client's matching lobby join before failing it
+QUICK_JOIN_TIMEOUT = 5
+# Quick join lobby selection (JoinableIndex.policies): "rank_closest", "random" or "fullest"
+QUICK_JOIN_POLICY = os.environ.get("MN_QUICK_JOIN_POLICY", "rank_closest")
+# Seconds between write-behind flushes of lobby state to the database
+LOBBY_FLUSH_INTERVAL = 2
+### SERVER / CHANNEL LIST PACKET CACHE (ListPacketCache)
+LIST_DEBOUNCE = 0.5  # Seconds a list may be served stale after a count change before it is rebuilt (0 = rebuild on next request)
+LIST_TTL = 2  # Multi-process / cluster mode: other processes change the counts, so lists are also rebuilt this often
+###
+### SQLITE BATCHED MODE (SQLITE_BATCHED=1): WAL + single writer with group commit
+SQLITE_BATCHED = os.environ.get("SQLITE_BATCHED", "0") == "1"
+SQLITE_COMMIT_INTERVAL = 0.005  # Seconds the writer waits to gather a group before committing
+SQLITE_COMMIT_MAX = 64  # Max queued writes per group commit
+SQLITE_READ_POOL = 4  # Read-only connections used by fetch/fetchrow
+###
+# Compiled statements kept per SQLite connection (named statements + ad-hoc queries)
+SQLITE_CACHED_STATEMENTS = 256
+# Network core: "streams" (asyncio.start_server) or "protocol" (raw asyncio.Protocol callbacks)
+NET_CORE = os.environ.get("MN_NET_CORE", "streams")
+# Event loop: "asyncio" or "uvloop" (optional `pip install uvloop`; falls back to asyncio if missing)
+EVENT_LOOP = os.environ.get("MN_EVENT_LOOP", "asyncio")
+# Max bytes taken from a client socket per read (framed into packets in place)
+RECV_CHUNK = 65536
+# Protocol core: packets waiting for a handler before reading from that client pauses
+RECV_BACKLOG_MAX = 256
+### OUTBOUND SEND QUEUE (one per session, drained by its own writer task)
+SEND_QUEUE_MAX = 256  # Packets queued per client before SEND_OVERFLOW applies
+SEND_OVERFLOW = os.environ.get("MN_SEND_OVERFLOW", "drop_move")  # "drop_move" or "disconnect"
+MOVE_CONFLATION = os.environ.get("MN_MOVE_CONFLATION", "1") == "1"  # Keep only the newest pending 0x1388 per sender
+### Multi-process mode: MN_WORKERS > 1 forks that many workers sharing both ports via SO_REUSEPORT (Linux)
+WORKERS = int(os.environ.get("MN_WORKERS", 1))
+SHARD_SEND_RETRIES = 50  # 0.1s apart; a peer worker may still be starting
+SHARD_HANDOFF_TIMEOUT = 5  # Seconds to wait for a client's queued output before handing it off
+SHARD_HANDOFF_MAX = 1 << 18  # Largest handoff datagram (state + unhandled received bytes)
+### Cluster mode: MN_NODE_SERVERS="MN0,MN1" makes this node serve those servers rows; nodes share the DB
+NODE_SERVERS = [name.strip() for name in os.environ.get("MN_NODE_SERVERS", "").split(",") if name.strip()]
+NODE_ID = os.environ.get("MN_NODE_ID", f"{socket.gethostname()}/{HOST}:{TCP_PORT}")
+NODE_HEARTBEAT_INTERVAL = 5
+NODE_TIMEOUT = 15  # Servers whose node has not heartbeated for this long are listed offline (-1)
+SESSION_LEASE = 15  # Cluster session directory: seconds a player's entry stays live without renewal
+SESSION_SYNC_INTERVAL = 1  # Seconds between lease renewals / superseded-session checks
 
-sessions = {}  # {addr: session}
 lobby_echo_results = {}   # {(channel_db_id, lobby_name): {player_id: bool}}
 last_packet_times = {}  # player_id -> timestamp
-sessions_lock = asyncio.Lock()
+lobby_list_packets = {}  # {channel_db_id: (LobbyStateEngine.channel_version, 0x0bc8 packet)}
 lobby_echo_lock = asyncio.Lock()
 last_packet_lock = asyncio.Lock()
 lobby_ready_lock = asyncio.Lock()
@@ -53,7 +107,24 @@ if DEBUG == 2:
 def print(*args, **kwargs):
     if not DEBUG:
         return
-    __builtins__.print(*args, **kwargs)
+    builtins.print(*args, **kwargs)
+
+# Lazy debug log: fmt % args is only built when DEBUG >= level, and Hex() defers .hex().
+# Per-packet call sites also sit behind `if DEBUG:` so DEBUG=0 skips even the call.
+def log(fmt, *args, level=1):
+    if DEBUG < level:
+        return
+    builtins.print(fmt % args if args else fmt)
+
+class Hex:
+    """Defers bytes.hex() until a log line is actually formatted."""
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data
+
+    def __str__(self):
+        return bytes(self.data).hex()
 
 def get_postgres_dsn():
     # Fallback to sensible defaults if env vars are missing
@@ -95,10 +166,12 @@ def trace_calls(func):
 # ========= CLASSES ==========
 
 class DBBase:
+    def prepare(self, query): return query
     async def connect(self): pass
     async def fetch(self, query, *args): pass
     async def fetchrow(self, query, *args): pass
     async def execute(self, query, *args): pass
+    async def execute_batch(self, statements): pass
     async def close(self): pass
 
 class PostgresDB(DBBase):
@@ -113,27 +186,41 @@ class PostgresDB(DBBase):
     async def execute(self, query, *args):
         async with self.pool.acquire() as conn:
             return await conn.execute(query, *args)
+    async def execute_batch(self, statements):
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                for query, args in statements:
+                    await conn.execute(query, *args)
     async def close(self):
-        if self.pool: await self.pool.close()
+        if self.pool:
+            await self.pool.close()
+            self.pool = None
 
 class SQLiteDB:
     def __init__(self, db_file="mysticnights.db", schema_file="mn_sqlite_schema.sql"):
         self.db_file = db_file
         self.schema_file = schema_file
         self.conn = None
+        # Writes share one connection: a batch must not interleave with (or be committed by) another write
+        self.write_lock = asyncio.Lock()
 
     @staticmethod
+    @functools.lru_cache(maxsize=512)
     def _rewrite_query(query):
         """
         Rewrite $1, $2... to '?' for SQLite parameter substitution.
+        Memoized, so repeated query texts skip the regex.
         """
         return re.sub(r'\$\d+', '?', query)
 
+    def prepare(self, query):
+        return self._rewrite_query(query)
+
     async def connect(self):
         """
         Open the database connection. Should only be called once.
         """
-        self.conn = await aiosqlite.connect(self.db_file)
+        self.conn = await aiosqlite.connect(self.db_file, cached_statements=SQLITE_CACHED_STATEMENTS)
         # Row factory gives dict-like rows for easier coding
         self.conn.row_factory = aiosqlite.Row
     
@@ -151,9 +238,24 @@ class SQLiteDB:
 
     async def execute(self, query, *args):
         query = self._rewrite_query(query)
-        async with self.conn.execute(query, (*args,)) as cursor:
+        async with self.write_lock:
+            async with self.conn.execute(query, (*args,)) as cursor:
+                await self.conn.commit()
+                return cursor.rowcount
+
+    async def execute_batch(self, statements):
+        """
+        Execute a list of (query, args) tuples in one transaction: all of them or none.
+        """
+        async with self.write_lock:
+            await self.conn.execute("BEGIN")
+            try:
+                for query, args in statements:
+                    await self.conn.execute(self._rewrite_query(query), (*args,))
+            except Exception:
+                await self.conn.rollback()
+                raise
             await self.conn.commit()
-            return cursor.rowcount
 
     async def close(self):
         if self.conn:
@@ -184,9 +286,223 @@ class SQLiteDB:
         await self.connect()
         return self
 
+class SQLiteBatchedDB(SQLiteDB):
+    """
+    SQLite backend with WAL journaling, a single writer coroutine that group-commits
+    queued writes, and a pool of read connections for fetch/fetchrow.
+    execute() still returns only once its write is committed, so callers keep
+    read-after-write consistency; concurrent writers just share one commit (fsync).
+    """
+    def __init__(self, db_file="mysticnights.db", schema_file="mn_sqlite_schema.sql"):
+        super().__init__(db_file, schema_file)
+        self.readers = None
+        self.write_queue = None
+        self.writer_task = None
+
+    async def connect(self):
+        # Autocommit mode: the writer issues BEGIN/COMMIT itself around each group
+        self.conn = await aiosqlite.connect(self.db_file, isolation_level=None, cached_statements=SQLITE_CACHED_STATEMENTS)
+        self.conn.row_factory = aiosqlite.Row
+        await self.conn.execute("PRAGMA journal_mode=WAL")
+        await self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.readers = asyncio.Queue()
+        for _ in range(SQLITE_READ_POOL):
+            reader = await aiosqlite.connect(self.db_file, cached_statements=SQLITE_CACHED_STATEMENTS)
+            reader.row_factory = aiosqlite.Row
+            await reader.execute("PRAGMA query_only=1")
+            self.readers.put_nowait(reader)
+        self.write_queue = asyncio.Queue()
+        self.writer_task = asyncio.create_task(self._writer())
+
+    async def fetch(self, query, *args):
+        reader = await self.readers.get()
+        try:
+            async with reader.execute(self._rewrite_query(query), (*args,)) as cursor:
+                rows = await cursor.fetchall()
+                return [dict(row) for row in rows]
+        finally:
+            self.readers.put_nowait(reader)
+
+    async def fetchrow(self, query, *args):
+        reader = await self.readers.get()
+        try:
+            async with reader.execute(self._rewrite_query(query), (*args,)) as cursor:
+                row = await cursor.fetchone()
+                return dict(row) if row else None
+        finally:
+            self.readers.put_nowait(reader)
+
+    async def execute(self, query, *args):
+        return await self._submit([(query, args)])
+
+    async def execute_batch(self, statements):
+        if statements:
+            await self._submit(list(statements))
+
+    async def _submit(self, statements):
+        if self.writer_task is None or self.writer_task.done():
+            raise Exception("SQLite writer is not running.")
+        future = asyncio.get_running_loop().create_future()
+        await self.write_queue.put((statements, future))
+        return await future
+
+    async def _run_item(self, statements):
+        """Run one queued item atomically inside the open group transaction."""
+        await self.conn.execute("SAVEPOINT item")
+        try:
+            rowcount = 0
+            for query, args in statements:
+                async with self.conn.execute(self._rewrite_query(query), (*args,)) as cursor:
+                    rowcount = cursor.rowcount
+        except Exception:
+            await self.conn.execute("ROLLBACK TO item")
+            await self.conn.execute("RELEASE item")
+            raise
+        await self.conn.execute("RELEASE item")
+        return rowcount
+
+    async def _writer(self):
+        running = True
+        while running:
+            item = await self.write_queue.get()
+            if item is None:
+                break
+            group = [item]
+            # Gather more writes until the interval passes or the group is full
+            deadline = time.monotonic() + SQLITE_COMMIT_INTERVAL
+            while len(group) < SQLITE_COMMIT_MAX:
+                timeout = deadline - time.monotonic()
+                try:
+                    item = self.write_queue.get_nowait() if timeout <= 0 else \
+                        await asyncio.wait_for(self.write_queue.get(), timeout)
+                except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                    break
+                if item is None:
+                    running = False
+                    break
+                group.append(item)
+
+            results = []
+            try:
+                # IMMEDIATE takes the write lock up front (busy-waiting on other worker processes)
+                await self.conn.execute("BEGIN IMMEDIATE")
+                for statements, future in group:
+                    try:
+                        results.append((future, await self._run_item(statements), None))
+                    except Exception as e:
+                        results.append((future, None, e))
+                await self.conn.execute("COMMIT")
+            except Exception as e:
+                print(f"[DB ERROR] Group commit of {len(group)} writes failed: {e}")
+                try:
+                    await self.conn.execute("ROLLBACK")
+                except Exception:
+                    pass
+                results = [(future, None, e) for _, future in group]
+            for future, rowcount, error in results:
+                if future.done():
+                    continue
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(rowcount)
+
+    async def close(self):
+        if self.writer_task:
+            if not self.writer_task.done():
+                await self.write_queue.put(None)
+                await self.writer_task
+            self.writer_task = None
+        if self.readers:
+            while not self.readers.empty():
+                await self.readers.get_nowait().close()
+            self.readers = None
+        await super().close()
+
 class DBManager:
     _instance = None
     _backend = None
+    _prepared = {}  # {statement key: query text ready for the active backend}
+
+    # Named statements used on hot paths, invoked by key via fetch_named/fetchrow_named/execute_named.
+    # A value is either one query for both backends or a (postgres, sqlite) pair.
+    # Texts are resolved once in init(); SQLite then reuses its compiled statement per connection
+    # and asyncpg its prepared statement per connection (both are cached by query text).
+    STATEMENTS = {
+        # servers
+        "server_by_ip": "SELECT id, name, ip_address, player_count, availability FROM servers WHERE ip_address = $1",
+        "servers_all": "SELECT id, name, ip_address, player_count, availability FROM servers ORDER BY id ASC",
+        "server_inc_players": """
+            UPDATE servers
+            SET player_count = player_count + 1,
+                availability = CASE
+                    WHEN player_count + 1 >= 640 THEN 2
+                    WHEN player_count + 1 >= 320 THEN 1
+                    ELSE 0
+                END
+            WHERE id = $1
+        """,
+        "server_dec_players": ("""
+            UPDATE servers
+            SET player_count = GREATEST(player_count - 1, 0),
+                availability = CASE
+                    WHEN GREATEST(player_count - 1, 0) >= 640 THEN 2
+                    WHEN GREATEST(player_count - 1, 0) >= 320 THEN 1
+                    ELSE 0
+                END
+            WHERE id = $1
+        """, """
+            UPDATE servers
+            SET player_count = MAX(player_count - 1, 0),
+                availability = CASE
+                    WHEN MAX(player_count - 1, 0) >= 640 THEN 2
+                    WHEN MAX(player_count - 1, 0) >= 320 THEN 1
+                    ELSE 0
+                END
+            WHERE id = $1
+        """),
+        # players
+        "player_load": "SELECT id, player_id, password, rank, created_at FROM players WHERE player_id = $1",
+        "player_insert": (
+            "INSERT INTO players (player_id, password, rank) VALUES ($1, $2, $3) RETURNING id, player_id, password, rank, created_at",
+            "INSERT INTO players (player_id, password, rank) VALUES ($1, $2, $3)"
+        ),
+        "player_delete": "DELETE FROM players WHERE player_id = $1",
+        "player_add_rank": (
+            "UPDATE players SET rank = LEAST(rank + $1, $2) WHERE player_id = $3",
+            "UPDATE players SET rank = MIN(rank + $1, $2) WHERE player_id = $3"
+        ),
+        # channels
+        "channel_db_id": "SELECT id FROM channels WHERE server_id = $1 AND channel_index = $2",
+        "channels_for_server": "SELECT id, server_id, channel_index, player_count FROM channels WHERE server_id = $1 ORDER BY channel_index ASC",
+        "channel_get": "SELECT id, server_id, channel_index, player_count FROM channels WHERE server_id = $1 AND channel_index = $2",
+        "channel_inc_players": (
+            "UPDATE channels SET player_count = LEAST(player_count + 1, 80) WHERE server_id = $1 AND channel_index = $2",
+            "UPDATE channels SET player_count = MIN(player_count + 1, 80) WHERE server_id = $1 AND channel_index = $2"
+        ),
+        "channel_dec_players": (
+            "UPDATE channels SET player_count = GREATEST(player_count - 1, 0) WHERE server_id = $1 AND channel_index = $2",
+            "UPDATE channels SET player_count = MAX(player_count - 1, 0) WHERE server_id = $1 AND channel_index = $2"
+        ),
+    }
+
+    @classmethod
+    def register(cls, key, query, sqlite_query=None):
+        """Register a named statement (before init()). sqlite_query overrides the text for SQLite."""
+        cls.STATEMENTS[key] = (query, sqlite_query) if sqlite_query else query
+
+    @classmethod
+    def _prepare_statements(cls, dbtype):
+        cls._prepared = {}
+        for key, query in cls.STATEMENTS.items():
+            if isinstance(query, tuple):
+                query = query[0] if dbtype == "postgres" else query[1]
+            cls._prepared[key] = cls._backend.prepare(query)
+
+    @classmethod
+    def sql(cls, key):
+        """Return the backend-ready text of a named statement."""
+        return cls._prepared[key]
 
     @classmethod
     async def init(cls, dsn=None, dbtype="postgres", sqlite_file=None, schema_file="mn_sqlite_schema.sql"):
@@ -195,10 +511,13 @@ class DBManager:
             await cls._backend.connect()
         elif dbtype == "sqlite":
             # Use SQLiteDB.init so schema gets created if missing
-            cls._backend = await SQLiteDB.init(db_file=sqlite_file or "mysticnights.db", schema_file=schema_file)
+            # Processes sharing one file (workers, cluster nodes) need its separate read/write connections
+            backend_cls = SQLiteBatchedDB if SQLITE_BATCHED or WORKERS > 1 or NODE_SERVERS else SQLiteDB
+            cls._backend = await backend_cls.init(db_file=sqlite_file or "mysticnights.db", schema_file=schema_file)
         else:
             raise ValueError(f"Unknown dbtype: {dbtype}")
         cls._instance = cls._backend
+        cls._prepare_statements(dbtype)
 
     @classmethod
     def instance(cls):
@@ -215,6 +534,18 @@ class DBManager:
     async def execute(cls, query, *args):
         return await cls._instance.execute(query, *args)
     @classmethod
+    async def execute_batch(cls, statements):
+        return await cls._instance.execute_batch(statements)
+    @classmethod
+    async def fetch_named(cls, key, *args):
+        return await cls._instance.fetch(cls._prepared[key], *args)
+    @classmethod
+    async def fetchrow_named(cls, key, *args):
+        return await cls._instance.fetchrow(cls._prepared[key], *args)
+    @classmethod
+    async def execute_named(cls, key, *args):
+        return await cls._instance.execute(cls._prepared[key], *args)
+    @classmethod
     async def close(cls):
         await cls._instance.close()
 
@@ -245,10 +576,7 @@ class ServerManager:
     @classmethod
     async def get_server_by_ip(cls, ip_address):
         print("get_server_by_ip:", repr(ip_address), type(ip_address))
-        row = await DBManager.fetchrow(
-            "SELECT id, name, ip_address, player_count, availability FROM servers WHERE ip_address = $1",
-            ip_address
-        )
+        row = await DBManager.fetchrow_named("server_by_ip", ip_address)
         return Server.from_row(row) if row else None
 
     @classmethod
@@ -258,9 +586,11 @@ class ServerManager:
 
     @classmethod
     async def get_servers(cls):
-        rows = await DBManager.fetch(
-            "SELECT id, name, ip_address, player_count, availability FROM servers ORDER BY id ASC"
-        )
+        if NODE_SERVERS:
+            # Cluster mode: availability is live, servers without a heartbeating node are offline
+            rows = await DBManager.fetch_named("servers_live", time.time() - NODE_TIMEOUT)
+        else:
+            rows = await DBManager.fetch_named("servers_all")
         return [Server.from_row(row) for row in rows]
 
     @classmethod
@@ -277,41 +607,13 @@ class ServerManager:
     
     @classmethod
     async def increment_player_count(cls, server_id):
-        await DBManager.execute("""
-            UPDATE servers 
-            SET player_count = player_count + 1,
-                availability = CASE 
-                    WHEN player_count + 1 >= 640 THEN 2
-                    WHEN player_count + 1 >= 320 THEN 1
-                    ELSE 0
-                END
-            WHERE id = $1
-        """, server_id)
+        await DBManager.execute_named("server_inc_players", server_id)
+        ListPacketCache.invalidate(ListPacketCache.SERVERS)
     
     @classmethod
     async def decrement_player_count(cls, server_id):
-        if dbtype == "postgres":
-            await DBManager.execute("""
-                UPDATE servers 
-                SET player_count = GREATEST(player_count - 1, 0),
-                    availability = CASE 
-                        WHEN GREATEST(player_count - 1, 0) >= 640 THEN 2
-                        WHEN GREATEST(player_count - 1, 0) >= 320 THEN 1
-                        ELSE 0
-                    END
-                WHERE id = $1
-            """, server_id)
-        else: # sqlite
-            await DBManager.execute("""
-                UPDATE servers 
-                SET player_count = MAX(player_count - 1, 0),
-                    availability = CASE 
-                        WHEN MAX(player_count - 1, 0) >= 640 THEN 2
-                        WHEN MAX(player_count - 1, 0) >= 320 THEN 1
-                        ELSE 0
-                    END
-                WHERE id = ?
-            """, server_id)
+        await DBManager.execute_named("server_dec_players", server_id)
+        ListPacketCache.invalidate(ListPacketCache.SERVERS)
 
     @classmethod
     async def init_server(cls):
@@ -336,6 +638,89 @@ class ServerManager:
             deleted = '?'
         print(f"[INIT] Cleared {deleted} non-TestRoom lobbies from database.")
 
+    @classmethod
+    async def reset_server(cls, server_id):
+        """init_server for a single servers row (cluster mode: other nodes' rows stay untouched)."""
+        await DBManager.execute(
+            "DELETE FROM lobbies WHERE name NOT LIKE $1 AND channel_id IN (SELECT id FROM channels WHERE server_id = $2)",
+            '%Test%', server_id)
+        await DBManager.execute("UPDATE servers SET player_count = 0, availability = 0 WHERE id = $1", server_id)
+        await DBManager.execute("UPDATE channels SET player_count = 0 WHERE server_id = $1", server_id)
+
+class ClusterManager:
+    """
+    Cluster mode (NODE_SERVERS): several nodes share one database, each serving some of
+    the servers rows. A node registers its rows in the nodes table and heartbeats them;
+    player counts are the shared servers/channels counters, so the server list built by
+    any node shows every node's load, and rows with no live node show as offline.
+    """
+    CREATE_SQL = """
+        CREATE TABLE IF NOT EXISTS nodes (
+            server_id INTEGER PRIMARY KEY REFERENCES servers(id),
+            node_id TEXT NOT NULL,
+            host TEXT NOT NULL,
+            last_seen DOUBLE PRECISION NOT NULL
+        )
+    """
+    CREATE_DIRECTORY_SQL = """
+        CREATE TABLE IF NOT EXISTS player_sessions (
+            player_id TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            lease_until DOUBLE PRECISION NOT NULL
+        )
+    """
+    DBManager.register("node_get", "SELECT node_id, last_seen FROM nodes WHERE server_id = $1")
+    DBManager.register("node_upsert", """
+        INSERT INTO nodes (server_id, node_id, host, last_seen) VALUES ($1, $2, $3, $4)
+        ON CONFLICT (server_id) DO UPDATE SET node_id = excluded.node_id, host = excluded.host, last_seen = excluded.last_seen
+    """)
+    DBManager.register("node_heartbeat", "UPDATE nodes SET last_seen = $1 WHERE node_id = $2")
+    DBManager.register("node_leave", "UPDATE nodes SET last_seen = 0 WHERE node_id = $1")
+    DBManager.register("servers_live", """
+        SELECT s.id, s.name, s.ip_address, s.player_count,
+               CASE WHEN n.last_seen >= $1 THEN s.availability ELSE -1 END AS availability
+        FROM servers s LEFT JOIN nodes n ON n.server_id = s.id
+        ORDER BY s.id ASC
+    """)
+
+    server_ids = []  # This node's servers rows (set by register; workers inherit it for ShardManager.reclaim_channels)
+
+    @classmethod
+    async def register(cls):
+        """Claim this node's servers rows and reset their counts and lobbies. Call once on startup."""
+        await DBManager.execute(cls.CREATE_SQL)
+        await DBManager.execute(cls.CREATE_DIRECTORY_SQL)
+        await DBManager.execute("CREATE INDEX IF NOT EXISTS idx_player_sessions_owner ON player_sessions(owner)")
+        by_name = {server.name: server for server in await ServerManager.get_servers()}
+        unknown = [name for name in NODE_SERVERS if name not in by_name]
+        if unknown:
+            raise RuntimeError(f"MN_NODE_SERVERS lists unknown servers: {', '.join(unknown)}")
+        now = time.time()
+        # Check every row before resetting any, so a refused node leaves all of them untouched
+        for name in NODE_SERVERS:
+            row = await DBManager.fetchrow_named("node_get", by_name[name].id)
+            if row and row['node_id'] != NODE_ID and row['last_seen'] >= now - NODE_TIMEOUT:
+                raise RuntimeError(f"{name} is already served by live node {row['node_id']}")
+        cls.server_ids = [by_name[name].id for name in NODE_SERVERS]
+        for server_id in cls.server_ids:
+            await ServerManager.reset_server(server_id)
+            await DBManager.execute_named("node_upsert", server_id, NODE_ID, HOST, now)
+        builtins.print(f"[CLUSTER] Node {NODE_ID} serving {', '.join(NODE_SERVERS)}")
+
+    @classmethod
+    async def run_heartbeat(cls):
+        while True:
+            await asyncio.sleep(NODE_HEARTBEAT_INTERVAL)
+            try:
+                await DBManager.execute_named("node_heartbeat", time.time(), NODE_ID)
+            except Exception as e:
+                print(f"[CLUSTER] Heartbeat failed: {e}")
+
+    @classmethod
+    async def leave(cls):
+        """Mark this node's servers offline right away instead of waiting for NODE_TIMEOUT."""
+        await DBManager.execute_named("node_leave", NODE_ID)
+
 class Player:
     def __init__(self, id, player_id, password, rank=1, created_at=None):
         self.id = id
@@ -392,6 +777,10 @@ class Lobby:
         self.player_ids = [player1_id, player2_id, player3_id, player4_id]
         self.player_characters = [player1_character, player2_character, player3_character, player4_character]
         self.player_statuses = [player1_status, player2_status, player3_status, player4_status]
+        self.deleted = False  # Set by LobbyStateEngine.delete()
+        self.version = 0  # Bumped on every mutation (LobbyStateEngine.touch)
+        self.room_packet = None  # Memoized 0x03ee: ((version, rank_epoch), bytes)
+        self.rank_key = None  # (average member rank, seq) while listed by RankMatchmaker
 
     @classmethod
     def from_row(cls, row):
@@ -412,16 +801,56 @@ class Lobby:
             player4_id=row.get('player4_id'), player4_character=row.get('player4_character'), player4_status=row.get('player4_status')
         )
 
+    def db_values(self):
+        """Column values in LobbyStateEngine.COLUMNS order."""
+        values = [self.channel_id, self.idx_in_channel, self.name, self.password,
+                  self.player_count, self.status, self.map, self.leader]
+        for i in range(4):
+            values += [self.player_ids[i], self.player_characters[i], self.player_statuses[i]]
+        return tuple(values)
+
     def as_short_tuple(self):
         """Used for lobby list: returns (idx_in_channel, player_count, name, password, status)"""
         return (self.idx_in_channel, self.player_count, self.name, self.password, self.status)
 
 
 class PlayerManager:
+    # Player profile cache used to build lobby room packets without querying ranks.
+    # Filled at login and channel join, updated in place on rank change, dropped when the account is deleted
+    # or the player's last local session disconnects.
+    _cache = {}  # {player_id: Player}
+    rank_epoch = 0  # Bumped on every rank change so memoized room packets get rebuilt
+
+    @classmethod
+    def cache_player(cls, player):
+        cached = cls._cache.get(player.player_id)
+        if cached is not None and cached.rank != player.rank:
+            cls.rank_epoch += 1
+        cls._cache[player.player_id] = player
+
+    @classmethod
+    def invalidate(cls, player_id):
+        cls._cache.pop(player_id, None)
+        cls.rank_epoch += 1
+
+    @classmethod
+    def cached_rank(cls, player_id):
+        """Rank from the profile cache without touching the database, or None if not cached."""
+        player = cls._cache.get(player_id)
+        return player.rank if player else None
+
+    @classmethod
+    async def get_cached_player(cls, player_id):
+        player = cls._cache.get(player_id)
+        if player is None:
+            player = await cls.load_player_from_db(player_id)
+            if player:
+                cls._cache[player_id] = player
+        return player
+
     @classmethod
     async def load_player_from_db(cls, player_id):
-        query = "SELECT id, player_id, password, rank, created_at FROM players WHERE player_id = $1"
-        row = await DBManager.fetchrow(query, player_id)
+        row = await DBManager.fetchrow_named("player_load", player_id)
         if row:
             return Player.from_row(row)
         return None
@@ -429,30 +858,20 @@ class PlayerManager:
     @classmethod
     async def create_player(cls, player_id, password, rank=1):
         if dbtype == "postgres":
-            query = """
-                INSERT INTO players (player_id, password, rank) 
-                VALUES ($1, $2, $3)
-                RETURNING id, player_id, password, rank, created_at
-            """
-            row = await DBManager.fetchrow(query, player_id, password, rank)
+            row = await DBManager.fetchrow_named("player_insert", player_id, password, rank)
         else:  # Assume SQLite
-            insert_query = """
-                INSERT INTO players (player_id, password, rank) 
-                VALUES (?, ?, ?)
-            """
-            await DBManager.execute(insert_query, player_id, password, rank)
+            await DBManager.execute_named("player_insert", player_id, password, rank)
             # Now get the last inserted row (SQLite only)
-            query = "SELECT id, player_id, password, rank, created_at FROM players WHERE player_id = ?"
-            row = await DBManager.fetchrow(query, player_id)
+            row = await DBManager.fetchrow_named("player_load", player_id)
         if row:
             return Player.from_row(row)
         return None
 
     @classmethod
     async def remove_player(cls, player_id):
-        query = "DELETE FROM players WHERE player_id = $1"
         try:
-            await DBManager.execute(query, player_id)
+            await DBManager.execute_named("player_delete", player_id)
+            cls.invalidate(player_id)
             return True
         except Exception as e:
             # Optionally log error here
@@ -460,47 +879,37 @@ class PlayerManager:
 
     @classmethod
     async def add_rank_points(cls, player_id, points, max_rank=199):
-        if dbtype == "postgres":
-            query = """
-                UPDATE players 
-                SET rank = LEAST(rank + $1, $2)
-                WHERE player_id = $3
-            """
-            await DBManager.execute(query, points, max_rank, player_id)
-        else:  # SQLite
-            query = """
-                UPDATE players 
-                SET rank = MIN(rank + ?, ?)
-                WHERE player_id = ?
-            """
-            await DBManager.execute(query, points, max_rank, player_id)
+        await DBManager.execute_named("player_add_rank", points, max_rank, player_id)
+        player = cls._cache.get(player_id)
+        if player:
+            # Same capped update as the statement; keeps the rank cached for matchmaking
+            player.rank = min(player.rank + points, max_rank)
+        cls.rank_epoch += 1
 
 class ChannelManager:
+    _db_ids = {}  # {(server_id, channel_index): channels.id}; channel rows are seeded and never renumbered
+
     @classmethod
     async def get_channel_db_id(cls, server_id, channel_index):
         """Returns the primary key (id) in channels table for a given server_id and channel_index."""
-        row = await DBManager.fetchrow(
-            "SELECT id FROM channels WHERE server_id = $1 AND channel_index = $2",
-            server_id, channel_index
-        )
-        return row['id'] if row else None
+        channel_db_id = cls._db_ids.get((server_id, channel_index))
+        if channel_db_id is None:
+            row = await DBManager.fetchrow_named("channel_db_id", server_id, channel_index)
+            if not row:
+                return None
+            channel_db_id = cls._db_ids[(server_id, channel_index)] = row['id']
+        return channel_db_id
 
     @classmethod
     async def get_channels_for_server(cls, server_id):
         """Return a list of Channel objects for this server_id."""
-        rows = await DBManager.fetch(
-            "SELECT id, server_id, channel_index, player_count FROM channels WHERE server_id = $1 ORDER BY channel_index ASC",
-            server_id
-        )
+        rows = await DBManager.fetch_named("channels_for_server", server_id)
         return [Channel.from_row(row) for row in rows]
 
     @classmethod
     async def get_channel(cls, server_id, channel_index):
         """Return Channel object for a given server_id and channel_index."""
-        row = await DBManager.fetchrow(
-            "SELECT id, server_id, channel_index, player_count FROM channels WHERE server_id = $1 AND channel_index = $2;",
-            server_id, channel_index
-        )
+        row = await DBManager.fetchrow_named("channel_get", server_id, channel_index)
         return Channel.from_row(row) if row else None
 
     @classmethod
@@ -524,97 +933,350 @@ class ChannelManager:
 
     @classmethod
     async def increment_player_count(cls, server_id, channel_index):
-        if dbtype == "postgres":
-            await DBManager.execute("""
-                UPDATE channels 
-                SET player_count = LEAST(player_count + 1, 80) 
-                WHERE server_id = $1 AND channel_index = $2;
-            """, server_id, channel_index)
-        else: # sqlite
-            await DBManager.execute("""
-                UPDATE channels 
-                SET player_count = MIN(player_count + 1, 80) 
-                WHERE server_id = ? AND channel_index = ?;
-            """, server_id, channel_index)
+        await DBManager.execute_named("channel_inc_players", server_id, channel_index)
+        ListPacketCache.invalidate(('channels', server_id))
 
     @classmethod
     async def decrement_player_count(cls, server_id, channel_index):
+        await DBManager.execute_named("channel_dec_players", server_id, channel_index)
+        ListPacketCache.invalidate(('channels', server_id))
+
+class ListPacketCache:
+    """
+    Prebuilt server list (0x0bc7) and per-server channel list (0x0bbb) packets.
+    ServerManager/ChannelManager count updates mark a list stale; a stale list is rebuilt on
+    the next request, at most once per LIST_DEBOUNCE seconds. When other processes share the
+    counts (MN_WORKERS, cluster nodes) a list is also rebuilt once it is LIST_TTL seconds old.
+    """
+    SERVERS = 'servers'
+    _packets = {}  # {SERVERS or ('channels', server_id): (monotonic build time, packet)}
+    _stale = set()
+
+    @classmethod
+    def invalidate(cls, key):
+        cls._stale.add(key)
+
+    @classmethod
+    async def server_list(cls):
+        return await cls._get(cls.SERVERS, build_server_list_packet)
+
+    @classmethod
+    async def channel_list(cls, server_id):
+        return await cls._get(('channels', server_id), functools.partial(build_channel_list_packet, server_id))
+
+    @classmethod
+    async def _get(cls, key, build):
+        now = time.monotonic()
+        cached = cls._packets.get(key)
+        if cached:
+            age = now - cached[0]
+            if key in cls._stale:
+                if age < LIST_DEBOUNCE:
+                    return cached[1]
+            elif not (WORKERS > 1 or NODE_SERVERS) or age < LIST_TTL:
+                return cached[1]
+        # Changes made while the list is being built mark it stale again
+        cls._stale.discard(key)
+        packet = await build()
+        cls._packets[key] = (now, packet)
+        return packet
+
+
+class LobbyStateEngine:
+    """
+    Write-behind store for lobby state. The in-memory Lobby objects are the source of truth;
+    mutations only mark a lobby dirty and the flusher persists them to the lobbies table in
+    coalesced batches every LOBBY_FLUSH_INTERVAL seconds (and on shutdown).
+    """
+    _by_channel = {}     # {channel_db_id: {idx_in_channel: Lobby}}
+    _versions = {}       # {channel_db_id: int} bumped on every change to that channel's lobbies
+    _dirty = set()       # Lobby objects to INSERT/UPDATE on next flush
+    _deleted_ids = set() # lobbies.id rows to DELETE on next flush
+    _flush_lock = asyncio.Lock()
+
+    COLUMNS = (
+        "channel_id, idx_in_channel, name, password, player_count, status, map, leader, "
+        "player1_id, player1_character, player1_status, "
+        "player2_id, player2_character, player2_status, "
+        "player3_id, player3_character, player3_status, "
+        "player4_id, player4_character, player4_status"
+    )
+    INSERT_SQL = f"INSERT INTO lobbies ({COLUMNS}) VALUES ({', '.join(f'${i}' for i in range(1, 21))})"
+    UPDATE_SQL = "UPDATE lobbies SET " + ", ".join(
+        f"{col.strip()} = ${i}" for i, col in enumerate(COLUMNS.split(","), 1)
+    ) + " WHERE id = $21"
+    DBManager.register("lobby_insert", INSERT_SQL + " RETURNING id", INSERT_SQL)
+    DBManager.register("lobby_update", UPDATE_SQL)
+    DBManager.register("lobby_delete", "DELETE FROM lobbies WHERE id = $1")
+    DBManager.register(
+        "lobby_last_id", "SELECT id FROM lobbies WHERE channel_id = $1 AND idx_in_channel = $2 ORDER BY id DESC"
+    )
+
+    @classmethod
+    async def load(cls):
+        """Load all lobbies from the database. Call once on startup, after ServerManager.init_server()."""
+        rows = await DBManager.fetch(f"SELECT id, {cls.COLUMNS} FROM lobbies ORDER BY channel_id ASC, idx_in_channel ASC")
+        for channel_db_id in cls._by_channel:
+            cls._bump(channel_db_id)
+        cls._by_channel = {}
+        JoinableIndex.clear()
+        for row in rows:
+            lobby = Lobby.from_row(row)
+            cls._by_channel.setdefault(lobby.channel_id, {})[lobby.idx_in_channel] = lobby
+            cls._bump(lobby.channel_id)
+            JoinableIndex.update(lobby)
+        print(f"[INIT] Loaded {len(rows)} lobbies into memory.")
+
+    @classmethod
+    def channel(cls, channel_db_id):
+        """Return {idx_in_channel: Lobby} for a channel (live objects, do not mutate directly)."""
+        return cls._by_channel.get(channel_db_id, {})
+
+    @classmethod
+    def channel_version(cls, channel_db_id):
+        return cls._versions.get(channel_db_id, 0)
+
+    @classmethod
+    def _bump(cls, channel_db_id):
+        cls._versions[channel_db_id] = cls._versions.get(channel_db_id, 0) + 1
+
+    @classmethod
+    def add(cls, lobby):
+        cls._by_channel.setdefault(lobby.channel_id, {})[lobby.idx_in_channel] = lobby
+        cls.touch(lobby)
+
+    @classmethod
+    def delete(cls, lobby):
+        channel = cls._by_channel.get(lobby.channel_id, {})
+        if channel.get(lobby.idx_in_channel) is lobby:
+            del channel[lobby.idx_in_channel]
+        lobby.deleted = True
+        cls._bump(lobby.channel_id)
+        JoinableIndex.update(lobby)
+        cls._dirty.discard(lobby)
+        if lobby.id is not None:
+            cls._deleted_ids.add(lobby.id)
+
+    @classmethod
+    def touch(cls, lobby):
+        """Mark a lobby as modified so that the next flush persists it."""
+        lobby.version += 1
+        cls._bump(lobby.channel_id)
+        cls._dirty.add(lobby)
+        JoinableIndex.update(lobby)
+
+    @classmethod
+    async def flush(cls):
+        async with cls._flush_lock:
+            deleted, cls._deleted_ids = cls._deleted_ids, set()
+            dirty, cls._dirty = cls._dirty, set()
+            if not deleted and not dirty:
+                return
+            # Snapshot row values now; the lobbies may keep changing while we await the DB
+            statements = [(DBManager.sql("lobby_delete"), (lobby_id,)) for lobby_id in deleted]
+            inserts = []
+            for lobby in dirty:
+                if lobby.id is None:
+                    inserts.append((lobby, lobby.db_values()))
+                else:
+                    statements.append((DBManager.sql("lobby_update"), lobby.db_values() + (lobby.id,)))
+            try:
+                await DBManager.execute_batch(statements)
+            except Exception as e:
+                print(f"[LOBBY FLUSH ERROR] {e}")
+                cls._deleted_ids |= deleted
+                cls._dirty |= dirty
+                return
+            for lobby, values in inserts:
+                try:
+                    lobby.id = await cls._insert(values)
+                except Exception as e:
+                    print(f"[LOBBY FLUSH ERROR] Insert of lobby '{lobby.name}' failed: {e}")
+                    cls._dirty.add(lobby)
+                    continue
+                # Lobby was removed while its INSERT was in flight
+                if lobby.deleted:
+                    cls._deleted_ids.add(lobby.id)
+            print(f"[LOBBY FLUSH] {len(deleted)} deleted, {len(dirty)} written.")
+
+    @classmethod
+    async def _insert(cls, values):
         if dbtype == "postgres":
-            query = "UPDATE channels SET player_count = GREATEST(player_count - 1, 0) WHERE server_id = $1 AND channel_index = $2;"
-        else:  # SQLite
-            query = "UPDATE channels SET player_count = MAX(player_count - 1, 0) WHERE server_id = ? AND channel_index = ?;"
-        await DBManager.execute(query, server_id, channel_index)
+            row = await DBManager.fetchrow_named("lobby_insert", *values)
+        else:  # sqlite
+            await DBManager.execute_named("lobby_insert", *values)
+            row = await DBManager.fetchrow_named("lobby_last_id", values[0], values[1])
+        return row['id']
 
+    @classmethod
+    async def run_flusher(cls):
+        while True:
+            await asyncio.sleep(LOBBY_FLUSH_INTERVAL)
+            await cls.flush()
+
+def pick_random_lobby(channel_db_id, player_id):
+    return random.choice(JoinableIndex.lobbies(channel_db_id))
+
+def pick_fullest_lobby(channel_db_id, player_id):
+    """Fill lobbies up first so games start sooner (random among equally full ones)."""
+    lobbies = JoinableIndex.lobbies(channel_db_id)
+    most = max(lobby.player_count for lobby in lobbies)
+    return random.choice([lobby for lobby in lobbies if lobby.player_count == most])
+
+class RankMatchmaker:
+    """
+    Rank-aware quick join. Each channel's joinable lobbies are kept sorted by their members'
+    average rank (from the PlayerManager profile cache), so picking the closest match to the
+    requester's rank is a bisect, with no lobby or rank reads from the database.
+    JoinableIndex calls update() whenever a lobby changes.
+    """
+    _keys = {}     # {channel_db_id: sorted [(average rank, seq)]}
+    _lobbies = {}  # {(average rank, seq): Lobby}
+    _seq = itertools.count()
+
+    @staticmethod
+    def average_rank(lobby):
+        ranks = [PlayerManager.cached_rank(pid) for pid in lobby.player_ids if pid]
+        ranks = [rank for rank in ranks if rank is not None]
+        return sum(ranks) / len(ranks) if ranks else 1
+
+    @classmethod
+    def clear(cls):
+        cls._keys = {}
+        cls._lobbies = {}
+
+    @classmethod
+    def update(cls, lobby, joinable):
+        key = None
+        if joinable:
+            seq = lobby.rank_key[1] if lobby.rank_key else next(cls._seq)
+            key = (cls.average_rank(lobby), seq)
+        if key == lobby.rank_key:
+            return
+        keys = cls._keys.setdefault(lobby.channel_id, [])
+        if lobby.rank_key is not None:
+            del keys[bisect.bisect_left(keys, lobby.rank_key)]
+            del cls._lobbies[lobby.rank_key]
+        if key is not None:
+            bisect.insort(keys, key)
+            cls._lobbies[key] = lobby
+        lobby.rank_key = key
+
+    @classmethod
+    def pick(cls, channel_db_id, player_id):
+        """Joinable lobby whose average member rank is closest to player_id's rank."""
+        keys = cls._keys.get(channel_db_id)
+        if not keys:
+            return None
+        rank = PlayerManager.cached_rank(player_id) or 1
+        i = bisect.bisect_left(keys, (rank,))
+        # The closest average is one of the two neighbours of the insertion point
+        candidates = keys[max(i - 1, 0):i + 1]
+        return cls._lobbies[min(candidates, key=lambda key: abs(key[0] - rank))]
+
+class JoinableIndex:
+    """
+    Per-channel pool of quick join candidates: public lobbies with fewer than 4 players
+    and status 1 (waiting). LobbyStateEngine updates it on every add/touch/delete, so a
+    quick join neither scans the channel's lobbies nor reads the database.
+    Each pool is a list plus a position map, so updates and random picks are O(1).
+    """
+    _pools = {}  # {channel_db_id: ([Lobby], {Lobby: position in list})}
+    # Selection policies: fn(channel_db_id, requesting player_id) -> Lobby (only called with a non-empty pool)
+    policies = {
+        "random": pick_random_lobby,
+        "fullest": pick_fullest_lobby,
+        "rank_closest": RankMatchmaker.pick,
+    }
+
+    @staticmethod
+    def is_joinable(lobby):
+        return not lobby.deleted and not lobby.password and lobby.player_count < 4 and lobby.status == 1
+
+    @classmethod
+    def clear(cls):
+        cls._pools = {}
+        RankMatchmaker.clear()
+
+    @classmethod
+    def update(cls, lobby):
+        """Add or drop a lobby after it changed."""
+        lobbies, positions = cls._pools.setdefault(lobby.channel_id, ([], {}))
+        joinable = cls.is_joinable(lobby)
+        RankMatchmaker.update(lobby, joinable)
+        if joinable:
+            if lobby not in positions:
+                positions[lobby] = len(lobbies)
+                lobbies.append(lobby)
+        elif lobby in positions:
+            # Swap-remove: move the last entry into the freed position
+            pos = positions.pop(lobby)
+            last = lobbies.pop()
+            if last is not lobby:
+                lobbies[pos] = last
+                positions[last] = pos
+
+    @classmethod
+    def lobbies(cls, channel_db_id):
+        return cls._pools.get(channel_db_id, ([], {}))[0]
+
+    @classmethod
+    def pick(cls, channel_db_id, player_id, policy=None):
+        """Choose a lobby for player_id with the given (default QUICK_JOIN_POLICY) policy, or None."""
+        lobbies = cls.lobbies(channel_db_id)
+        if not lobbies:
+            return None
+        return cls.policies.get(policy or QUICK_JOIN_POLICY, pick_random_lobby)(channel_db_id, player_id)
 
 class LobbyManager:
+    # Lobby state lives in LobbyStateEngine; these methods never wait on the database.
+    @classmethod
+    def _find_player_lobby(cls, channel_db_id, player_id):
+        channel = LobbyStateEngine.channel(channel_db_id)
+        for idx in sorted(channel):
+            if player_id in channel[idx].player_ids:
+                return channel[idx]
+        return None
+
+    @classmethod
+    def _clear_slot(cls, lobby, idx):
+        lobby.player_ids[idx] = None
+        lobby.player_characters[idx] = None
+        lobby.player_statuses[idx] = None
+        lobby.player_count = max(lobby.player_count - 1, 0)
+
     @classmethod
     async def get_lobbies_for_channel(cls, channel_db_id):
-        rows = await DBManager.fetch("""
-            SELECT id, channel_id, idx_in_channel, name, password, player_count, status, map, leader,
-                   player1_id, player1_character, player1_status,
-                   player2_id, player2_character, player2_status,
-                   player3_id, player3_character, player3_status,
-                   player4_id, player4_character, player4_status
-            FROM lobbies
-            WHERE channel_id = $1
-            ORDER BY idx_in_channel ASC
-        """, channel_db_id)
-        return [Lobby.from_row(row) for row in rows]
+        channel = LobbyStateEngine.channel(channel_db_id)
+        return [channel[idx] for idx in sorted(channel)]
 
     @classmethod
     async def get_lobby_by_name(cls, lobby_name, channel_db_id):
-        row = await DBManager.fetchrow("""
-            SELECT id, channel_id, idx_in_channel, name, password, player_count, status, map, leader,
-                   player1_id, player1_character, player1_status,
-                   player2_id, player2_character, player2_status,
-                   player3_id, player3_character, player3_status,
-                   player4_id, player4_character, player4_status
-            FROM lobbies
-            WHERE name = $1 AND channel_id = $2
-        """, lobby_name, channel_db_id)
-        return Lobby.from_row(row) if row else None
+        for lobby in LobbyStateEngine.channel(channel_db_id).values():
+            if lobby.name == lobby_name:
+                return lobby
+        return None
 
     @classmethod
     async def set_player_character(cls, channel_db_id, player_id, character):
-        rows = await DBManager.fetch("""
-            SELECT id, player1_id, player2_id, player3_id, player4_id
-            FROM lobbies WHERE channel_id = $1
-        """, channel_db_id)
-        for row in rows:
-            lobby_id = row['id']
-            for idx, pid in enumerate([row['player1_id'], row['player2_id'], row['player3_id'], row['player4_id']], 1):
-                if pid == player_id:
-                    await DBManager.execute(
-                        f"UPDATE lobbies SET player{idx}_character=$1 WHERE id=$2",
-                        character, lobby_id
-                    )
-                    return True
-        return False
+        lobby = cls._find_player_lobby(channel_db_id, player_id)
+        if not lobby:
+            return False
+        lobby.player_characters[lobby.player_ids.index(player_id)] = character
+        LobbyStateEngine.touch(lobby)
+        return True
 
     @classmethod
     async def set_lobby_map(cls, channel_db_id, lobby_name, map_id):
-        await DBManager.execute(
-            "UPDATE lobbies SET map=$1 WHERE channel_id=$2 AND name=$3",
-            map_id, channel_db_id, lobby_name
-        )
+        lobby = await cls.get_lobby_by_name(lobby_name, channel_db_id)
+        if lobby:
+            lobby.map = map_id
+            LobbyStateEngine.touch(lobby)
 
     @classmethod
     async def get_lobby_name_for_player(cls, channel_db_id, player_id):
-        if dbtype == "postgres":
-            row = await DBManager.fetchrow(
-                """SELECT name FROM lobbies
-                   WHERE channel_id=$1 AND
-                   (player1_id=$2 OR player2_id=$2 OR player3_id=$2 OR player4_id=$2)""",
-                channel_db_id, player_id
-            )
-        else: # sqlite
-            row = await DBManager.fetchrow(
-                """SELECT name FROM lobbies
-                   WHERE channel_id=? AND
-                   (player1_id=? OR player2_id=? OR player3_id=? OR player4_id=?)""",
-                channel_db_id, player_id, player_id, player_id, player_id
-            )
-        return row['name'] if row else None
+        lobby = cls._find_player_lobby(channel_db_id, player_id)
+        return lobby.name if lobby else None
 
     @classmethod
     async def create_lobby_db(cls, lobby_name, password, channel_db_id, player_id):
@@ -631,12 +1293,11 @@ class LobbyManager:
             print(f"[ERROR] No more lobby slots available in channel {channel_db_id}")
             return False
 
-        await DBManager.execute(
-            """INSERT INTO lobbies
-               (channel_id, idx_in_channel, name, password, status, player1_id, player1_character, player1_status, player_count, leader, map)
-               VALUES ($1, $2, $3, $4, $5, $6, $7, $8, 1, $9, 1)
-            """, channel_db_id, idx_in_channel, lobby_name, password, 1, player_id, 1, 0, player_id
-        )
+        LobbyStateEngine.add(Lobby(
+            None, channel_db_id, idx_in_channel, lobby_name, password,
+            player_count=1, status=1, map=1, leader=player_id,
+            player1_id=player_id, player1_character=1, player1_status=0
+        ))
         print(f"[DB] Created lobby '{lobby_name}' in channel {channel_db_id} idx {idx_in_channel}")
         return True
 
@@ -646,30 +1307,22 @@ class LobbyManager:
         if not lobby:
             print(f"[ERROR] Lobby '{lobby_name}' not found in DB for add_player.")
             return False
-        player_slots = lobby.player_ids
         characters_taken = set(filter(None, lobby.player_characters))
         char_choices = {1,2,3,4,5,6,7,8} - characters_taken
         assigned_character = min(char_choices) if char_choices else 1
         assigned_status = 0  # "preparing"
-        for idx, slot in enumerate(player_slots, 1):
+        for idx, slot in enumerate(lobby.player_ids):
             if slot is None:
-                await DBManager.execute(
-                    f"""UPDATE lobbies
-                        SET player{idx}_id = $1,
-                            player{idx}_character = $2,
-                            player{idx}_status = $3,
-                            player_count = player_count + 1
-                        WHERE id = $4""",
-                    player_id, assigned_character, assigned_status, lobby.id
-                )
-                print(f"[DB] Added player {player_id} to lobby '{lobby_name}' (slot {idx}, char {assigned_character}).")
+                lobby.player_ids[idx] = player_id
+                lobby.player_characters[idx] = assigned_character
+                lobby.player_statuses[idx] = assigned_status
+                lobby.player_count += 1
+                print(f"[DB] Added player {player_id} to lobby '{lobby_name}' (slot {idx + 1}, char {assigned_character}).")
                 # Edge case: Assign leader if currently missing (should only happen if DB is altered from external source)
                 if not lobby.leader:
-                    await DBManager.execute(
-                        "UPDATE lobbies SET leader = $1 WHERE id = $2",
-                        player_id, lobby.id
-                    )
+                    lobby.leader = player_id
                     print(f"[LOBBY FIX] Lobby '{lobby_name}' had no leader — assigned {player_id} as new leader.")
+                LobbyStateEngine.touch(lobby)
                 return True
         print(f"[WARN] No empty player slot in lobby '{lobby_name}'")
         return False
@@ -677,197 +1330,80 @@ class LobbyManager:
     @classmethod
     async def remove_player_from_lobby_db(cls, player_id, channel_db_id=None):
         if channel_db_id is not None:
-            if dbtype == "postgres":
-                row = await DBManager.fetchrow("""
-                    SELECT id, idx_in_channel, player1_id, player2_id, player3_id, player4_id
-                    FROM lobbies
-                    WHERE channel_id = $1
-                      AND ($2 = ANY(ARRAY[player1_id, player2_id, player3_id, player4_id]))
-                """, channel_db_id, player_id)
-            else:  # SQLite
-                row = await DBManager.fetchrow("""
-                    SELECT id, idx_in_channel, player1_id, player2_id, player3_id, player4_id
-                    FROM lobbies
-                    WHERE channel_id = ?
-                      AND (player1_id = ? OR player2_id = ? OR player3_id = ? OR player4_id = ?)
-                """, channel_db_id, player_id, player_id, player_id, player_id)
+            lobby = cls._find_player_lobby(channel_db_id, player_id)
         else:
-            # This query works on both backends since it doesn't use ANY/ARRAY
-            row = await DBManager.fetchrow("""
-                SELECT id, idx_in_channel, player1_id, player2_id, player3_id, player4_id
-                FROM lobbies
-                WHERE player1_id = $1 OR player2_id = $1 OR player3_id = $1 OR player4_id = $1
-            """, player_id)
-        if not row:
+            lobby = None
+            for ch in sorted(LobbyStateEngine._by_channel):
+                lobby = cls._find_player_lobby(ch, player_id)
+                if lobby:
+                    break
+        if not lobby:
             print(f"[WARN] Player {player_id} not found in any lobby for removal.")
             return False
-        lobby_id, idx_in_channel, p1, p2, p3, p4 = (
-            row['id'], row['idx_in_channel'], row['player1_id'], row['player2_id'], row['player3_id'], row['player4_id']
-        )
-        for idx, slot in enumerate([p1, p2, p3, p4], 1):
-            if slot == player_id:
-                if dbtype == "postgres":
-                    await DBManager.execute(
-                        f"""UPDATE lobbies
-                            SET player{idx}_id = NULL,
-                                player{idx}_character = NULL,
-                                player{idx}_status = NULL,
-                                player_count = GREATEST(player_count - 1, 0)
-                            WHERE id = $1
-                        """, lobby_id
-                    )
-                else: # sqlite
-                    await DBManager.execute(
-                        f"""UPDATE lobbies
-                            SET player{idx}_id = NULL,
-                                player{idx}_character = NULL,
-                                player{idx}_status = NULL,
-                                player_count = MAX(player_count - 1, 0)
-                            WHERE id = ?
-                        """, lobby_id
-                    )
-                print(f"[DB] Removed player {player_id} from lobby (idx {idx_in_channel}).")
-                return True
-        return False
+        cls._clear_slot(lobby, lobby.player_ids.index(player_id))
+        LobbyStateEngine.touch(lobby)
+        print(f"[DB] Removed player {player_id} from lobby (idx {lobby.idx_in_channel}).")
+        return True
 
     @classmethod
     async def remove_player_and_update_leader(cls, player_id, channel_db_id):
-        # NOTE: thread locking must be done outside this method for asyncio!
-        if dbtype == "postgres":
-            row = await DBManager.fetchrow("""
-                SELECT id, name, leader,
-                       player1_id, player2_id, player3_id, player4_id
-                FROM lobbies
-                WHERE channel_id = $1 AND ($2 = ANY(ARRAY[player1_id, player2_id, player3_id, player4_id]))
-            """, channel_db_id, player_id)
-        else: #sqlite
-            row = await DBManager.fetchrow("""
-                SELECT id, name, leader,
-                       player1_id, player2_id, player3_id, player4_id
-                FROM lobbies
-                WHERE channel_id = ? AND
-                    (? = player1_id OR ? = player2_id OR ? = player3_id OR ? = player4_id)
-            """, channel_db_id, player_id, player_id, player_id, player_id)
-        if not row:
+        lobby = cls._find_player_lobby(channel_db_id, player_id)
+        if not lobby:
             return (None, False)
-        lobby_id, lobby_name, leader, p1, p2, p3, p4 = (
-            row['id'], row['name'], row['leader'],
-            row['player1_id'], row['player2_id'], row['player3_id'], row['player4_id']
-        )
-        player_slots = [p1, p2, p3, p4]
-        cleared = False
-        for idx, pid in enumerate(player_slots, 1):
+        for idx, pid in enumerate(lobby.player_ids):
             if pid == player_id:
-                if dbtype == "postgres":
-                    await DBManager.execute(
-                        f"""UPDATE lobbies
-                            SET player{idx}_id = NULL,
-                                player{idx}_character = NULL,
-                                player{idx}_status = NULL,
-                                player_count = GREATEST(player_count - 1, 0)
-                            WHERE id = $1
-                        """, lobby_id
-                    )
-                else: # sqlite
-                    await DBManager.execute(
-                        f"""UPDATE lobbies
-                            SET player{idx}_id = NULL,
-                                player{idx}_character = NULL,
-                                player{idx}_status = NULL,
-                                player_count = MAX(player_count - 1, 0)
-                            WHERE id = ?
-                        """, lobby_id
-                    )
-                cleared = True
-        if not cleared:
-            return (None, False)
-        # Reload updated slots and leader
-        row2 = await DBManager.fetchrow(
-            "SELECT leader, player1_id, player2_id, player3_id, player4_id FROM lobbies WHERE id=$1", lobby_id
-        )
-        leader, p1, p2, p3, p4 = row2['leader'], row2['player1_id'], row2['player2_id'], row2['player3_id'], row2['player4_id']
-        slots = [(1, p1), (2, p2), (3, p3), (4, p4)]
-        non_empty = [(i, pid) for i, pid in slots if pid]
+                cls._clear_slot(lobby, idx)
+        non_empty = [pid for pid in lobby.player_ids if pid]
         # If leader was removed or is now None, assign to lowest index remaining
-        if (leader == player_id) or (not leader) or (leader not in [pid for _, pid in non_empty]):
-            new_leader = non_empty[0][1] if non_empty else None
-            await DBManager.execute(
-                "UPDATE lobbies SET leader=$1 WHERE id=$2", new_leader, lobby_id
-            )
+        if (lobby.leader == player_id) or (not lobby.leader) or (lobby.leader not in non_empty):
+            lobby.leader = non_empty[0] if non_empty else None
         # If lobby is now empty, delete it
         if not non_empty:
-            await DBManager.execute("DELETE FROM lobbies WHERE id=$1", lobby_id)
-            print(f"[LOBBY DELETED] Lobby '{lobby_name}' deleted (was empty after player leave/disconnect).")
-            return (lobby_name, True)
-        return (lobby_name, False)
+            LobbyStateEngine.delete(lobby)
+            print(f"[LOBBY DELETED] Lobby '{lobby.name}' deleted (was empty after player leave/disconnect).")
+            return (lobby.name, True)
+        LobbyStateEngine.touch(lobby)
+        return (lobby.name, False)
 
     @classmethod
     async def is_player_in_lobby_db(cls, lobby_name, channel_db_id, player_id):
-        row = await DBManager.fetchrow("""
-            SELECT player1_id, player2_id, player3_id, player4_id
-            FROM lobbies
-            WHERE name = $1 AND channel_id = $2
-        """, lobby_name, channel_db_id)
-        if not row:
+        lobby = await cls.get_lobby_by_name(lobby_name, channel_db_id)
+        if not lobby:
             return False
-        return player_id in [row['player1_id'], row['player2_id'], row['player3_id'], row['player4_id']]
+        return player_id in lobby.player_ids
 
     @classmethod
     async def toggle_player_ready_in_lobby(cls, channel_db_id, lobby_name, player_id):
-        row = await DBManager.fetchrow("""
-            SELECT player1_id, player2_id, player3_id, player4_id,
-                   player1_status, player2_status, player3_status, player4_status
-            FROM lobbies WHERE name = $1 AND channel_id = $2
-        """, lobby_name, channel_db_id)
-        if not row:
+        lobby = await cls.get_lobby_by_name(lobby_name, channel_db_id)
+        if not lobby or player_id not in lobby.player_ids:
             return None
-        ids = [row['player1_id'], row['player2_id'], row['player3_id'], row['player4_id']]
-        statuses = [row['player1_status'], row['player2_status'], row['player3_status'], row['player4_status']]
-        for idx, pid in enumerate(ids):
-            if pid == player_id:
-                new_status = 0 if (statuses[idx] or 0) == 1 else 1
-                await DBManager.execute(
-                    f"UPDATE lobbies SET player{idx+1}_status = $1 WHERE name = $2 AND channel_id = $3",
-                    new_status, lobby_name, channel_db_id
-                )
-                return new_status
-        return None
+        idx = lobby.player_ids.index(player_id)
+        new_status = 0 if (lobby.player_statuses[idx] or 0) == 1 else 1
+        lobby.player_statuses[idx] = new_status
+        LobbyStateEngine.touch(lobby)
+        return new_status
 
     @classmethod
     async def set_player_not_ready(cls, player_id, channel_db_id, lobby_name):
-        if dbtype == "postgres":
-            await DBManager.execute("""
-                UPDATE lobbies
-                SET player1_status = CASE WHEN player1_id=$1 THEN 0 ELSE player1_status END,
-                    player2_status = CASE WHEN player2_id=$1 THEN 0 ELSE player2_status END,
-                    player3_status = CASE WHEN player3_id=$1 THEN 0 ELSE player3_status END,
-                    player4_status = CASE WHEN player4_id=$1 THEN 0 ELSE player4_status END
-                WHERE name = $2 AND channel_id = $3
-            """, player_id, lobby_name, channel_db_id)
-        else: #sqlite
-            await DBManager.execute("""
-                UPDATE lobbies
-                SET player1_status = CASE WHEN player1_id = ? THEN 0 ELSE player1_status END,
-                    player2_status = CASE WHEN player2_id = ? THEN 0 ELSE player2_status END,
-                    player3_status = CASE WHEN player3_id = ? THEN 0 ELSE player3_status END,
-                    player4_status = CASE WHEN player4_id = ? THEN 0 ELSE player4_status END
-                WHERE name = ? AND channel_id = ?
-            """, player_id, player_id, player_id, player_id, lobby_name, channel_db_id)
+        lobby = await cls.get_lobby_by_name(lobby_name, channel_db_id)
+        if not lobby:
+            return
+        for idx, pid in enumerate(lobby.player_ids):
+            if pid == player_id:
+                lobby.player_statuses[idx] = 0
+        LobbyStateEngine.touch(lobby)
 
     @classmethod
     async def set_lobby_status(cls, channel_db_id, lobby_name, status):
-        await DBManager.execute(
-            "UPDATE lobbies SET status=$1 WHERE name=$2 AND channel_id=$3",
-            status, lobby_name, channel_db_id
-        )
+        lobby = await cls.get_lobby_by_name(lobby_name, channel_db_id)
+        if lobby:
+            lobby.status = status
+            LobbyStateEngine.touch(lobby)
 
     @classmethod
     async def get_lobby_status(cls, channel_db_id, lobby_name):
-        row = await DBManager.fetchrow(
-            "SELECT status FROM lobbies WHERE name = $1 AND channel_id = $2",
-            lobby_name, channel_db_id
-        )
-        return row['status'] if row else None
+        lobby = await cls.get_lobby_by_name(lobby_name, channel_db_id)
+        return lobby.status if lobby else None
 
     @classmethod
     async def get_player_character_from_slot_id(cls, lobby_name, channel_db_id, slot_id):
@@ -877,283 +1413,301 @@ class LobbyManager:
         return 0  # Return 0 (default) if not found or invalid slot
 
     @classmethod
-    async def print_lobby_table(cls, channel_id=None):
-        if channel_id is not None:
-            rows = await DBManager.fetch("""
-                SELECT id, channel_id, idx_in_channel, name, password, player_count, status, map, leader,
-                       player1_id, player1_character, player1_status,
-                       player2_id, player2_character, player2_status,
-                       player3_id, player3_character, player3_status,
-                       player4_id, player4_character, player4_status
-                FROM lobbies
-                WHERE channel_id = $1
-                ORDER BY idx_in_channel ASC
-            """, channel_id)
-        else:
-            rows = await DBManager.fetch("""
-                SELECT id, channel_id, idx_in_channel, name, password, player_count, status, map, leader,
-                       player1_id, player1_character, player1_status,
-                       player2_id, player2_character, player2_status,
-                       player3_id, player3_character, player3_status,
-                       player4_id, player4_character, player4_status
-                FROM lobbies
-                ORDER BY channel_id ASC, idx_in_channel ASC
-            """)
-        lobbies = [Lobby.from_row(row) for row in rows]
-        print("ChID  Idx  Name            Players  Type     Status")
-        print("=" * 60)
-        status_map = {0: '〈비어있음〉', 1: '대기중', 2: '시작됨'}
-        for lobby in lobbies:
-            is_private = bool(lobby.password)
-            type_txt = "Private" if is_private else "Public"
-            print(f"{lobby.channel_id:<5} {lobby.idx_in_channel:<4} {lobby.name[:12]:12} {lobby.player_count:<7} {type_txt:7} {status_map.get(lobby.status, lobby.status):6}")
-        print("=" * 60)
+    async def print_lobby_table(cls, channel_id=None):
+        if channel_id is not None:
+            lobbies = await cls.get_lobbies_for_channel(channel_id)
+        else:
+            lobbies = [lobby for ch in sorted(LobbyStateEngine._by_channel) for lobby in await cls.get_lobbies_for_channel(ch)]
+        print("ChID  Idx  Name            Players  Type     Status")
+        print("=" * 60)
+        status_map = {0: '〈비어있음〉', 1: '대기중', 2: '시작됨'}
+        for lobby in lobbies:
+            is_private = bool(lobby.password)
+            type_txt = "Private" if is_private else "Public"
+            print(f"{lobby.channel_id:<5} {lobby.idx_in_channel:<4} {lobby.name[:12]:12} {lobby.player_count:<7} {type_txt:7} {status_map.get(lobby.status, lobby.status):6}")
+        print("=" * 60)
+
+class SessionRegistry:
+    """
+    Registry of connected sessions with secondary indexes by player_id and
+    lobby. Index updates never await, so they are
+    atomic with respect to other coroutines and need no lock.
+    The lobby index is the routing table for gameplay relay: it is maintained on
+    lobby create/join, leave, kick and disconnect so that 0x13XX packets can be
+    relayed to the sender's lobby without touching the database.
+    """
+    _by_addr = {}     # {addr: session}
+    _by_player = {}   # {player_id: {addr: session}}
+    _by_lobby = {}    # {(channel_db_id, lobby_name): {addr: session}}
+
+    @staticmethod
+    def _index_add(index, key, session):
+        index.setdefault(key, {})[session['addr']] = session
+
+    @staticmethod
+    def _index_remove(index, key, session):
+        members = index.get(key)
+        if members is not None and members.get(session['addr']) is session:
+            del members[session['addr']]
+            if not members:
+                del index[key]
+
+    @classmethod
+    def add(cls, session):
+        cls._by_addr[session['addr']] = session
+        if session.get('player_id'):
+            cls._index_add(cls._by_player, session['player_id'], session)
+
+    @classmethod
+    def remove(cls, session):
+        if cls._by_addr.get(session['addr']) is session:
+            del cls._by_addr[session['addr']]
+        if session.get('player_id'):
+            cls._index_remove(cls._by_player, session['player_id'], session)
+        cls.leave_lobby(session)
+
+    @classmethod
+    def set_player(cls, session, player_id):
+        if session.get('player_id'):
+            cls._index_remove(cls._by_player, session['player_id'], session)
+        session['player_id'] = player_id
+        if player_id and not session.get('removed'):
+            cls._index_add(cls._by_player, player_id, session)
+
+    @classmethod
+    def set_channel(cls, session, channel_index):
+        session['channel_index'] = channel_index
+
+    @classmethod
+    def all(cls):
+        return list(cls._by_addr.values())
+
+    @classmethod
+    def by_player(cls, player_id):
+        members = cls._by_player.get(player_id)
+        return list(members.values()) if members else []
+
+    @classmethod
+    def join_lobby(cls, session, channel_db_id, lobby_name):
+        key = (channel_db_id, lobby_name)
+        if session.get('lobby_route') != key:
+            cls.leave_lobby(session)
+        cls._index_add(cls._by_lobby, key, session)
+        session['lobby_route'] = key
+
+    @classmethod
+    def leave_lobby(cls, session):
+        key = session.pop('lobby_route', None)
+        if key is not None:
+            cls._index_remove(cls._by_lobby, key, session)
+
+    @classmethod
+    def leave_lobby_player(cls, channel_db_id, lobby_name, player_id):
+        """Remove every routed session of player_id from a lobby (used for kicks)."""
+        members = cls._by_lobby.get((channel_db_id, lobby_name), {})
+        for s in [s for s in members.values() if s.get('player_id') == player_id]:
+            cls.leave_lobby(s)
+
+    @classmethod
+    def lobby_peers(cls, session):
+        """Return the routed sessions (including session itself) of the session's lobby."""
+        key = session.get('lobby_route')
+        if key is None:
+            return ()
+        members = cls._by_lobby.get(key)
+        return members.values() if members else ()
+
+### END OF CLASS DEFINITIONS ###
+
+class SessionDirectory:
+    """
+    One active session per player_id. Login and channel join claim the player; the
+    newest claim wins and older sessions for that player are disconnected.
+    Single node: the SessionRegistry player index is the directory (worker processes
+    forward the sweep with ShardManager.kick_elsewhere).
+    Cluster mode: a player_sessions table maps player_id -> owner (node, plus worker
+    index) under a lease. Each owner renews its leases every SESSION_SYNC_INTERVAL and
+    disconnects local sessions whose player has since been claimed by another owner
+    (or kicked, which deletes the entry). Lookups are a primary-key read.
+    """
+    DBManager.register("dir_claim", """
+        INSERT INTO player_sessions (player_id, owner, lease_until) VALUES ($1, $2, $3)
+        ON CONFLICT (player_id) DO UPDATE SET owner = excluded.owner, lease_until = excluded.lease_until
+    """)
+    DBManager.register("dir_renew", "UPDATE player_sessions SET lease_until = $1 WHERE owner = $2")
+    DBManager.register("dir_owned", "SELECT player_id FROM player_sessions WHERE owner = $1")
+    DBManager.register("dir_release", "DELETE FROM player_sessions WHERE player_id = $1 AND owner = $2")
+    DBManager.register("dir_release_owner", "DELETE FROM player_sessions WHERE owner = $1")
+    DBManager.register("dir_lookup", "SELECT owner FROM player_sessions WHERE player_id = $1 AND lease_until >= $2")
+    DBManager.register("dir_kick", "DELETE FROM player_sessions WHERE player_id = $1")
+
+    owner = None
+    _claimed = {}  # {player_id: (session, monotonic time the claim was committed)}
+
+    @classmethod
+    async def start(cls):
+        """Cluster mode: drop entries left by a previous run of this owner, then keep leases alive."""
+        cls.owner = NODE_ID if ShardManager.index is None else f"{NODE_ID}#{ShardManager.index}"
+        await DBManager.execute_named("dir_release_owner", cls.owner)
+        asyncio.create_task(cls.run_sync())
+
+    @classmethod
+    async def claim(cls, session):
+        player_id = session.get('player_id')
+        if cls.owner is None or not player_id:
+            return
+        await DBManager.execute_named("dir_claim", player_id, cls.owner, time.time() + SESSION_LEASE)
+        cls._claimed[player_id] = (session, time.monotonic())
+
+    @classmethod
+    def forget(cls, session):
+        """Stop tracking session here without touching its entry (it moved to another worker)."""
+        claimed = cls._claimed.get(session.get('player_id'))
+        if claimed is not None and claimed[0] is session:
+            del cls._claimed[session['player_id']]
+
+    @classmethod
+    async def release(cls, session):
+        claimed = cls._claimed.get(session.get('player_id'))
+        if claimed is not None and claimed[0] is session:
+            del cls._claimed[session['player_id']]
+            await DBManager.execute_named("dir_release", session['player_id'], cls.owner)
+
+    @classmethod
+    async def lookup(cls, player_id):
+        """Owner holding player_id's active session, or None."""
+        if cls.owner is None:
+            return NODE_ID if SessionRegistry.by_player(player_id) else None
+        row = await DBManager.fetchrow_named("dir_lookup", player_id, time.time())
+        return row['owner'] if row else None
 
-### END OF CLASS DEFINITIONS ###
+    @classmethod
+    async def kick(cls, player_id):
+        """Disconnect player_id wherever it is connected; returns the number of local sessions closed."""
+        sessions = [s for s in SessionRegistry.by_player(player_id) if not s.get('removed')]
+        for s in sessions:
+            await full_disconnect(s)
+        if ShardManager.index is not None:
+            ShardManager.kick_elsewhere(player_id)
+        if cls.owner is not None:
+            # The owning node sees its entry gone on its next sync and disconnects the session
+            await DBManager.execute_named("dir_kick", player_id)
+        return len(sessions)
+
+    @classmethod
+    async def run_sync(cls):
+        while True:
+            await asyncio.sleep(SESSION_SYNC_INTERVAL)
+            try:
+                started = time.monotonic()
+                await DBManager.execute_named("dir_renew", time.time() + SESSION_LEASE, cls.owner)
+                owned = {row['player_id'] for row in await DBManager.fetch_named("dir_owned", cls.owner)}
+                for player_id, (session, claimed_at) in list(cls._claimed.items()):
+                    # Claims committed after the read started may not be in it yet
+                    if player_id not in owned and claimed_at < started:
+                        del cls._claimed[player_id]
+                        if not session.get('removed'):
+                            print(f"[DIRECTORY] {player_id} is active elsewhere: disconnecting {session['addr']}.")
+                            asyncio.create_task(full_disconnect(session))
+            except Exception as e:
+                print(f"[DIRECTORY] Sync failed: {e}")
 
 def build_account_creation_result(success=True, val=1):
-    packet_id = 0x0bba
-    if success:
-        flag = b'\x01\x00\x00\x00'
-    else:
-        flag = b'\x00'
-    payload = flag + struct.pack('<H', val) 
-    packet_len = len(payload)
-    header = struct.pack('<HH', packet_id, packet_len)
-    return header + payload
+    return mn_codec.encode_result(0x0bba, success, val)
 
 def build_account_deletion_result(success=True, val=1):
-    packet_id = 0x0bb9
-    if success:
-        flag = b'\x01\x00\x00\x00'
-    else:
-        flag = b'\x00'
-    payload = flag + struct.pack('<H', val)
-    packet_len = len(payload)
-    header = struct.pack('<HH', packet_id, packet_len)
-    return header + payload
+    return mn_codec.encode_result(0x0bb9, success, val)
 
 async def build_channel_list_packet(server_id):
-    packet_id = 0x0bbb
-    flag = b'\x01\x00\x00\x00'
-    entries = []
-
     # Get all channels for this server from DB (async)
     channels_list = await ChannelManager.get_channels_for_server(server_id)
     channels = {ch.channel_index: ch for ch in channels_list}
 
-    for ch_idx in range(12):
+    entries = []
+    for ch_idx in range(mn_codec.MAX_CHANNELS):
         ch = channels.get(ch_idx)
         if ch:
-            cid = ch.channel_index
-            cur_players = ch.player_count
+            entries.append((ch.channel_index, ch.player_count))
         else:
-            cid = ch_idx
-            cur_players = 0
-        max_players = 80
-        entries.append(struct.pack('<III', cid, cur_players, max_players))
-    payload = flag + b''.join(entries)
-    header = struct.pack('<HH', packet_id, len(payload))
+            entries.append((ch_idx, 0))
     if DEBUG == 3:
         await ChannelManager.print_channel_table(server_id)
-    return header + payload
+    return mn_codec.encode_channel_list(entries)
 
 def build_channel_join_ack(success=True, val=1):
-    packet_id = 0x0bbc
-    if success:
-        flag = b'\x01\x00\x00\x00'
-    else:
-        flag = b'\x00'
-    payload = flag + struct.pack('<H', val)
-    packet_len = len(payload)
-    header = struct.pack('<HH', packet_id, packet_len)
-    return header + payload
+    return mn_codec.encode_result(0x0bbc, success, val)
 
 def build_lobby_create_ack(success=True, val=1):
-    packet_id = 0x0bbd
-    if success:
-        flag = b'\x01\x00\x00\x00'
-    else:
-        flag = b'\x00'
-    payload = flag + struct.pack('<H', val)
-    packet_len = len(payload)
-    header = struct.pack('<HH', packet_id, packet_len)
-    return header + payload
+    return mn_codec.encode_result(0x0bbd, success, val)
 
 # where val = lobby idx_in_channel if success
 def build_lobby_join_ack(success=True, val=1):
-    packet_id = 0x0bbe
-    if success:
-        flag = b'\x01\x00\x00\x00'
-    else:
-        flag = b'\x00'
-    payload = flag + struct.pack('<H', val)
-    packet_len = len(payload)
-    header = struct.pack('<HH', packet_id, packet_len)
-    return header + payload
+    return mn_codec.encode_result(0x0bbe, success, val)
 
 # where val = lobby idx_in_channel if success
 def build_lobby_quick_join_ack(success=True, val=1):
-    packet_id = 0x0bbf
-    if success:
-        flag = b'\x01\x00\x00\x00'
-    else:
-        flag = b'\x00'
-    payload = flag + struct.pack('<H', val)
-    packet_len = len(payload)
-    header = struct.pack('<HH', packet_id, packet_len)
-    return header + payload
+    return mn_codec.encode_result(0x0bbf, success, val)
 
 def build_login_packet(success=True, val=1):
-    packet_id = 0x0bb8
-    if success:
-        flag = b'\x01\x00\x00\x00'
-    else:
-        flag = b'\x00'
-    payload = flag + struct.pack('<H', val)
-    packet_len = len(payload)
-    header = struct.pack('<HH', packet_id, packet_len)
-    return header + payload
+    return mn_codec.encode_result(0x0bb8, success, val)
 
 async def build_lobby_list_packet(server_id, channel_index):
-    packet_id = 0xbc8
-    flag = b'\x01\x00\x00\x00'
-    entry_struct = '<III16s1s12s1sB1s'
-    max_lobbies = 20
-    entries = [None] * max_lobbies
+    entries = {}
 
     channel_db_id = await ChannelManager.get_channel_db_id(server_id, channel_index)
+    if DEBUG == 3:
+        await LobbyManager.print_lobby_table(channel_db_id)
+    # Unchanged channels reuse the packet built for their current version
+    version = LobbyStateEngine.channel_version(channel_db_id)
+    cached = lobby_list_packets.get(channel_db_id)
+    if cached and cached[0] == version:
+        return cached[1]
     rows = []
     if channel_db_id is not None:
         rows = await LobbyManager.get_lobbies_for_channel(channel_db_id)
 
     for lobby in rows:
         idx = lobby.idx_in_channel
-        player_count = lobby.player_count
-        name = lobby.name
-        password = lobby.password
-        status = lobby.status
-        max_players = 4
-        name_enc = name.encode('euc-kr', errors='replace')[:16].ljust(16, b'\x00')
-        pad1 = b'\x00'
-        pw_enc = (password or '').encode('euc-kr', errors='replace')[:12].ljust(12, b'\x00')
-        pad2 = b'\x00'
-        pad3 = b'\x00'
-        packed = struct.pack(entry_struct, idx, player_count, max_players, name_enc, pad1, pw_enc, pad2, status, pad3)
-        if 0 <= idx < max_lobbies:
-            entries[idx] = packed
-
-    # Fill unused slots
-    for idx in range(max_lobbies):
-        if entries[idx] is None:
-            name = f"Lobby{idx+1}".encode('euc-kr')[:16].ljust(16, b'\x00')
-            pad1 = b'\x00'
-            pw_enc = b"".ljust(12, b'\x00')
-            pad2 = b'\x00'
-            status = 0
-            pad3 = b'\x00'
-            packed = struct.pack(entry_struct, idx, 0, 4, name, pad1, pw_enc, pad2, status, pad3)
-            entries[idx] = packed
-
-    payload = flag + b''.join(entries)
-    header = struct.pack('<HH', packet_id, len(payload))
-    if DEBUG == 3:
-        await LobbyManager.print_lobby_table(channel_db_id)
-    return header + payload
+        if 0 <= idx < mn_codec.MAX_LOBBIES:
+            name_enc = lobby.name.encode('euc-kr', errors='replace')
+            pw_enc = (lobby.password or '').encode('euc-kr', errors='replace')
+            entries[idx] = mn_codec.encode_lobby_entry(idx, lobby.player_count, name_enc, pw_enc, lobby.status)
+
+    # Unused slots are filled with placeholder entries by the codec
+    packet = mn_codec.encode_lobby_list(entries)
+    lobby_list_packets[channel_db_id] = (version, packet)
+    return packet
 
 async def build_server_list_packet():
-    packet_id = 0x0bc7
-    flag = b'\x01\x00\x00\x00'
     servers = []
     server_list = await ServerManager.get_servers()
     for server in server_list:
-        name = server.name.encode('euc-kr').ljust(16, b'\x00')
-        ip = server.ip_address.encode('ascii') + b'\x00'
-        ip = ip.ljust(16, b'\x00')
-        reserved1 = b'\x00' * 5
-        reserved2 = b'\x00' * 3
-        servers.append(struct.pack('<16s5s16s3si', name, reserved1, ip, reserved2, server.availability))
-    while len(servers) < 10:
-        idx = len(servers)
-        name = f"MN{idx}".encode('euc-kr').ljust(16, b'\x00')
-        ip = b'0.0.0.0\x00'.ljust(16, b'\x00')
-        reserved1 = b'\x00' * 5
-        reserved2 = b'\x00' * 3
-        servers.append(struct.pack('<16s5s16s3si', name, reserved1, ip, reserved2, -1))
-    entries = b''.join(servers)
-    payload = flag + entries
-    header = struct.pack('<HH', packet_id, len(payload))
+        name = server.name.encode('euc-kr')
+        ip = server.ip_address.encode('ascii')
+        servers.append((name, ip, server.availability))
     if DEBUG == 3:
         await ServerManager.print_server_table()
-    return header + payload
+    # Missing servers are padded up to 10 offline entries by the codec
+    return mn_codec.encode_server_list(servers)
 
 def build_map_select_ack(success=True, val=1):
-    packet_id = 0x0bc6
-    if success:
-        flag = b'\x01\x00\x00\x00'
-    else:
-        flag = b'\x00'
-    payload = flag + struct.pack('<H', val)
-    packet_len = len(payload)
-    header = struct.pack('<HH', packet_id, packet_len)
-    return header + payload
+    return mn_codec.encode_result(0x0bc6, success, val)
 
 def build_character_select_ack(success=True, val=1):
-    packet_id = 0xbc5
-    if success:
-        flag = b'\x01\x00\x00\x00'
-    else:
-        flag = b'\x00'
-    payload = flag + struct.pack('<H', val)
-    header = struct.pack('<HH', packet_id, len(payload))
-    return header + payload
-
-def build_character_select_setup_packet(player):
-    packet_id = 0xbc4
-    flag_and_unknown = b'\x01\x00\x00\x00'
-    pid = player.player_id.encode('ascii')[:8].ljust(8, b'\x00')
-    block = bytearray(28)
-    block[0:8]   = pid
-    block[8:13]  = b'\x00' * 5
-    block[0x0D]  = player.character
-    block[0x0E]  = player.status
-    block[0x0F]  = 0
-    block[0x10:0x14] = struct.pack('<I', player.rank)
-    block[0x14:0x18] = struct.pack('<I', 0)
-    block[0x18:0x1C] = struct.pack('<I', 0)
-    data = bytes(block).ljust(32, b'\x00')
-    header = struct.pack('<HH', packet_id, 36)
-    return header + flag_and_unknown + data
+    return mn_codec.encode_result(0xbc5, success, val)
+
+def build_character_select_setup_packet(player, character, status):
+    pid = player.player_id.encode('ascii')
+    return mn_codec.encode_character_setup(pid, character, status, player.rank)
 
 def build_kick_player_ack(success=True, val=1):
-    packet_id = 0xbc3
-    if success:
-        flag = b'\x01\x00\x00\x00'
-    else:
-        flag = b'\x00'
-    payload = flag + struct.pack('<H', val)
-    header = struct.pack('<HH', packet_id, len(payload))
-    return header + payload
+    return mn_codec.encode_result(0xbc3, success, val)
 
 def build_lobby_leave_ack(success=True, val=1):
-    packet_id = 0xbc2
-    if success:
-        flag = b'\x01\x00\x00\x00'
-    else:
-        flag = b'\x00'
-    payload = flag + struct.pack('<H', val)
-    header = struct.pack('<HH', packet_id, len(payload))
-    return header + payload
+    return mn_codec.encode_result(0xbc2, success, val)
 
 def build_player_ready_ack(success=True, val=1):
-    packet_id = 0xbc1
-    if success:
-        flag = b'\x01\x00\x00\x00'
-    else:
-        flag = b'\x00'
-    payload = flag + struct.pack('<H', val)
-    header = struct.pack('<HH', packet_id, len(payload))
-    return header + payload
+    return mn_codec.encode_result(0xbc1, success, val)
 
 async def build_game_start_ack(lobby_name, channel_db_id, success= True, val=1, player_count=4):
     """
@@ -1165,12 +1719,9 @@ async def build_game_start_ack(lobby_name, channel_db_id, success= True, val=1,
     """
     packet_id = 0xbc0
     if success:
-        flag = b'\x01\x00\x00\x00'
-        pad = b'\x00\x00'
         g_logic = False
         # Generate unique random positions for each player (0..11)
         start_positions = random.sample(range(12), k=player_count)
-        positions = b''.join(struct.pack('<B3x', pos) for pos in start_positions)
         vampire_id = random.randint(0, 3)
         vampire_character = await LobbyManager.get_player_character_from_slot_id(lobby_name, channel_db_id, vampire_id)
         # Assign gender based on gender of character
@@ -1186,21 +1737,8 @@ async def build_game_start_ack(lobby_name, channel_db_id, success= True, val=1,
         map_id = random.randint(1, 4) # If RANDOM map was selected, this value will be used
         print(f"Start Positions:{start_positions}, Map:{map_id}, Vampire:{vampire_id}, Gender:{vampire_gender}")
 
-        payload = (
-            flag
-            + positions
-            + struct.pack('<H', vampire_id)
-            + pad
-            + struct.pack('<H', vampire_gender)
-            + pad
-            + struct.pack('<H', map_id)
-        )
-        header = struct.pack('<HH', packet_id, len(payload))
-    else:
-        flag = b'\x00'
-        payload = flag + struct.pack('<H', val)
-        header = struct.pack('<HH', packet_id, len(payload))
-    return header + payload
+        return mn_codec.encode_game_start(start_positions, vampire_id, vampire_gender, map_id)
+    return mn_codec.encode_result(packet_id, success, val)
 
 async def build_lobby_room_packet(lobby_name, channel_db_id):
     lobby = await LobbyManager.get_lobby_by_name(lobby_name, channel_db_id)
@@ -1208,7 +1746,17 @@ async def build_lobby_room_packet(lobby_name, channel_db_id):
         print(f"[ERROR] Could not fetch lobby {lobby_name} for channel {channel_db_id}")
         return b''
 
-    packet_id = 0x03ee
+    # Look up each player's rank from the profile cache (DB only on a cache miss)
+    player_ranks = {}
+    for pid_str in lobby.player_ids:
+        if pid_str:
+            player = await PlayerManager.get_cached_player(pid_str)
+            player_ranks[pid_str] = player.rank if player else 1
+
+    # Identical rebuilds (same lobby version and ranks) reuse the previous packet
+    memo_key = (lobby.version, PlayerManager.rank_epoch)
+    if lobby.room_packet and lobby.room_packet[0] == memo_key:
+        return lobby.room_packet[1]
 
     # Determine leader index (0 if not found)
     leader_idx = 0
@@ -1216,73 +1764,34 @@ async def build_lobby_room_packet(lobby_name, channel_db_id):
         if pid == lobby.leader:
             leader_idx = i
             break
-    lobby_leader = struct.pack("B", leader_idx)
-    padding = b'\x00\x00\x00'
-    name = lobby.name.encode('euc-kr', errors='replace')[:16].ljust(16, b'\x00')
-    unknown1 = b'\x00' * 16
+    name = lobby.name.encode('euc-kr', errors='replace')
 
-    player_structs = []
+    players = []
     for i in range(4):
         pid_str = lobby.player_ids[i]
-        pid = (pid_str or '').encode('ascii')[:8].ljust(8, b'\x00')
-        block = bytearray(28)
-        block[0:8] = pid
-        block[8:13] = b'\x00' * 5
-        block[0x0D] = lobby.player_characters[i] or 0
-        block[0x0E] = lobby.player_statuses[i] or 0
-        block[0x0F] = 0
-        # Look up each player's rank from the database 
-        if pid_str:
-            player = await PlayerManager.load_player_from_db(pid_str)
-            player_rank = player.rank if player else 1
-        else:
-            player_rank = 1
-        block[0x10:0x14] = struct.pack('<I', player_rank)
-        block[0x14:0x18] = struct.pack('<I', 0)
-        block[0x18:0x1C] = struct.pack('<I', 0)
-        player_structs.append(bytes(block))
-
-    map_select = struct.pack('<I', lobby.map or 1)
-    lobby_status = struct.pack('<I', lobby.status or 1)
-    payload = (
-        lobby_leader +
-        padding +
-        name +
-        unknown1 +
-        b''.join(player_structs) +
-        map_select +
-        lobby_status
-    )
-    header = struct.pack('<HH', packet_id, len(payload))
-    return header + payload
+        player_rank = player_ranks.get(pid_str, 1) if pid_str else 1
+        players.append((
+            (pid_str or '').encode('ascii'),
+            lobby.player_characters[i] or 0,
+            lobby.player_statuses[i] or 0,
+            player_rank
+        ))
+
+    packet = mn_codec.encode_room(leader_idx, name, players, lobby.map or 1, lobby.status or 1)
+    lobby.room_packet = (memo_key, packet)
+    return packet
 
 def parse_account(data):
-    packet_id, payload_len = struct.unpack('<HH', data[:4])
-    username = data[4:12].decode('ascii').rstrip('\x00')
-    password = data[17:29].decode('ascii').rstrip('\x00')
-    return packet_id, payload_len, username, password
+    return mn_codec.decode_account(data)
 
 def parse_channel_join_packet(data):
-    packet_id, payload_len = struct.unpack('<HH', data[:4])
-    player_id = data[4:12].decode('ascii').rstrip('\x00')
-    channel_index = struct.unpack('<H', data[20:22])[0]
-    return {
-        "packet_id": packet_id,
-        "payload_len": payload_len,
-        "player_id": player_id,
-        "channel_index": channel_index
-    }
+    return mn_codec.decode_channel_join(data)
 
 def parse_lobby_create_packet(data):
-    player_id = data[4:12].decode('ascii').rstrip('\x00')
-    lobby_name = data[17:29].decode('ascii').rstrip('\x00')
-    password = data[34:42].decode('ascii').rstrip('\x00')
-    return player_id, lobby_name, password
+    return mn_codec.decode_lobby_create(data)
 
 def parse_lobby_join_packet(data):
-    player_id = data[4:12].decode('ascii').rstrip('\x00')
-    lobby_name = data[24:36].decode('ascii').rstrip('\x00')
-    return player_id, lobby_name
+    return mn_codec.decode_lobby_join(data)
 
 def parse_move_packet(data):
     """
@@ -1290,59 +1799,24 @@ def parse_move_packet(data):
     Assumes 'data' includes header (4 bytes) + payload (24 bytes).
     Returns a dict of all parsed fields.
     """
-    if len(data) < 28:
-        raise ValueError("Packet too short for 0x1388 movement update")
-
-    pkt_id, pkt_len = struct.unpack('<HH', data[:4])
-    y_pos      = struct.unpack('<f', data[4:8])[0]
-    x_pos      = struct.unpack('<f', data[8:12])[0]
-    player_heading    = struct.unpack('<f', data[12:16])[0]
-    cam_heading= struct.unpack('<f', data[16:20])[0]
-    unknown1   = data[20:22]           # 2 bytes
-    left_right = data[22]              # 1 byte
-    up_down    = data[23]              # 1 byte
-    player_idx   = data[24:28]           # 4 bytes (character index [0,3])
-
-    return {
-        "pkt_id": pkt_id,
-        "pkt_len": pkt_len,
-        "x_pos": x_pos,
-        "y_pos": y_pos,
-        "player_heading": player_heading,
-        "cam_heading": cam_heading,
-        "unknown1": unknown1,
-        "left_right": left_right,
-        "up_down": up_down,
-        "player_idx": player_idx,
-    }
+    return mn_codec.decode_move(data)
 
 def build_dc_packet(player_index):
     """
     Build the 0x03f4 Player DC packet.
     Example: player_index 3 -> f4 03 04 00 03 00 00 00
     """
-    packet_id = 0x03f4
-    payload_len = 4
-    payload = struct.pack('<B3x', player_index)
-    header = struct.pack('<HH', packet_id, payload_len)
-    return header + payload
+    return mn_codec.encode_dc(player_index)
 
 def build_countdown(number):
     """
     Build the 0x03ef Countdown packet (ef03 0100 XX).
     Example: number=3 -> ef 03 01 00 03
     """
-    packet_id = 0x03ef
-    payload_len = 1
-    header = struct.pack('<HH', packet_id, payload_len)
-    payload = struct.pack('<B', number)
-    return header + payload
+    return mn_codec.encode_countdown(number)
 
 async def send_echo_challenge(session, payload=None, broadcast=False):
-    packet_id = 0x03e9
-    payload = payload or b'\x01\x00\x00\x00'
-    header = struct.pack('<HH', packet_id, len(payload))
-    packet = header + payload[:4]
+    packet = mn_codec.encode_echo(payload or None)
     if broadcast:
         player_id = session.get('player_id')
         server_id = session.get('server_id')
@@ -1383,23 +1857,147 @@ async def run_echo_challenge(session, purpose, payload=None, timeout=10, interva
     session['echo'][purpose]['in_progress'] = False
 
 
+class SendQueue:
+    """
+    Bounded per-session outbound queue drained by its own writer task.
+    Producers never await the socket: whatever queued up while the previous
+    drain() was pending goes out in one writelines() call, so a slow client
+    only backs up its own queue. When the queue is full, SEND_OVERFLOW decides:
+    "drop_move" sheds the oldest queued 0x1388 (ordered events are never dropped;
+    with no movement left to shed the client is disconnected), "disconnect"
+    aborts the connection right away.
+
+    Movement relayed with put_move() is conflated: at most one 0x1388 per sender
+    is pending, and a newer one overwrites it in place. Everything else stays in
+    order.
+    """
+    MOVE_PREFIX = mn_codec.U16.pack(mn_codec.MOVE_UPDATE)
+
+    def __init__(self, session, maxlen=None, policy=None):
+        self.session = session
+        self.writer = session['writer']
+        self.maxlen = maxlen or SEND_QUEUE_MAX
+        self.policy = policy or SEND_OVERFLOW
+        self.pending = collections.deque()  # bytes, or [payload, sender] slots for conflated movement
+        self.move_slots = {}  # sender -> its pending movement slot
+        self.dropped = 0
+        self.conflated = 0
+        self.closed = False
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    def put(self, payload):
+        if self.closed:
+            return False
+        if len(self.pending) >= self.maxlen and not self._overflow(payload):
+            return False
+        self.pending.append(payload)
+        self._wakeup.set()
+        return True
+
+    def put_move(self, sender, payload):
+        """Queue a 0x1388 from sender, replacing that sender's still-pending one if any."""
+        if self.closed:
+            return False
+        slot = self.move_slots.get(sender)
+        if slot is not None:
+            slot[0] = payload
+            self.conflated += 1
+            return True
+        if len(self.pending) >= self.maxlen and not self._overflow(payload):
+            return False
+        slot = [payload, sender]
+        self.move_slots[sender] = slot
+        self.pending.append(slot)
+        self._wakeup.set()
+        return True
+
+    def _overflow(self, payload):
+        """Make room for payload; returns False if it should not be queued."""
+        if self.policy == "drop_move":
+            move = self.MOVE_PREFIX
+            for i, queued in enumerate(self.pending):
+                if queued.__class__ is list:
+                    del self.move_slots[queued[1]]
+                elif queued[:2] != move:
+                    continue
+                del self.pending[i]
+                self.dropped += 1
+                return True
+            if payload[:2] == move:
+                self.dropped += 1
+                return False
+        print(f"[SEND QUEUE] {self.session.get('addr')} overflowed ({len(self.pending)} queued), disconnecting.")
+        self.abort()
+        return False
+
+    def _take(self):
+        """Pop everything pending as a list of bytes, resolving movement slots."""
+        batch = [p[0] if p.__class__ is list else p for p in self.pending]
+        self.pending.clear()
+        self.move_slots.clear()
+        return batch
+
+    async def _run(self):
+        writer = self.writer
+        pending = self.pending
+        try:
+            while True:
+                if not pending:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+                writer.writelines(self._take())
+                await writer.drain()
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print(f"[SEND ERROR] {self.session.get('addr')}: {e}")
+            self.abort()
+
+    def abort(self):
+        """Drop everything and reset the connection; the reader loop then runs full_disconnect."""
+        self.closed = True
+        self.pending.clear()
+        self.move_slots.clear()
+        self._task.cancel()
+        transport = self.writer.transport
+        if not transport.is_closing():
+            transport.abort()
+
+    def close(self):
+        """Stop the writer task, handing anything still queued to the transport before it is closed."""
+        if self.closed:
+            return
+        self.closed = True
+        self._task.cancel()
+        batch = self._take()
+        if batch and not self.writer.is_closing():
+            self.writer.writelines(batch)
+
+def queue_packet(session, payload, note="", sender=None):
+    """Queue payload for session; passing sender conflates it as that sender's 0x1388."""
+    sendq = session.get('sendq')
+    if sendq is None:
+        return False
+    if sender is None:
+        queued = sendq.put(payload)
+    else:
+        queued = sendq.put_move(sender, payload)
+    if queued and DEBUG:
+        log("[SEND] %s To %s: %s", note, session['addr'], Hex(payload))
+    return queued
+
 async def send_packet_to_client(session, payload, note=""):
-    try:
-        writer = session['writer']  # should be an asyncio.StreamWriter
-        writer.write(payload)
-        await writer.drain()
-        if note:
-            print(f"[SEND] {note} To {session['addr']}: {payload.hex()}")
-        else:
-            print(f"[SEND] To {session['addr']}: {payload.hex()}")
-    except Exception as e:
-        print(f"[SEND ERROR] {session['addr']}: {e}")
+    # Queued for the session's writer task; never waits on the client's socket
+    queue_packet(session, payload, note)
+
+def is_relay_packet(pkt_id):
+    """Gameplay (0x13xx) and 0x03f1 are forwarded unchanged, so they can stay zero-copy views."""
+    return pkt_id >> 8 == 0x13 or pkt_id == 0x03f1
 
 def parse_packet_header(data):
-    if len(data) < 4:
-        return None, None
-    packet_id, payload_len = struct.unpack('<HH', data[:4])
-    return packet_id, payload_len
+    return mn_codec.decode_header(data)
 
 async def broadcast_to_lobby(lobby_name, channel_db_id, payload, note="", cur_session=None, to_self=True):
     lobby = await LobbyManager.get_lobby_by_name(lobby_name, channel_db_id)
@@ -1408,20 +2006,31 @@ async def broadcast_to_lobby(lobby_name, channel_db_id, payload, note="", cur_se
         return
 
     target_ids = {pid for pid in lobby.player_ids if pid}
+    targets = [s for pid in target_ids for s in SessionRegistry.by_player(pid)]
 
-    async with sessions_lock:
-        targets = [
-            s for s in sessions.values()
-            #if s.get("player_id") in target_ids and s['addr'][1] == CLIENT_GAMEPLAY_PORT
-            if s.get("player_id") in target_ids
-        ]
+    if DEBUG:
+        note = f"[BROADCAST {lobby_name}] {note}"
+    # Queueing never blocks, so one slow client cannot hold up the others
+    for s in targets:
+        if not s.get('removed') and (to_self or s is not cur_session):
+            queue_packet(s, payload, note)
 
-    # Use asyncio.gather to send to all clients concurrently
-    await asyncio.gather(*[
-        send_packet_to_client(s, payload, note=f"[BROADCAST] {lobby_name}] {note}")
-        for s in targets
-        if not s.get('removed') and (to_self or s is not cur_session)
-    ])
+def relay_to_lobby(session, payload, note="", to_self=True, conflate=False):
+    """
+    Relay a gameplay packet to the sender's lobby using the SessionRegistry lobby index (no DB queries).
+    conflate=True (0x1388 only) keeps at most one pending copy per sender in each recipient's queue.
+    Returns False if the session is not routed to any lobby.
+    """
+    peers = SessionRegistry.lobby_peers(session)
+    if not peers:
+        return False
+    if DEBUG:
+        note = f"[RELAY {session['lobby_route'][1]}] {note}"
+    sender = session['addr'] if conflate else None
+    for s in peers:
+        if not s.get('removed') and (to_self or s is not session):
+            queue_packet(s, payload, note, sender)
+    return True
 
 async def handle_client_packet(session, data):
     # The session is now a dict: {'socket': sock, 'addr': addr, ...}
@@ -1441,8 +2050,8 @@ async def handle_client_packet(session, data):
         print("[DEBUG] Handling 0x07d0 LOGIN packet")
         print(f"[DEBUG] Raw client_data: {data.hex()}")
         if len(data) >= 30:
-            player_id = data[4:16].decode('ascii', errors='replace').rstrip('\x00')
-            pwd = data[17:29].decode('ascii', errors='replace').rstrip('\x00')
+            player_id = mn_codec.cstr(data, 4, 16, errors='replace')
+            pwd = mn_codec.cstr(data, 17, 29, errors='replace')
             print(f"[DEBUG] Parsed player_id: '{player_id}' (raw: {data[4:16].hex()})")
             print(f"[DEBUG] Parsed password: '{pwd}' (raw: {data[17:29].hex()})")
             player = await PlayerManager.load_player_from_db(player_id)
@@ -1450,9 +2059,11 @@ async def handle_client_packet(session, data):
                 print(f"[DEBUG] Player found in DB: '{player.player_id}', expected password: '{player.password}'")
                 if player.password == pwd:
                     print(f"[LOGIN] Login OK for player '{player_id}'")
+                    PlayerManager.cache_player(player)
                     response = build_login_packet(success=True)
                     # Save to session for later use
-                    session['player_id'] = player_id
+                    SessionRegistry.set_player(session, player_id)
+                    await SessionDirectory.claim(session)
                 else:
                     print(f"[LOGIN] Login failed for player '{player_id}'. Received password: '{pwd}' != Expected password: '{player.password}'")
                     response = build_login_packet(success=False, val=7)
@@ -1513,9 +2124,9 @@ async def handle_client_packet(session, data):
         # Decrement channel player count 
         if channel_index is not None:
             await ChannelManager.decrement_player_count(server_id, channel_index)
-            session['channel_index'] = None
+            SessionRegistry.set_channel(session, None)
         # Send response
-        response = await build_channel_list_packet(server_id)
+        response = await ListPacketCache.channel_list(server_id)
         await send_packet_to_client(session, response, note="[CHANNEL LIST]")
 
     # --- Channel Join ---
@@ -1532,24 +2143,27 @@ async def handle_client_packet(session, data):
             await send_packet_to_client(session, response, note="[CHANNEL JOIN FAIL]")
             return
 
+        # Fresh profile: the rank may have changed on another worker or node since it was cached here
         player = await PlayerManager.load_player_from_db(player_id)
         if player:
+            PlayerManager.cache_player(player)
             # ChannelManager.increment_player_count(server_id, channel_index)  # Uncomment if wanted
             print(f"[CHANNEL JOIN] Player {player.player_id} joined channel {channel_index} on server_id {server_id}")
         else:
             print(f"[ERROR] Channel join for unknown player: {player_id}")
 
         # Disconnect any OTHER existing session(s) for this player_id (Connection Manager 18000 session)
-        async with sessions_lock:
-            sessions_snapshot = list(sessions.values())
-        for s in sessions_snapshot:
-            if s.get('player_id') == player_id and not s == session and not s.get('removed'):
+        for s in SessionRegistry.by_player(player_id):
+            if s is not session and not s.get('removed'):
                 print(f"[CHANNEL JOIN] Player {player_id} : Disconnecting other session.")
                 await full_disconnect(s)
+        if ShardManager.index is not None:
+            ShardManager.kick_elsewhere(player_id)
 
         # Save per-session state for later packets
-        session['player_id'] = player_id
-        session['channel_index'] = channel_index
+        SessionRegistry.set_player(session, player_id)
+        SessionRegistry.set_channel(session, channel_index)
+        await SessionDirectory.claim(session)
         # Only increment server count once per session
         ### We only increment Player Count on Channel Join instead of Channel List to avoid edge case where
         ### the client disconnects before joining a channel and there is no player_id set for the session
@@ -1568,7 +2182,7 @@ async def handle_client_packet(session, data):
     # --- Lobby Create ---
     elif pkt_id == 0x07d5:
         player_id, lobby_name, password = parse_lobby_create_packet(data)
-        player = await PlayerManager.load_player_from_db(player_id)
+        player = await PlayerManager.get_cached_player(player_id)
         server_id = session.get('server_id')
         channel_index = session.get('channel_index')
         channel_db_id = await ChannelManager.get_channel_db_id(server_id, channel_index)
@@ -1592,6 +2206,7 @@ async def handle_client_packet(session, data):
                     response = build_lobby_create_ack(success=False, val=0x0d)  # Full
             else:
                 print(f"[LOBBY CREATE] Lobby '{lobby_name}' successfully created in channel {channel_db_id}")
+                SessionRegistry.join_lobby(session, channel_db_id, lobby_name)
                 response = build_lobby_create_ack(success=True)
                 await send_packet_to_client(session, response, note="[LOBBY CREATE OK]")
                 room_packet = await build_lobby_room_packet(lobby_name, channel_db_id)
@@ -1604,7 +2219,7 @@ async def handle_client_packet(session, data):
     # --- Lobby Join ---
     elif pkt_id == 0x07d6:
         player_id, lobby_name = parse_lobby_join_packet(data)
-        player = await PlayerManager.load_player_from_db(player_id)
+        player = await PlayerManager.get_cached_player(player_id)
         server_id = session.get('server_id')
         channel_index = session.get('channel_index')
         channel_db_id = await ChannelManager.get_channel_db_id(server_id, channel_index)
@@ -1629,7 +2244,7 @@ async def handle_client_packet(session, data):
                 # Allow this join and clear the session vars now
                 session.pop('quick_join_lobby_idx', None)
                 session.pop('quick_join_lobby_name', None)
-                session.pop('quick_join_time', None)
+                SessionTimers.cancel(session, 'quick_join')
 
         success = False
         val = 1  # Default (idx)
@@ -1671,6 +2286,7 @@ async def handle_client_packet(session, data):
         await send_packet_to_client(session, response, note="[LOBBY JOIN]")
 
         if success and channel_db_id is not None and lobby is not None:
+            SessionRegistry.join_lobby(session, channel_db_id, lobby_name)
             # Store the player_index in the session
             updated_lobby = await LobbyManager.get_lobby_by_name(lobby_name, channel_db_id)
             if updated_lobby and player_id in updated_lobby.player_ids:
@@ -1688,7 +2304,7 @@ async def handle_client_packet(session, data):
             await send_packet_to_client(session, response, note="[QUICK JOIN FAIL]")
             return
 
-        player_id = data[4:12].decode('ascii').rstrip('\x00')
+        player_id = mn_codec.cstr(data, 4, 12)
         print(f"[QUICK JOIN] Request from player_id={player_id}")
 
         server_id = session.get('server_id')
@@ -1706,18 +2322,11 @@ async def handle_client_packet(session, data):
             await send_packet_to_client(session, response, note="[QUICK JOIN FAIL]")
             return
 
-        # Get all lobbies in the channel
-        lobbies = await LobbyManager.get_lobbies_for_channel(channel_db_id)
-        # Filter: public, not full, status == 1 (waiting)
-        available = [
-            lobby for lobby in lobbies
-        	if not lobby.password  # public
-        	and lobby.player_count < 4
-        	and lobby.status == 1  # waiting for players
-        ]
-        print(f"[QUICK JOIN] {len(available)} public, not full lobbies found.")
-
-        if not available:
+        # Public, not full, waiting lobbies come from the per-channel joinable index
+        lobby = JoinableIndex.pick(channel_db_id, player_id)
+        print(f"[QUICK JOIN] {len(JoinableIndex.lobbies(channel_db_id))} public, not full lobbies found.")
+
+        if lobby is None:
         	# No lobbies available
             response = build_lobby_quick_join_ack(success=False, val=0x0d)
             # --- BLOCK LOBBY JOINS FOR 1 SECOND ---
@@ -1725,14 +2334,12 @@ async def handle_client_packet(session, data):
             await send_packet_to_client(session, response, note="[QUICK JOIN NO LOBBY]")
             return
 
-        # Pick a random lobby
-        lobby = random.choice(available)
         lobby_name = lobby.name
 
-        # Store the expected lobby index and time in session for robust join check
+        # Store the expected lobby index in session for robust join check, and arm its timeout
         session['quick_join_lobby_idx'] = lobby.idx_in_channel
         session['quick_join_lobby_name'] = lobby.name
-        session['quick_join_time'] = time.time()
+        SessionTimers.schedule(session, 'quick_join', time.time() + QUICK_JOIN_TIMEOUT, on_quick_join_timeout)
 
         print(f"[QUICK JOIN] Player {player_id} request to join lobby '{lobby_name}' (idx {lobby.idx_in_channel})")
         response = build_lobby_quick_join_ack(success=True, val=lobby.idx_in_channel)
@@ -1742,7 +2349,7 @@ async def handle_client_packet(session, data):
     elif pkt_id == 0x07d8:
         if len(data) >= 8:
             session['countdown_in_progress'] = True  
-            player_id = data[4:12].decode('ascii').rstrip('\x00')
+            player_id = mn_codec.cstr(data, 4, 12)
             server_id = session.get('server_id')
             channel_index = session.get('channel_index')
             channel_db_id = await ChannelManager.get_channel_db_id(server_id, channel_index)
@@ -1767,7 +2374,7 @@ async def handle_client_packet(session, data):
     elif pkt_id == 0x07d9:
         if len(data) >= 8:
             session['countdown_in_progress'] = True 
-            player_id = data[4:12].decode('ascii').rstrip('\x00')
+            player_id = mn_codec.cstr(data, 4, 12)
             server_id = session.get('server_id')
             channel_index = session.get('channel_index')
             channel_db_id = await ChannelManager.get_channel_db_id(server_id, channel_index)
@@ -1792,7 +2399,7 @@ async def handle_client_packet(session, data):
     # --- Lobby Leave ---
     elif pkt_id == 0x07da:  # Lobby leave
         if len(data) >= 8:
-            player_id = data[4:12].decode('ascii').rstrip('\x00')
+            player_id = mn_codec.cstr(data, 4, 12)
             server_id = session.get('server_id')
             channel_index = session.get('channel_index')
             channel_db_id = await ChannelManager.get_channel_db_id(server_id, channel_index)
@@ -1800,6 +2407,7 @@ async def handle_client_packet(session, data):
                 print(f"[ERROR] No channel DB id for server_id={server_id}, channel_index={channel_index}")
                 ack_packet = build_lobby_leave_ack()
             removed_lobby, lobby_deleted = await LobbyManager.remove_player_and_update_leader(player_id, channel_db_id)
+            SessionRegistry.leave_lobby(session)
             ack_packet = build_lobby_leave_ack()
             await send_packet_to_client(session, ack_packet, note="[LOBBY LEAVE ACK]")
             if not lobby_deleted:
@@ -1817,7 +2425,7 @@ async def handle_client_packet(session, data):
 # --- Lobby Kick ---
     elif pkt_id == 0x07db:
         if len(data) >= 8:
-            kick_idx = struct.unpack('<I', data[4:8])[0]
+            kick_idx = mn_codec.decode_u32(data, 4)
             server_id = session.get('server_id')
             channel_index = session.get('channel_index')
             player_id = session.get('player_id')
@@ -1832,13 +2440,7 @@ async def handle_client_packet(session, data):
                     kicked_player_id = lobby.player_ids[kick_idx]
                     if kicked_player_id:
                         # Send kick to the player being kicked and to lobby leader (this session) to ack the 
-                        async with sessions_lock:
-                            targets = [
-                                s for s in sessions.values()
-                                #if s.get("player_id") == kicked_player_id and s['addr'][1] == CLIENT_GAMEPLAY_PORT
-                                if s.get("player_id") == kicked_player_id
-                            ]
-                        # Release lock before any awaits
+                        targets = SessionRegistry.by_player(kicked_player_id)
 
                         for s in targets:
                             await send_packet_to_client(s, kick_packet, note=f"[PLAYER KICKED index={kick_idx}]")
@@ -1846,6 +2448,7 @@ async def handle_client_packet(session, data):
                             break
 
                         removed = await LobbyManager.remove_player_from_lobby_db(kicked_player_id, channel_db_id)
+                        SessionRegistry.leave_lobby_player(channel_db_id, lobby_name, kicked_player_id)
                         if removed:
                             print(f"[KICK] Removed player: {kicked_player_id} from {lobby_name} (idx {kick_idx})")
                         else:
@@ -1865,7 +2468,7 @@ async def handle_client_packet(session, data):
     # --- Character Info Request ---
     elif pkt_id == 0x07dc:
         if len(data) >= 8:
-            requested_id = data[4:12].decode('ascii').rstrip('\x00')
+            requested_id = mn_codec.cstr(data, 4, 12)
             print(f"[0x7dc] Requested player info for: {requested_id}")
             server_id = session.get('server_id')
             channel_index = session.get('channel_index')
@@ -1879,11 +2482,9 @@ async def handle_client_packet(session, data):
                         slot_idx = lobby.player_ids.index(requested_id)
                         character = lobby.player_characters[slot_idx] or 0
                         status = lobby.player_statuses[slot_idx] or 0
-                player = await PlayerManager.load_player_from_db(requested_id)
+                player = await PlayerManager.get_cached_player(requested_id)
                 if player:
-                    player.character = character
-                    player.status = status
-                    bc4_response = build_character_select_setup_packet(player)
+                    bc4_response = build_character_select_setup_packet(player, character, status)
                     await send_packet_to_client(session, bc4_response, note="[CHAR INFO]")
         else:
             print(f"[ERROR] Malformed 0x07dc packet (len={len(data)})")
@@ -1910,7 +2511,7 @@ async def handle_client_packet(session, data):
     # --- Map Select Request ---
     elif pkt_id == 0x07de:  # Map select
         if len(data) >= 8:
-            desired_map = struct.unpack('<I', data[4:12])[0]
+            desired_map = mn_codec.decode_u32(data, 4)
             player_id = session.get('player_id')
             server_id = session.get('server_id')
             channel_index = session.get('channel_index')
@@ -1928,7 +2529,7 @@ async def handle_client_packet(session, data):
 
     # --- Server List ---
     elif pkt_id == 0x07df: 
-        response = await build_server_list_packet()
+        response = await ListPacketCache.server_list()
         await send_packet_to_client(session, response, note="[SERVER LIST]")
 
     # --- Lobby List ---
@@ -1965,17 +2566,10 @@ async def handle_client_packet(session, data):
             print(f"[READY] Echo reply for '{player_id}' is {'READY' if success else 'DC'}")
 
             # Check and mark DCs for all other slots (not self)
-            async with sessions_lock:
-                sessions_snapshot = list(sessions.values())
-            # Now operate on snapshot outside lock
             for idx, pid in enumerate(lobby.player_ids):
                 if not pid or pid == player_id:
                     continue
-                active = any(
-                    #s.get("player_id") == pid and s['addr'][1] == CLIENT_GAMEPLAY_PORT
-                    s.get("player_id") == pid
-                    for s in sessions_snapshot
-                )
+                active = bool(SessionRegistry.by_player(pid))
                 d = lobby_echo_results.setdefault(key, {})
                 if not active and pid not in d:
                     d[pid] = False  # Mark as DC
@@ -1997,9 +2591,8 @@ async def handle_client_packet(session, data):
                 for idx, pid in enumerate(lobby.player_ids):
                     if not pid:
                         continue
-                    for s in sessions_snapshot:
-                        #if s.get("player_id") == pid and s['addr'][1] == CLIENT_GAMEPLAY_PORT:
-                        if s.get("player_id") == pid:
+                    for s in SessionRegistry.by_player(pid):
+                        if not s.get('removed'):
                             dc_packet = build_dc_packet(idx)
                             tasks.append(send_packet_to_client(s, dc_packet, note=f"[EXPERIMENTAL DC SELF {idx}]"))
                             break
@@ -2015,10 +2608,9 @@ async def handle_client_packet(session, data):
                     final_packet = build_countdown(0)
                     await broadcast_to_lobby(lobby_name, channel_db_id, final_packet, note="[COUNTDOWN GO]")
                     lobby_echo_results[key] = {}
-                    async with sessions_lock:
-                        session_list = list(sessions.values())
-                    for s in session_list:
-                        s['countdown_in_progress'] = False
+                    for pid in lobby.player_ids:
+                        for s in SessionRegistry.by_player(pid):
+                            s['countdown_in_progress'] = False
 
                 asyncio.create_task(countdown_coroutine())
 
@@ -2048,6 +2640,7 @@ async def handle_client_packet(session, data):
             await broadcast_to_lobby(lobby_name, channel_db_id, data, note=f"[DISCONNECT BROADCAST {pkt_id}]")
             # Remove player, update leader, and delete lobby if empty
             removed_lobby, lobby_deleted = await LobbyManager.remove_player_and_update_leader(player_id, channel_db_id)
+            SessionRegistry.leave_lobby(session)
             if not lobby_deleted:
                 # Broadcast updated room info to remaining players
                 room_packet = await build_lobby_room_packet(lobby_name, channel_db_id)
@@ -2063,7 +2656,7 @@ async def handle_client_packet(session, data):
         Update the player's status and broadcast lobby room info
         """            
     elif pkt_id == 0x03f2:
-        player_id = data[4:12].decode('ascii').rstrip('\x00')
+        player_id = mn_codec.cstr(data, 4, 12)
         server_id = session.get('server_id')
         channel_index = session.get('channel_index')
         channel_db_id = await ChannelManager.get_channel_db_id(server_id, channel_index)
@@ -2084,9 +2677,8 @@ async def handle_client_packet(session, data):
         If player wins, increment RANK score by 5 points
         If player loses, increment RANK score by 2 points
         """    
-        player_id = data[4:12].decode('ascii').rstrip('\x00')
-        victory_flag = data[20:24]
-        is_victory = struct.unpack('<I', victory_flag)[0] == 1
+        player_id = mn_codec.cstr(data, 4, 12)
+        is_victory = mn_codec.decode_u32(data, 20) == 1
         points = 5 if is_victory else 2
         print(f"[GAME END] Player {player_id} {'VICTORY' if is_victory else 'DEFEAT'}, +{points} pts")
         await PlayerManager.add_rank_points(player_id, points)
@@ -2096,7 +2688,7 @@ async def handle_client_packet(session, data):
         # The payload is always the last 4 bytes after the 4-byte header
         if len(data) >= 8:
             payload = data[-4:]
-            print(f"[ECHO REPLY 0x03ea] Payload: {payload.hex()}")
+            log("[ECHO REPLY 0x03ea] Payload: %s", Hex(payload))
             # No lock needed for single-threaded asyncio
             echo = session.get('echo', {})
             # Prioritize readycheck reply if in progress
@@ -2106,12 +2698,25 @@ async def handle_client_packet(session, data):
                 echo['keepalive']['reply'] = True
             session['echo'] = echo  # If you’re storing a copy, but not needed if it's a ref
         else:
-            print(f"[ECHO REPLY 0x03ea] Packet too short: {data.hex()}")
+            log("[ECHO REPLY 0x03ea] Packet too short: %s", Hex(data))
 
 # --- Gameplay Loop ---
 
+    # --- Player Movement and all other Gameplay ---
+    elif pkt_id >> 8 == 0x13: # check high byte - if packet_id is 0x13XX
+        handle_gameplay_packet(session, pkt_id, data)
+
+    # --- Unhandled Packet ---
+    else:
+        print(f"[WARN] Unhandled packet ID: 0x{pkt_id:04x} from {session['addr']}")
+
+def handle_gameplay_packet(session, pkt_id, data):
+    """
+    0x13XX gameplay packets. Pure relays through the SessionRegistry lobby index:
+    synchronous (no DB, no awaits), so the protocol core can run them inside data_received.
+    """
     # --- Player Movement ---
-    elif pkt_id == 0x1388:
+    if pkt_id == 0x1388:
         try:
             parsed = parse_move_packet(data)
             # Store state for session
@@ -2124,61 +2729,41 @@ async def handle_client_packet(session, data):
             session['move_unknown1'] = parsed['unknown1']
             session['player_idx'] = parsed['player_idx']
 
-            # Figure out lobby as before
             player_id = session.get('player_id')
-            server_id = session.get('server_id')
-            channel_index = session.get('channel_index')
-            channel_db_id = await ChannelManager.get_channel_db_id(server_id, channel_index)
-            lobby_name = None
-            if channel_db_id is not None and player_id:
-                lobby_name = await LobbyManager.get_lobby_name_for_player(channel_db_id, player_id)
-
-            print(f"[1388] Movement from {player_id}: x={parsed['x_pos']:.3f} y={parsed['y_pos']:.3f} "
-                  f"player_heading={parsed['player_heading']:.3f} cam={parsed['cam_heading']:.3f} "
-                  f"LR={parsed['left_right']:02x} UD={parsed['up_down']:02x} "
-                  f"unk1={parsed['unknown1'].hex()} player_idx={parsed['player_idx'].hex()}")
+            if DEBUG:
+                log("[1388] Movement from %s: x=%.3f y=%.3f player_heading=%.3f cam=%.3f LR=%02x UD=%02x unk1=%s player_idx=%s",
+                    player_id, parsed['x_pos'], parsed['y_pos'], parsed['player_heading'], parsed['cam_heading'],
+                    parsed['left_right'], parsed['up_down'], Hex(parsed['unknown1']), Hex(parsed['player_idx']))
 
-            # Broadcast to other players in the same lobby
-            if lobby_name and channel_db_id is not None:
-                await broadcast_to_lobby(lobby_name, channel_db_id, data, note=f"[MOVE BROADCAST 0x1388]")
-            else:
-                print(f"[1388] WARNING: Could not find lobby/channel for movement broadcast for {player_id}")
+            # Relay to the players in the same lobby (routing table, no DB lookups)
+            if not relay_to_lobby(session, data, note="[MOVE BROADCAST 0x1388]", conflate=MOVE_CONFLATION):
+                log("[1388] WARNING: Could not find lobby/channel for movement broadcast for %s", player_id)
 
         except Exception as e:
-            print(f"[ERROR][1388] Failed to parse or broadcast movement packet: {e}")
+            log("[ERROR][1388] Failed to parse or broadcast movement packet: %s", e)
 
     # --- All other Gameplay ---
-    elif pkt_id >> 8 == 0x13: # check high byte - if packet_id is 0x13XX
+    else:
         player_id = session.get('player_id')
-        server_id = session.get('server_id')
-        channel_index = session.get('channel_index')
-        channel_db_id = await ChannelManager.get_channel_db_id(server_id, channel_index)
-        lobby_name = None
-        if channel_db_id is not None and player_id:
-            lobby_name = await LobbyManager.get_lobby_name_for_player(channel_db_id, player_id)
-        
-        # Broadcast to all players in the lobby
-        if lobby_name and channel_db_id is not None:
-            if pkt_id == 0x139c: # Don't self-broadcast Incident Proximity Detection
-                await broadcast_to_lobby(lobby_name, channel_db_id, data, note=f"[SCAN DETECTION {pkt_id:04x}]", cur_session=session, to_self = False)
-            elif pkt_id == 0x138c: # Don't self-broadcast Attacks (causes twice the amount of ammo consumed on shots and mags consumed on reload)
-                await broadcast_to_lobby(lobby_name, channel_db_id, data, note=f"[ATTACK {pkt_id:04x}]", cur_session=session, to_self = False)
-            elif pkt_id == 0x1390:
-                await broadcast_to_lobby(lobby_name, channel_db_id, data, note=f"[ENEMY ATTACK {pkt_id:04x}]", cur_session=session, to_self = False)
-            elif pkt_id == 0x1394:
-                await broadcast_to_lobby(lobby_name, channel_db_id, data, note=f"[ENEMY MOVE {pkt_id:04x}]")                         
-            else:
-                await broadcast_to_lobby(lobby_name, channel_db_id, data, note=f"[GAMEPLAY BROADCAST {pkt_id:04x}]")
-        else:
-            print(f"[{pkt_id:04x}] WARNING: Could not find lobby/channel for broadcast for {player_id}")
 
-    # --- Unhandled Packet ---
-    else:
-        print(f"[WARN] Unhandled packet ID: 0x{pkt_id:04x} from {session['addr']}")
+        # Relay to all players in the lobby (routing table, no DB lookups)
+        if pkt_id == 0x139c: # Don't self-broadcast Incident Proximity Detection
+            routed = relay_to_lobby(session, data, note="[SCAN DETECTION]", to_self=False)
+        elif pkt_id == 0x138c: # Don't self-broadcast Attacks (causes twice the amount of ammo consumed on shots and mags consumed on reload)
+            routed = relay_to_lobby(session, data, note="[ATTACK]", to_self=False)
+        elif pkt_id == 0x1390:
+            routed = relay_to_lobby(session, data, note="[ENEMY ATTACK]", to_self=False)
+        elif pkt_id == 0x1394:
+            routed = relay_to_lobby(session, data, note="[ENEMY MOVE]")
+        else:
+            routed = relay_to_lobby(session, data, note="[GAMEPLAY BROADCAST]")
+        if not routed:
+            log("[%04x] WARNING: Could not find lobby/channel for broadcast for %s", pkt_id, player_id)
 
 ### END OF PACKET HANDLERS ###
 
-async def handle_client(reader, writer, server_port):
+async def open_session(reader, writer, server_port):
+    """Create and register the session for a new connection (shared by both network cores)."""
     addr = writer.get_extra_info('peername')
     host = writer.get_extra_info('sockname')[0]
 
@@ -2199,19 +2784,59 @@ async def handle_client(reader, writer, server_port):
         },
         'countdown_in_progress': False,
     }
-    # Add to global sessions
-    async with sessions_lock:
-        sessions[addr] = session
-        print(f"[CONNECT] New connection from {addr}")
-
+    session['sendq'] = SendQueue(session)
+    # Add to global session registry
+    SessionRegistry.add(session)
+    KeepaliveScheduler.track(session)
+    print(f"[CONNECT] New connection from {addr}")
+    return session
+
+async def dispatch_packet(session, data):
+    """
+    Handle a client packet. In multi-process mode, returns the worker the connection
+    must be handed to instead (data is then left unhandled for that worker).
+    """
+    if ShardManager.index is not None:
+        target = ShardManager.route(session, data)
+        if target is not None:
+            return target
+    await handle_client_packet(session, data)
+
+async def handle_client(reader, writer, server_port, handoff=None):
+    session = await open_session(reader, writer, server_port)
+    addr = session['addr']
+
+    framer = mn_codec.PacketFramer()
+    chunk = None
+    if handoff is not None:
+        # Socket handed over by another worker: resume with the bytes it had not handled
+        state, chunk = handoff
+        ShardManager.restore_state(session, state)
     try:
         while True:
-            header = await reader.readexactly(4)
-            pkt_id, payload_len = struct.unpack('<HH', header)
-            payload = await reader.readexactly(payload_len)
-            data = header + payload
-            print(f"[RECV] From {addr}: {data.hex()} (pkt_id={pkt_id:04x}, {payload_len} bytes)")
-            await handle_client_packet(session, data)
+            # One read per chunk; packets are framed as memoryviews of it (no per-packet copies)
+            if not chunk:
+                chunk = await reader.read(RECV_CHUNK)
+                if not chunk:
+                    print(f"[DISCONNECT] {addr} disconnected.")
+                    break
+            packets = framer.feed(chunk)
+            chunk = None
+            for i, data in enumerate(packets):
+                pkt_id = data[0] | data[1] << 8
+                if DEBUG:
+                    log("[RECV] From %s: %s (pkt_id=%04x, %d bytes)", addr, Hex(data), pkt_id, len(data) - 4)
+                if not is_relay_packet(pkt_id):
+                    # Handlers may keep parts of it; only relayed packets stay views of the chunk
+                    data = bytes(data)
+                target = await dispatch_packet(session, data)
+                if target is not None:
+                    writer.transport.pause_reading()
+                    # feed_eof lets read() return whatever the stream already buffered
+                    reader.feed_eof()
+                    pending = b''.join([*map(bytes, packets[i:]), framer.tail, await reader.read()])
+                    await ShardManager.hand_off(session, target, pending)
+                    return
     except asyncio.IncompleteReadError:
         print(f"[DISCONNECT] {addr} disconnected.")
     except Exception as e:
@@ -2219,14 +2844,439 @@ async def handle_client(reader, writer, server_port):
     finally:
         await full_disconnect(session)
 
+class TransportWriter:
+    """
+    StreamWriter-shaped adapter over a raw transport for the protocol core, so
+    SendQueue, full_disconnect and the echo watchers work unchanged. drain()
+    only waits while the transport has paused writing (buffer over its high-water mark).
+    """
+    def __init__(self, transport):
+        self.transport = transport
+        self._loop = asyncio.get_running_loop()
+        self._paused = False
+        self._drain_waiter = None
+        self._closed = self._loop.create_future()
+
+    def write(self, data):
+        self.transport.write(data)
+
+    def writelines(self, data):
+        self.transport.writelines(data)
+
+    def get_extra_info(self, name, default=None):
+        return self.transport.get_extra_info(name, default)
+
+    def is_closing(self):
+        return self.transport.is_closing()
+
+    def close(self):
+        self.transport.close()
+
+    async def wait_closed(self):
+        await self._closed
+
+    async def drain(self):
+        if self.transport.is_closing():
+            raise ConnectionResetError("Connection lost")
+        if self._paused:
+            self._drain_waiter = self._loop.create_future()
+            await self._drain_waiter
+
+    def pause_writing(self):
+        self._paused = True
+
+    def resume_writing(self):
+        self._paused = False
+        self._wake(None)
+
+    def connection_lost(self):
+        self._wake(ConnectionResetError("Connection lost"))
+        if not self._closed.done():
+            self._closed.set_result(None)
+
+    def _wake(self, exc):
+        waiter, self._drain_waiter = self._drain_waiter, None
+        if waiter is not None and not waiter.done():
+            if exc is None:
+                waiter.set_result(None)
+            else:
+                waiter.set_exception(exc)
+
+class ClientProtocol(asyncio.Protocol):
+    """
+    Callback-based connection handler (NET_CORE = "protocol").
+    data_received frames packets straight out of the received bytes. 0x13XX
+    relays are dispatched synchronously inside the callback when nothing is
+    queued ahead of them. Every other packet (handlers that await the DB), and
+    anything arriving behind one, runs in order on a per-connection task.
+    """
+    def __init__(self, server_port, handoff=None):
+        self.server_port = server_port
+        self.handoff = handoff  # (state, unhandled bytes) for a socket handed over by another worker
+        self.framer = mn_codec.PacketFramer()
+        self.transport = None
+        self.writer = None
+        self.addr = None
+        self.session = None
+        self.backlog = collections.deque()
+        self.task = None
+        self.lost = False
+        self.reading_paused = False
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.writer = TransportWriter(transport)
+        self.addr = transport.get_extra_info('peername')
+        # The session needs a DB lookup, so it is opened as the task's first step
+        self.task = asyncio.create_task(self._run())
+        if self.handoff is not None and self.handoff[1]:
+            self.data_received(self.handoff[1])
+
+    def data_received(self, chunk):
+        session = self.session
+        for data in self.framer.feed(chunk):
+            pkt_id = data[0] | data[1] << 8
+            if DEBUG:
+                log("[RECV] From %s: %s (pkt_id=%04x, %d bytes)", self.addr, Hex(data), pkt_id, len(data) - 4)
+            if self.task is None and pkt_id >> 8 == 0x13:
+                touch_packet_time(session)
+                handle_gameplay_packet(session, pkt_id, data)
+                continue
+            # Handlers may keep parts of it; only relayed packets stay views of the chunk
+            self.backlog.append(data if is_relay_packet(pkt_id) else bytes(data))
+            if self.task is None:
+                self.task = asyncio.create_task(self._run())
+        if len(self.backlog) >= RECV_BACKLOG_MAX and not self.reading_paused:
+            self.reading_paused = True
+            self.transport.pause_reading()
+
+    async def _run(self):
+        try:
+            if self.session is None:
+                self.session = await open_session(None, self.writer, self.server_port)
+                if self.handoff is not None:
+                    ShardManager.restore_state(self.session, self.handoff[0])
+            while self.backlog and not self.lost:
+                data = self.backlog.popleft()
+                target = await dispatch_packet(self.session, data)
+                if target is not None:
+                    self.transport.pause_reading()
+                    pending = b''.join([bytes(data), *map(bytes, self.backlog), self.framer.tail])
+                    self.backlog.clear()
+                    if not await ShardManager.hand_off(self.session, target, pending):
+                        self.transport.abort()
+                    return
+                if self.reading_paused and len(self.backlog) < RECV_BACKLOG_MAX // 2:
+                    self.reading_paused = False
+                    self.transport.resume_reading()
+        except Exception as e:
+            print(f"[CLIENT ERROR] {self.addr}: {e}")
+            self.transport.abort()
+        finally:
+            self.task = None
+            if self.lost and self.session is not None:
+                await full_disconnect(self.session)
+
+    def pause_writing(self):
+        self.writer.pause_writing()
+
+    def resume_writing(self):
+        self.writer.resume_writing()
+
+    def connection_lost(self, exc):
+        print(f"[DISCONNECT] {self.addr} disconnected.")
+        self.lost = True
+        self.writer.connection_lost()
+        # A running task disconnects the session itself once its current handler returns
+        if self.task is None and self.session is not None:
+            asyncio.create_task(full_disconnect(self.session))
+
 async def start_server(host, listen_port):
-    server = await asyncio.start_server(
-        lambda r, w: handle_client(r, w, listen_port),
-        host, listen_port
-    )
-    print(f"[SERVER] LISTENING on {host}:{listen_port}")
+    # Workers share the listening ports; the kernel spreads new connections between them
+    reuse_port = True if ShardManager.index is not None else None
+    if NET_CORE == "protocol":
+        loop = asyncio.get_running_loop()
+        server = await loop.create_server(lambda: ClientProtocol(listen_port), host, listen_port,
+                                          reuse_port=reuse_port)
+    else:
+        server = await asyncio.start_server(
+            lambda r, w: handle_client(r, w, listen_port),
+            host, listen_port, reuse_port=reuse_port
+        )
+    print(f"[SERVER] LISTENING on {host}:{listen_port} ({NET_CORE} core)")
     return server
 
+### MULTI-PROCESS MODE (MN_WORKERS > 1) ###
+# A supervisor resets the DB once and forks WORKERS processes that all listen on both
+# ports with SO_REUSEPORT. Every channel has one owner worker holding its lobby state;
+# when a client joins a channel owned by another worker, the accepting worker hands the
+# client's socket itself to the owner (SCM_RIGHTS over a Unix datagram socket), so all
+# lobby traffic, 0x13XX relay included, stays inside one process with no extra hop.
+# Server/channel counts are DB counters updated by whichever worker holds the session.
+
+# Handoff datagram: message type, JSON length, then the JSON and any raw bytes
+HANDOFF_HEAD = struct.Struct('<BI')
+HANDOFF_SESSION = 1  # + 1 fd: session state (JSON), then received bytes not yet handled
+HANDOFF_KICK = 2     # player_id (JSON): duplicate login sweep for that player
+
+class ShardManager:
+    index = None           # This worker's index (None: single-process mode)
+    count = 1
+    socket_dir = None
+    _sock = None           # Bound AF_UNIX datagram socket (receives handoffs, sends to peers)
+
+    # Restarted worker: give back the counts of the sessions that died with the old process
+    DBManager.register(
+        "shard_server_release",
+        "UPDATE servers SET player_count = GREATEST(player_count - $1, 0) WHERE id = $2",
+        "UPDATE servers SET player_count = MAX(player_count - $1, 0) WHERE id = $2"
+    )
+    DBManager.register("shard_server_availability", """
+        UPDATE servers
+        SET availability = CASE WHEN player_count >= 640 THEN 2 WHEN player_count >= 320 THEN 1 ELSE 0 END
+        WHERE id = $1
+    """)
+    DBManager.register("shard_channel_reset", "UPDATE channels SET player_count = 0 WHERE id = $1")
+    DBManager.register("shard_lobbies_reset", "DELETE FROM lobbies WHERE channel_id = $1 AND name NOT LIKE $2")
+
+    @classmethod
+    def supported(cls):
+        return hasattr(os, "fork") and hasattr(socket, "SO_REUSEPORT") and hasattr(socket, "SCM_RIGHTS")
+
+    @classmethod
+    def owner_of(cls, server_id, channel_index):
+        return (server_id * mn_codec.MAX_CHANNELS + channel_index) % cls.count
+
+    @classmethod
+    def socket_path(cls, index):
+        return os.path.join(cls.socket_dir, f"worker{index}.sock")
+
+    @classmethod
+    async def reclaim_channels(cls, index):
+        """
+        Worker restart: every session in the channels worker index owns died with the old
+        process. Zero those channel counts, take them off their servers' counts and drop the
+        channels' lobbies (Test rooms stay, as at startup). Call before accepting clients or handoffs.
+        """
+        server_ids = ClusterManager.server_ids if NODE_SERVERS else [server.id for server in await ServerManager.get_servers()]
+        statements = []
+        released = 0
+        for server_id in server_ids:
+            lost = 0
+            for channel in await ChannelManager.get_channels_for_server(server_id):
+                if cls.owner_of(server_id, channel.channel_index) != index:
+                    continue
+                lost += channel.player_count
+                statements.append((DBManager.sql("shard_channel_reset"), (channel.id,)))
+                statements.append((DBManager.sql("shard_lobbies_reset"), (channel.id, '%Test%')))
+            if lost:
+                statements.append((DBManager.sql("shard_server_release"), (lost, server_id)))
+                statements.append((DBManager.sql("shard_server_availability"), (server_id,)))
+                released += lost
+        await DBManager.execute_batch(statements)
+        builtins.print(f"[SHARD] Worker {index} restarted: released {released} players from its channels.")
+
+    @classmethod
+    async def start(cls, index):
+        cls.index = index
+        path = cls.socket_path(index)
+        if os.path.exists(path):
+            os.unlink(path)
+        cls._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        cls._sock.bind(path)
+        cls._sock.setblocking(False)
+        asyncio.get_running_loop().add_reader(cls._sock.fileno(), cls._on_datagram)
+        print(f"[SHARD] Worker {index}/{cls.count} accepting handoffs on {path}")
+
+    @classmethod
+    async def _send(cls, index, message, fds=()):
+        path = cls.socket_path(index)
+        for attempt in range(SHARD_SEND_RETRIES):
+            try:
+                # socket.send_fds() ignores its address argument, so build the SCM_RIGHTS message here
+                ancillary = [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array("i", fds))] if fds else []
+                cls._sock.sendmsg([message], ancillary, 0, path)
+                return
+            except (BlockingIOError, FileNotFoundError, ConnectionRefusedError):
+                # Peer queue full, or the peer is still (re)starting
+                await asyncio.sleep(0.1)
+        raise ConnectionError(f"worker {index} is unreachable")
+
+    # ----- session state handoff -----
+    @classmethod
+    def session_state(cls, session):
+        return {
+            'player_id': session.get('player_id'),
+            'channel_index': session.get('channel_index'),
+            'server_counted': bool(session.get('server_counted')),
+        }
+
+    @classmethod
+    def restore_state(cls, session, state):
+        if state.get('player_id'):
+            SessionRegistry.set_player(session, state['player_id'])
+            # A profile cached on an earlier visit may be stale; the channel join reloads it
+            PlayerManager.invalidate(state['player_id'])
+        if state.get('channel_index') is not None:
+            SessionRegistry.set_channel(session, state['channel_index'])
+        session['server_counted'] = state.get('server_counted', False)
+        print(f"[SHARD] Adopted {session['addr']} ({state.get('player_id')}) on worker {cls.index}")
+
+    @classmethod
+    def route(cls, session, data):
+        """Returns the worker that must take this connection before data is handled, or None."""
+        pkt_id = data[0] | data[1] << 8
+        if pkt_id != mn_codec.CHANNEL_JOIN or session.get('server_id') is None or len(data) < 22:
+            return None
+        owner = cls.owner_of(session['server_id'], mn_codec.decode_channel_join(data)["channel_index"])
+        return owner if owner != cls.index else None
+
+    @classmethod
+    async def hand_off(cls, session, target, pending):
+        """
+        Give the client's socket to worker target, with the session state and the
+        received bytes not handled yet (pending starts with the packet that triggered it).
+        Reading must already be paused. Returns False if the client had to be dropped.
+        """
+        # No more packets for this session here; counts move with it (server_counted)
+        SessionRegistry.remove(session)
+        if session.get('player_id') and not SessionRegistry.by_player(session['player_id']):
+            # Ranks can change while the player is on another worker
+            PlayerManager.invalidate(session['player_id'])
+        writer = session['writer']
+        transport = writer.transport
+        # Everything already queued must reach the socket before the other worker writes to it
+        session['sendq'].close()
+        deadline = time.monotonic() + SHARD_HANDOFF_TIMEOUT
+        while transport.get_write_buffer_size():
+            if transport.is_closing() or time.monotonic() > deadline:
+                print(f"[SHARD] {session['addr']} did not drain before handoff.")
+                return False
+            await asyncio.sleep(0.005)
+        state = json.dumps(cls.session_state(session)).encode()
+        message = b''.join((HANDOFF_HEAD.pack(HANDOFF_SESSION, len(state)), state, pending))
+        try:
+            await cls._send(target, message, [transport.get_extra_info('socket').fileno()])
+        except OSError as e:
+            print(f"[SHARD] Handoff of {session['addr']} to worker {target} failed: {e}")
+            return False
+        # The socket lives on in the target worker; only this process's descriptor closes.
+        # Its directory entry stays claimed until now, so a failed handoff still releases it on disconnect.
+        SessionDirectory.forget(session)
+        session['removed'] = True
+        transport.abort()
+        print(f"[SHARD] {session['addr']} handed off to worker {target}")
+        return True
+
+    @classmethod
+    def kick_elsewhere(cls, player_id):
+        """Run the duplicate-session sweep for player_id on every other worker."""
+        payload = json.dumps(player_id).encode()
+        message = HANDOFF_HEAD.pack(HANDOFF_KICK, len(payload)) + payload
+
+        async def kick(index):
+            try:
+                await cls._send(index, message)
+            except ConnectionError as e:
+                print(f"[SHARD] Kick of {player_id} on worker {index} skipped: {e}")
+
+        for index in range(cls.count):
+            if index != cls.index:
+                asyncio.create_task(kick(index))
+
+    @classmethod
+    def _on_datagram(cls):
+        while True:
+            try:
+                message, fds, flags, _ = socket.recv_fds(cls._sock, SHARD_HANDOFF_MAX, 1)
+            except BlockingIOError:
+                return
+            if flags & (socket.MSG_TRUNC | socket.MSG_CTRUNC):
+                print("[SHARD] Dropped a truncated handoff.")
+                for fd in fds:
+                    os.close(fd)
+                continue
+            msg_type, length = HANDOFF_HEAD.unpack_from(message)
+            body = HANDOFF_HEAD.size + length
+            state = json.loads(message[HANDOFF_HEAD.size:body])
+            if msg_type == HANDOFF_SESSION and fds:
+                asyncio.create_task(cls._adopt(fds[0], state, message[body:]))
+            elif msg_type == HANDOFF_KICK:
+                for s in SessionRegistry.by_player(state):
+                    if not s.get('removed'):
+                        print(f"[SHARD] Player {state} joined a channel on another worker: disconnecting this session.")
+                        asyncio.create_task(full_disconnect(s))
+
+    @classmethod
+    async def _adopt(cls, fd, state, pending):
+        """Serve a handed-off client socket on this worker's network core."""
+        sock = socket.socket(fileno=fd)
+        sock.setblocking(False)
+        handoff = (state, pending)
+        try:
+            if NET_CORE == "protocol":
+                await asyncio.get_running_loop().connect_accepted_socket(
+                    lambda: ClientProtocol(SERVER_PORT, handoff), sock)
+            else:
+                reader, writer = await asyncio.open_connection(sock=sock)
+                asyncio.create_task(handle_client(reader, writer, SERVER_PORT, handoff))
+        except OSError as e:
+            print(f"[SHARD] Could not adopt handed-off socket: {e}")
+            sock.close()
+
+def run_supervisor():
+    """Reset shared DB state once, then fork and babysit WORKERS gameplay worker processes."""
+    asyncio.run(init_database(reset=True, close=True))
+    ShardManager.count = WORKERS
+    ShardManager.socket_dir = tempfile.mkdtemp(prefix="mn_workers_")
+    workers = {}
+    stopping = False
+
+    def spawn(index, restarted=False):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                signal.signal(signal.SIGINT, signal.SIG_DFL)
+                install_event_loop()
+                asyncio.run(main(worker_index=index, restarted=restarted))
+            except (KeyboardInterrupt, SystemExit):
+                pass
+            except Exception as e:
+                builtins.print(f"[WORKER {index}] crashed: {e!r}")
+                code = 1
+            finally:
+                os._exit(code)
+        workers[pid] = index
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for index in range(WORKERS):
+        spawn(index)
+    builtins.print(f"[SUPERVISOR] {WORKERS} workers on {HOST}:{TCP_PORT}/{SERVER_PORT} (SO_REUSEPORT)")
+    try:
+        while workers:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            index = workers.pop(pid, None)
+            if index is not None and not stopping:
+                builtins.print(f"[SUPERVISOR] Worker {index} exited (status {status}), restarting.")
+                spawn(index, restarted=True)
+    finally:
+        shutil.rmtree(ShardManager.socket_dir, ignore_errors=True)
+
 async def full_disconnect(session):
     if session.get('removed'):
         return
@@ -2250,12 +3300,18 @@ async def full_disconnect(session):
     if lobby_name and channel_db_id is not None:
         lobby = await LobbyManager.get_lobby_by_name(lobby_name, channel_db_id)
 
-    # Mark as removed and remove from sessions
+    # Mark as removed and remove from the session registry (all indexes)
     session['removed'] = True
-    async with sessions_lock:
-        sessions.pop(addr, None)
-
-    # Close writer if not already closed
+    SessionRegistry.remove(session)
+    if player_id and not SessionRegistry.by_player(player_id):
+        # Last local session gone: drop the cached profile
+        PlayerManager.invalidate(player_id)
+    await SessionDirectory.release(session)
+
+    # Flush what is still queued, then close writer if not already closed
+    sendq = session.get('sendq')
+    if sendq:
+        sendq.close()
     writer = session.get('writer')
     if writer and not writer.is_closing():
         try:
@@ -2314,6 +3370,8 @@ async def admin_command_loop():
             elif cmd.lower() == "help":
                 print("Commands:")
                 print("  sendhex HEXSTRING     # Send raw hex packet to all clients")
+                print("  kick PLAYER_ID        # Disconnect a player wherever they are connected")
+                print("  whereis PLAYER_ID     # Show which node holds a player's session")
                 print("  quit                  # Exit admin console")
             elif cmd.lower().startswith("sendhex "):
                 hex_str = cmd.split(" ", 1)[1]
@@ -2325,6 +3383,14 @@ async def admin_command_loop():
                 # Await the async broadcast function
                 await broadcast_manual_packet(payload, note="ADMIN TERMINAL")
                 print(f"[ADMIN] Sent {len(payload)} bytes to all clients.")
+            elif cmd.lower().startswith("kick "):
+                player_id = cmd.split(" ", 1)[1].strip()
+                closed = await SessionDirectory.kick(player_id)
+                print(f"[ADMIN] Kicked {player_id} ({closed} local session(s)).")
+            elif cmd.lower().startswith("whereis "):
+                player_id = cmd.split(" ", 1)[1].strip()
+                owner = await SessionDirectory.lookup(player_id)
+                print(f"[ADMIN] {player_id}: {owner or 'not connected'}")
             else:
                 print("Unknown command. Type 'help' for help.")
         except EOFError:
@@ -2332,99 +3398,144 @@ async def admin_command_loop():
         except KeyboardInterrupt:
             break
 
-async def quick_join_timeout_watcher():
-    # Run periodically to check all sessions for quick join timeouts
-    while True:
-        now = time.time()
-        async with sessions_lock:
-            for session in list(sessions.values()):
-                if 'quick_join_lobby_idx' in session and 'quick_join_time' in session:
-                    elapsed = now - session['quick_join_time']
-                    if elapsed > 5:
-                        print(f"[QUICK JOIN TIMEOUT] No valid join received after 5s, sending error to {session.get('addr')}")
-                        error_packet = build_lobby_join_ack(success=False, val=0x02)  # An error occured during transmission
-                        await send_packet_to_client(session, error_packet, note="[QUICK JOIN TIMEOUT]")
-                        session.pop('quick_join_lobby_idx', None)
-                        session.pop('quick_join_lobby_name', None)
-                        session.pop('quick_join_time', None)
-        await asyncio.sleep(1)
-
-async def echo_watcher():
-    while True:
-        now = time.time()
-        # snapshot all current sessions
-        async with sessions_lock:
-            active_sessions = list(sessions.values())
-        for session in active_sessions:
-            player_id = session.get('player_id')
-            if not player_id:
-                continue
-            # Only send echo to gameplay clients
-            #if session['addr'][1] != CLIENT_GAMEPLAY_PORT:
-            #    continue
-            if session.get('countdown_in_progress', False):
-                continue
+class SessionTimers:
+    """
+    Per-session deadlines in one heap, served by a single task.
+    A session holds at most one deadline per timer name; scheduling again supersedes the
+    old entry, which is skipped when it comes due. Each due `callback(session, now)` runs in
+    its own task, so a callback stuck on one client (e.g. a disconnect waiting on the DB)
+    does not hold back other sessions' deadlines.
+    """
+    _heap = []  # [(deadline, seq, session, name, callback)]
+    _seq = itertools.count()
+    _wakeup = None
+    _running = set()  # Callback tasks still in flight (strong refs until they finish)
 
-            # Use a simple global last_packet_times dict, you may want an asyncio.Lock for atomic access
-            last_time = last_packet_times.get(player_id, 0)
-            if now - last_time <= ECHO_TIMEOUT:
-                continue
-            if session['echo']['keepalive']['in_progress']:
-                continue
+    @classmethod
+    def schedule(cls, session, name, deadline, callback):
+        session.setdefault('timers', {})[name] = deadline
+        earliest = cls._heap[0][0] if cls._heap else None
+        heapq.heappush(cls._heap, (deadline, next(cls._seq), session, name, callback))
+        if cls._wakeup is not None and (earliest is None or deadline < earliest):
+            cls._wakeup.set()
 
-            # Use an async function to check if session is alive if possible, or just leave it sync
-            if not is_session_socket_alive(session):
-                print(f"[ECHO CHECK] Socket dead for {player_id}, immediate kick.")
-                await full_disconnect(session)
-                continue
+    @classmethod
+    def cancel(cls, session, name):
+        session.get('timers', {}).pop(name, None)
 
-            session['echo']['keepalive']['in_progress'] = True
-            session['echo']['keepalive']['token'] = uuid.uuid4().hex
-            session['echo']['keepalive']['reply'] = False
-            echo_token = session['echo']['keepalive']['token']
+    @classmethod
+    async def run(cls):
+        cls._wakeup = asyncio.Event()
+        while True:
+            now = time.time()
+            while cls._heap and cls._heap[0][0] <= now:
+                deadline, _, session, name, callback = heapq.heappop(cls._heap)
+                timers = session.get('timers', {})
+                if session.get('removed') or timers.get(name) != deadline:
+                    continue
+                del timers[name]
+                task = asyncio.create_task(cls._fire(session, name, callback, now))
+                cls._running.add(task)
+                task.add_done_callback(cls._running.discard)
+            timeout = cls._heap[0][0] - time.time() if cls._heap else None
+            cls._wakeup.clear()
+            try:
+                await asyncio.wait_for(cls._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
 
-            print(f"[ECHO CHECK] {player_id} idle for {int(now - last_time)}s, sending echo challenge...")
+    @classmethod
+    async def _fire(cls, session, name, callback, now):
+        try:
+            await callback(session, now)
+        except Exception as e:
+            print(f"[TIMER ERROR] {name} failed for {session.get('addr')}: {e}")
 
-            # Launch an echo challenge (one per session)
-            asyncio.create_task(
-                echo_per_session(session, player_id, echo_token)
-            )
-        await asyncio.sleep(WATCHER_SLEEP_TIME)
+async def on_quick_join_timeout(session, now):
+    if 'quick_join_lobby_idx' not in session:
+        return
+    print(f"[QUICK JOIN TIMEOUT] No valid join received after {QUICK_JOIN_TIMEOUT}s, sending error to {session.get('addr')}")
+    error_packet = build_lobby_join_ack(success=False, val=0x02)  # An error occured during transmission
+    await send_packet_to_client(session, error_packet, note="[QUICK JOIN TIMEOUT]")
+    session.pop('quick_join_lobby_idx', None)
+    session.pop('quick_join_lobby_name', None)
 
-async def echo_per_session(session, player_id, echo_token):
-    try:
-        for i in range(ECHO_RESPONSE_WAIT):
-            if not is_session_socket_alive(session):
-                print(f"[ECHO THREAD] Socket dead for {player_id}, kicking immediately from echo thread.")
-                await on_echo_result(False, session, player_id, echo_token)
-                return
-            if session['echo']['keepalive']['token'] != echo_token:
-                print(f"[ECHO THREAD] Token changed for {player_id}, another echo thread is running or session replaced. Abort.")
-                return
-            try:
-                await send_echo_challenge(session)
-            except Exception as e:
-                print(f"[ECHO ERROR] Failed to send echo to {player_id}: {e}")
-                await on_echo_result(False, session, player_id, echo_token)
-                return
-            await asyncio.sleep(1)
-            if session['echo']['keepalive']['reply']:
-                print(f"[ECHO REPLY] {player_id} replied on attempt {i+1}.")
-                await on_echo_result(True, session, player_id, echo_token)
-                return
-        await on_echo_result(False, session, player_id, echo_token)
-    finally:
-        session['echo']['keepalive']['in_progress'] = False
+class KeepaliveScheduler:
+    """
+    Echo keepalives driven by one 'keepalive' SessionTimers deadline per session.
+    Packet receipt only updates last_packet_times; when the deadline comes due the session
+    is re-checked and, if it has been active, simply rescheduled for ECHO_TIMEOUT after its
+    last packet. Idle sessions get an echo challenge once per second (the same deadline)
+    until they reply or ECHO_RESPONSE_WAIT challenges go unanswered.
+    """
+
+    @classmethod
+    def track(cls, session):
+        """Start keepalive checks for a new session."""
+        cls.schedule(session, time.time() + ECHO_TIMEOUT)
+
+    @classmethod
+    def schedule(cls, session, deadline):
+        SessionTimers.schedule(session, 'keepalive', deadline, cls._expire)
+
+    @classmethod
+    async def _expire(cls, session, now):
+        player_id = session.get('player_id')
+        keepalive = session['echo']['keepalive']
+        if keepalive['in_progress']:
+            await cls._challenge(session, player_id, now)
+            return
+        # Only logged-in players are challenged; countdowns are left alone until they end
+        if not player_id or session.get('countdown_in_progress', False):
+            cls.schedule(session, now + WATCHER_SLEEP_TIME if player_id else now + ECHO_TIMEOUT)
+            return
+        last_time = last_packet_times.get(player_id, 0)
+        if now - last_time < ECHO_TIMEOUT:
+            cls.schedule(session, last_time + ECHO_TIMEOUT)
+            return
+        if not is_session_socket_alive(session):
+            print(f"[ECHO CHECK] Socket dead for {player_id}, immediate kick.")
+            await full_disconnect(session)
+            return
+
+        keepalive['in_progress'] = True
+        keepalive['token'] = uuid.uuid4().hex
+        keepalive['reply'] = False
+        keepalive['attempts'] = 0
+        print(f"[ECHO CHECK] {player_id} idle for {int(now - last_time)}s, sending echo challenge...")
+        await cls._challenge(session, player_id, now)
+
+    @classmethod
+    async def _challenge(cls, session, player_id, now):
+        """One step of a running challenge: check for a reply, else send the next echo."""
+        keepalive = session['echo']['keepalive']
+        token = keepalive['token']
+        if keepalive['reply']:
+            print(f"[ECHO REPLY] {player_id} replied on attempt {keepalive['attempts']}.")
+            keepalive['in_progress'] = False
+            await on_echo_result(True, session, player_id, token)
+            cls.schedule(session, now + ECHO_TIMEOUT)
+            return
+        if keepalive['attempts'] >= ECHO_RESPONSE_WAIT or not is_session_socket_alive(session):
+            keepalive['in_progress'] = False
+            await on_echo_result(False, session, player_id, token)
+            return
+        try:
+            await send_echo_challenge(session)
+        except Exception as e:
+            print(f"[ECHO ERROR] Failed to send echo to {player_id}: {e}")
+            keepalive['in_progress'] = False
+            await on_echo_result(False, session, player_id, token)
+            return
+        keepalive['attempts'] += 1
+        cls.schedule(session, now + 1)
 
 async def broadcast_manual_packet(payload: bytes, note="MANUAL BROADCAST"):
     """
     Broadcast a manual packet to all currently connected sessions (asyncio version).
     `payload` should be a complete packet (header + payload), e.g. from struct.pack or a hex string.
     """
-    # If you keep sessions in a global dict:
-    async with sessions_lock:
-        sessions_list = list(sessions.values())  # snapshot for iteration
-    for session in sessions_list:
+    for session in SessionRegistry.all():
         try:
             await send_packet_to_client(session, payload, note=note)
         except Exception as e:
@@ -2440,13 +3551,20 @@ async def on_echo_result(success, session, player_id, token):
         print(f"[ECHO SUCCESS] {player_id} replied successfully, no action needed.")
         return
     print(f"[ECHO FAIL] {player_id} did not reply, disconnecting.")
+    # An unresponsive peer may have stopped reading: drop the socket instead of waiting on a graceful close
+    writer = session.get('writer')
+    if writer:
+        writer.transport.abort()
     await full_disconnect(session)
 
 async def update_last_packet_time(session):
+    async with last_packet_lock:
+        touch_packet_time(session)
+
+def touch_packet_time(session):
     player_id = session.get('player_id')
     if player_id:
-        async with last_packet_lock:
-            last_packet_times[player_id] = time.time()
+        last_packet_times[player_id] = time.time()
 
 def is_session_socket_alive(session):
     writer = session.get('writer')
@@ -2455,7 +3573,7 @@ def is_session_socket_alive(session):
     transport = writer.transport
     return not transport.is_closing()
 
-async def main():
+async def init_database(reset=True, close=False):
     # Init DB
     if dbtype == "postgres":
         dsn = get_postgres_dsn()
@@ -2464,8 +3582,30 @@ async def main():
         sqlite_file = os.environ.get("SQLITE_FILE", "mysticnights.db")
         schema_file = os.environ.get("SQLITE_SCHEMA", "mn_sqlite_schema.sql")
         await DBManager.init(dbtype="sqlite", sqlite_file=sqlite_file, schema_file=schema_file)
-    # Clear orphaned lobbies (async now!)
-    await ServerManager.init_server()
+    try:
+        if reset and NODE_SERVERS:
+            # Cluster mode: only this node's servers rows are reset
+            await ClusterManager.register()
+        elif reset:
+            # Clear orphaned lobbies (async now!)
+            await ServerManager.init_server()
+    except Exception:
+        # Open DB connections would keep the process alive
+        await DBManager.close()
+        raise
+    if close:
+        await DBManager.close()
+
+async def main(worker_index=None, restarted=False):
+    # In multi-process mode the supervisor already reset the shared DB state
+    await init_database(reset=worker_index is None)
+    if worker_index is not None:
+        if restarted:
+            await ShardManager.reclaim_channels(worker_index)
+        await ShardManager.start(worker_index)
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    # Lobby state is held in memory from here on
+    await LobbyStateEngine.load()
     # Start both servers
     manager_server = await start_server(HOST, TCP_PORT)
     gameplay_server = await start_server(HOST, SERVER_PORT)    
@@ -2473,14 +3613,46 @@ async def main():
     asyncio.create_task(manager_server.serve_forever())
     # Gameplay/Server
     asyncio.create_task(gameplay_server.serve_forever())
-    # Echo Watcher
-    asyncio.create_task(echo_watcher())
-    # Quick Join Timeout Watcher
-    asyncio.create_task(quick_join_timeout_watcher())
-    # Optionally start admin command loop
-    asyncio.create_task(admin_command_loop())
+    # Per-session deadlines (echo keepalive, quick join timeout)
+    asyncio.create_task(SessionTimers.run())
+    # Lobby state write-behind
+    asyncio.create_task(LobbyStateEngine.run_flusher())
+    # Optionally start admin command loop (one console per terminal: worker 0 only)
+    if not worker_index:
+        asyncio.create_task(admin_command_loop())
+        # Cluster node liveness (one heartbeat per node, not per worker)
+        if NODE_SERVERS:
+            asyncio.create_task(ClusterManager.run_heartbeat())
+    # Cluster-wide one-session-per-player directory (one owner per worker)
+    if NODE_SERVERS:
+        await SessionDirectory.start()
     # Wait forever
-    await asyncio.Event().wait()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        # Persist pending lobby state before exiting
+        await LobbyStateEngine.flush()
+        if NODE_SERVERS and not worker_index:
+            await ClusterManager.leave()
+
+def install_event_loop():
+    """Install uvloop's loop policy if EVENT_LOOP asks for it; returns the loop actually used."""
+    if EVENT_LOOP != "uvloop":
+        return "asyncio"
+    try:
+        import uvloop
+    except ImportError:
+        builtins.print("[SERVER] MN_EVENT_LOOP=uvloop but uvloop is not installed, using the asyncio loop.")
+        return "asyncio"
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return "uvloop"
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    if WORKERS > 1 and ShardManager.supported():
+        run_supervisor()
+    else:
+        if WORKERS > 1:
+            builtins.print("[SERVER] MN_WORKERS needs os.fork and SO_REUSEPORT, running a single process.")
+        loop_name = install_event_loop()
+        print(f"[SERVER] Event loop: {loop_name}")
+        asyncio.run(main())
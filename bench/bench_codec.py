@@ -0,0 +1,147 @@
+"""
+Microbenchmark: per-packet encode/decode cost of the legacy struct.pack/slice
+builders vs the precompiled mn_codec layer.
+
+Usage (from the repo root):
+    python bench/bench_codec.py [--number N]
+"""
+import argparse
+import os
+import struct
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import mn_codec
+
+# ========== LEGACY (pre-codec) IMPLEMENTATIONS ==========
+def legacy_result(packet_id, success=True, val=1):
+    if success:
+        flag = b'\x01\x00\x00\x00'
+    else:
+        flag = b'\x00'
+    payload = flag + struct.pack('<H', val)
+    header = struct.pack('<HH', packet_id, len(payload))
+    return header + payload
+
+def legacy_channel_list(entries):
+    flag = b'\x01\x00\x00\x00'
+    packed = [struct.pack('<III', cid, cur, 80) for cid, cur in entries]
+    payload = flag + b''.join(packed)
+    return struct.pack('<HH', 0x0bbb, len(payload)) + payload
+
+def legacy_lobby_list(lobbies):
+    entry_struct = '<III16s1s12s1sB1s'
+    entries = [None] * 20
+    for idx, count, name, pw, status in lobbies:
+        name_enc = name.encode('euc-kr', errors='replace')[:16].ljust(16, b'\x00')
+        pw_enc = pw.encode('euc-kr', errors='replace')[:12].ljust(12, b'\x00')
+        entries[idx] = struct.pack(entry_struct, idx, count, 4, name_enc, b'\x00', pw_enc, b'\x00', status, b'\x00')
+    for idx in range(20):
+        if entries[idx] is None:
+            name = f"Lobby{idx+1}".encode('euc-kr')[:16].ljust(16, b'\x00')
+            entries[idx] = struct.pack(entry_struct, idx, 0, 4, name, b'\x00', b''.ljust(12, b'\x00'), b'\x00', 0, b'\x00')
+    payload = b'\x01\x00\x00\x00' + b''.join(entries)
+    return struct.pack('<HH', 0xbc8, len(payload)) + payload
+
+def legacy_server_list(servers):
+    out = []
+    for name, ip, availability in servers:
+        name = name.encode('euc-kr').ljust(16, b'\x00')
+        ip = (ip.encode('ascii') + b'\x00').ljust(16, b'\x00')
+        out.append(struct.pack('<16s5s16s3si', name, b'\x00' * 5, ip, b'\x00' * 3, availability))
+    while len(out) < 10:
+        name = f"MN{len(out)}".encode('euc-kr').ljust(16, b'\x00')
+        ip = b'0.0.0.0\x00'.ljust(16, b'\x00')
+        out.append(struct.pack('<16s5s16s3si', name, b'\x00' * 5, ip, b'\x00' * 3, -1))
+    payload = b'\x01\x00\x00\x00' + b''.join(out)
+    return struct.pack('<HH', 0x0bc7, len(payload)) + payload
+
+def legacy_room(leader_idx, name, players, map_select, status):
+    name = name.encode('euc-kr', errors='replace')[:16].ljust(16, b'\x00')
+    blocks = []
+    for pid, character, pstatus, rank in players:
+        block = bytearray(28)
+        block[0:8] = pid.encode('ascii')[:8].ljust(8, b'\x00')
+        block[8:13] = b'\x00' * 5
+        block[0x0D] = character
+        block[0x0E] = pstatus
+        block[0x0F] = 0
+        block[0x10:0x14] = struct.pack('<I', rank)
+        block[0x14:0x18] = struct.pack('<I', 0)
+        block[0x18:0x1C] = struct.pack('<I', 0)
+        blocks.append(bytes(block))
+    payload = (struct.pack("B", leader_idx) + b'\x00\x00\x00' + name + b'\x00' * 16 + b''.join(blocks)
+               + struct.pack('<I', map_select) + struct.pack('<I', status))
+    return struct.pack('<HH', 0x03ee, len(payload)) + payload
+
+def legacy_move(data):
+    pkt_id, pkt_len = struct.unpack('<HH', data[:4])
+    y_pos = struct.unpack('<f', data[4:8])[0]
+    x_pos = struct.unpack('<f', data[8:12])[0]
+    player_heading = struct.unpack('<f', data[12:16])[0]
+    cam_heading = struct.unpack('<f', data[16:20])[0]
+    return {
+        "pkt_id": pkt_id, "pkt_len": pkt_len, "x_pos": x_pos, "y_pos": y_pos,
+        "player_heading": player_heading, "cam_heading": cam_heading,
+        "unknown1": data[20:22], "left_right": data[22], "up_down": data[23], "player_idx": data[24:28],
+    }
+
+def legacy_channel_join(data):
+    packet_id, payload_len = struct.unpack('<HH', data[:4])
+    return {
+        "packet_id": packet_id, "payload_len": payload_len,
+        "player_id": data[4:12].decode('ascii').rstrip('\x00'),
+        "channel_index": struct.unpack('<H', data[20:22])[0],
+    }
+
+# ========== CODEC EQUIVALENTS ==========
+def codec_lobby_list(lobbies):
+    entries = {
+        idx: mn_codec.encode_lobby_entry(idx, count, name.encode('euc-kr', errors='replace'),
+                                         pw.encode('euc-kr', errors='replace'), status)
+        for idx, count, name, pw, status in lobbies
+    }
+    return mn_codec.encode_lobby_list(entries)
+
+def codec_server_list(servers):
+    return mn_codec.encode_server_list([(n.encode('euc-kr'), ip.encode('ascii'), a) for n, ip, a in servers])
+
+def codec_room(leader_idx, name, players, map_select, status):
+    return mn_codec.encode_room(leader_idx, name.encode('euc-kr', errors='replace'),
+                                [(pid.encode('ascii'), c, s, r) for pid, c, s, r in players], map_select, status)
+
+# ========== FIXTURES ==========
+CHANNELS = [(i, i * 3) for i in range(12)]
+LOBBIES = [(0, 4, "ROOMA", "", 1), (3, 2, "ROOMB", "PW", 2), (7, 1, "테스트", "", 1)]
+SERVERS = [("MN0", "207.148.21.93", 0)]
+PLAYERS = [("AAAA", 1, 1, 10), ("BBBB", 2, 0, 20), ("CCCC", 3, 1, 30), ("", 0, 0, 1)]
+MOVE = struct.pack('<HHffff2sBBI', 0x1388, 24, 1.0, 2.0, 3.0, 4.0, b'\x00\x00', 1, 0, 2)
+CHANNEL_JOIN = struct.pack('<HH8s8sH2x', 0x07d4, 20, b'AAAA', b'', 3)
+
+CASES = [
+    ("result ack (encode)", lambda: legacy_result(0x0bc1, True, 1), lambda: mn_codec.encode_result(0x0bc1, True, 1)),
+    ("channel list (encode)", lambda: legacy_channel_list(CHANNELS), lambda: mn_codec.encode_channel_list(CHANNELS)),
+    ("lobby list (encode)", lambda: legacy_lobby_list(LOBBIES), lambda: codec_lobby_list(LOBBIES)),
+    ("server list (encode)", lambda: legacy_server_list(SERVERS), lambda: codec_server_list(SERVERS)),
+    ("lobby room 0x03ee (encode)", lambda: legacy_room(0, "ROOMA", PLAYERS, 3, 1), lambda: codec_room(0, "ROOMA", PLAYERS, 3, 1)),
+    ("move 0x1388 (decode)", lambda: legacy_move(MOVE), lambda: mn_codec.decode_move(MOVE)),
+    ("channel join (decode)", lambda: legacy_channel_join(CHANNEL_JOIN), lambda: mn_codec.decode_channel_join(CHANNEL_JOIN)),
+]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--number", type=int, default=100000, help="iterations per case")
+    args = parser.parse_args()
+
+    print(f"{'packet':<28} {'legacy ns':>10} {'codec ns':>10} {'speedup':>8}")
+    print("-" * 60)
+    for name, legacy, codec in CASES:
+        if legacy() != codec():
+            raise SystemExit(f"[BENCH] Output mismatch for {name}")
+        t_legacy = min(timeit.repeat(legacy, number=args.number, repeat=3)) / args.number * 1e9
+        t_codec = min(timeit.repeat(codec, number=args.number, repeat=3)) / args.number * 1e9
+        print(f"{name:<28} {t_legacy:>10.0f} {t_codec:>10.0f} {t_legacy / t_codec:>7.2f}x")
+
+if __name__ == "__main__":
+    main()
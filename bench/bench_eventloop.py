@@ -0,0 +1,38 @@
+"""
+Event loop comparison: 4-player lobbies relaying 0x1388 at 30 Hz, run once
+with the default asyncio loop and once with MN_EVENT_LOOP=uvloop, reporting
+relay throughput and tail latency for each.
+
+Usage (from the repo root):
+    python bench/bench_eventloop.py --lobbies 40 --duration 15
+    python bench/bench_eventloop.py --env MN_NET_CORE=protocol
+
+uvloop must be installed for the server's interpreter (`pip install uvloop`);
+otherwise the server falls back to asyncio and both runs measure the same loop.
+"""
+import argparse
+import importlib.util
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import bench_server
+
+def main():
+    parser = argparse.ArgumentParser(description="Mystic Nights event loop benchmark")
+    bench_server.add_server_arguments(parser)
+    # Movement-only relay at 30 Hz per player
+    parser.set_defaults(move_rate=30.0, aux_rate=0.0, lobbies=20)
+    args = parser.parse_args()
+    if importlib.util.find_spec("uvloop") is None:
+        print("[BENCH] uvloop is not installed: the uvloop run falls back to asyncio.")
+
+    rows = bench_server.compare(args, [("asyncio", ["MN_EVENT_LOOP=asyncio"]), ("uvloop", ["MN_EVENT_LOOP=uvloop"])])
+    (_, base, base_cpu), (_, fast, fast_cpu) = rows
+    rate = lambda stats: stats.delivered / stats.elapsed
+    print(f"throughput change   : {(rate(fast) / rate(base) - 1) * 100:+.1f}% delivered/s")
+    if base_cpu and fast_cpu:
+        print(f"CPU per packet      : {(fast_cpu / fast.delivered) / (base_cpu / base.delivered) * 100 - 100:+.1f}%")
+
+if __name__ == "__main__":
+    main()
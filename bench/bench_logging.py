@@ -0,0 +1,105 @@
+"""
+Microbenchmark: per-packet cost of the debug logging calls on the relay hot
+path with DEBUG=0, legacy eager f-strings vs the lazy log()/Hex facility.
+
+Usage (from the repo root):
+    python bench/bench_logging.py [--number N]
+"""
+import argparse
+import os
+import struct
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ["MN_DEBUG"] = "0"
+import MN_SERVER
+import mn_codec
+
+log = MN_SERVER.log
+Hex = MN_SERVER.Hex
+
+# ========== FIXTURES ==========
+DATA = struct.pack('<HHffff2sBBI', 0x1388, 24, 1.0, 2.0, 3.0, 4.0, b'\x00\x00', 1, 0, 2)
+PARSED = mn_codec.decode_move(DATA)
+ADDR = ('127.0.0.1', 50000)
+SESSION = {'addr': ADDR, 'player_id': 'AAAA', 'lobby_route': (1, 'ROOMA')}
+PEERS = 4  # 0x1388 is relayed to all 4 lobby members
+
+# ========== LEGACY (eager f-string) CALL SITES ==========
+def legacy_recv():
+    MN_SERVER.print(f"[RECV] From {ADDR}: {DATA.hex()} (pkt_id={0x1388:04x}, {24} bytes)")
+
+def legacy_send(note):
+    if note:
+        MN_SERVER.print(f"[SEND] {note} To {SESSION['addr']}: {DATA.hex()}")
+    else:
+        MN_SERVER.print(f"[SEND] To {SESSION['addr']}: {DATA.hex()}")
+
+def legacy_move():
+    parsed = PARSED
+    MN_SERVER.print(f"[1388] Movement from {SESSION['player_id']}: x={parsed['x_pos']:.3f} y={parsed['y_pos']:.3f} "
+                    f"player_heading={parsed['player_heading']:.3f} cam={parsed['cam_heading']:.3f} "
+                    f"LR={parsed['left_right']:02x} UD={parsed['up_down']:02x} "
+                    f"unk1={parsed['unknown1'].hex()} player_idx={parsed['player_idx'].hex()}")
+
+def legacy_packet():
+    legacy_recv()
+    legacy_move()
+    note = f"[MOVE BROADCAST 0x1388]"
+    for _ in range(PEERS):
+        legacy_send(f"[RELAY] {SESSION['lobby_route'][1]}] {note}")
+
+# ========== LAZY CALL SITES (as in MN_SERVER.py) ==========
+def lazy_recv():
+    if MN_SERVER.DEBUG:
+        log("[RECV] From %s: %s (pkt_id=%04x, %d bytes)", ADDR, Hex(DATA), 0x1388, 24)
+
+def lazy_send(note):
+    if MN_SERVER.DEBUG:
+        log("[SEND] %s To %s: %s", note, SESSION['addr'], Hex(DATA))
+
+def lazy_move():
+    parsed = PARSED
+    if MN_SERVER.DEBUG:
+        log("[1388] Movement from %s: x=%.3f y=%.3f player_heading=%.3f cam=%.3f LR=%02x UD=%02x unk1=%s player_idx=%s",
+            SESSION['player_id'], parsed['x_pos'], parsed['y_pos'], parsed['player_heading'], parsed['cam_heading'],
+            parsed['left_right'], parsed['up_down'], Hex(parsed['unknown1']), Hex(parsed['player_idx']))
+
+def lazy_packet():
+    lazy_recv()
+    lazy_move()
+    note = "[MOVE BROADCAST 0x1388]"
+    if MN_SERVER.DEBUG:
+        note = f"[RELAY {SESSION['lobby_route'][1]}] {note}"
+    for _ in range(PEERS):
+        lazy_send(note)
+
+def baseline_packet():
+    # The same loop with no logging at all, to show what is left
+    for _ in range(PEERS):
+        pass
+
+CASES = [
+    ("recv line", legacy_recv, lazy_recv),
+    ("send line", lambda: legacy_send("[RELAY]"), lambda: lazy_send("[RELAY]")),
+    ("0x1388 movement line", legacy_move, lazy_move),
+    ("relayed 0x1388 (1 in, 4 out)", legacy_packet, lazy_packet),
+]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--number", type=int, default=200000, help="iterations per case")
+    args = parser.parse_args()
+
+    print(f"{'call site (DEBUG=0)':<30} {'legacy ns':>10} {'lazy ns':>10} {'speedup':>8}")
+    print("-" * 62)
+    for name, legacy, lazy in CASES:
+        t_legacy = min(timeit.repeat(legacy, number=args.number, repeat=3)) / args.number * 1e9
+        t_lazy = min(timeit.repeat(lazy, number=args.number, repeat=3)) / args.number * 1e9
+        print(f"{name:<30} {t_legacy:>10.0f} {t_lazy:>10.0f} {t_legacy / t_lazy:>7.2f}x")
+    t_base = min(timeit.repeat(baseline_packet, number=args.number, repeat=3)) / args.number * 1e9
+    print(f"{'no-logging loop (floor)':<30} {'':>10} {t_base:>10.0f}")
+
+if __name__ == "__main__":
+    main()
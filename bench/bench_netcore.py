@@ -0,0 +1,25 @@
+"""
+Network core comparison: runs the same simulated load against MN_SERVER.py
+once per MN_NET_CORE ("streams" = asyncio.start_server, "protocol" = raw
+asyncio.Protocol) and compares relay throughput per server CPU-second.
+
+Usage (from the repo root):
+    python bench/bench_netcore.py --lobbies 40 --duration 15
+    python bench/bench_netcore.py --cores streams,protocol --move-rate 30
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import bench_server
+
+def main():
+    parser = argparse.ArgumentParser(description="Mystic Nights network core benchmark")
+    bench_server.add_server_arguments(parser)
+    parser.add_argument("--cores", default="streams,protocol", help="comma-separated MN_NET_CORE values")
+    args = parser.parse_args()
+    bench_server.compare(args, [(core, [f"MN_NET_CORE={core}"]) for core in args.cores.split(",")])
+
+if __name__ == "__main__":
+    main()
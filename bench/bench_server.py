@@ -0,0 +1,169 @@
+"""
+Benchmark harness: starts a local MN_SERVER.py on a throwaway SQLite database,
+drives N simulated 4-player lobbies against it with mn_client_sim and reports
+throughput, p50/p99 relay latency and server CPU per packet.
+
+Usage (from the repo root):
+    python bench/bench_server.py --lobbies 20 --duration 15
+    python bench/bench_server.py --lobbies 20 --env SQLITE_BATCHED=1
+    python bench/bench_server.py --lobbies 40 --env MN_WORKERS=4
+
+Server CPU (including worker processes) is sampled from /proc/<pid>/stat around the streaming window
+(Linux); elsewhere it is reported as n/a.
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+import mn_client_sim
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def make_db(path, host):
+    schema = os.path.join(REPO, "mn_sqlite_schema.sql")
+    with open(schema, encoding="utf-8") as f:
+        sql = f.read()
+    with sqlite3.connect(path) as conn:
+        conn.executescript(sql)
+        # Sessions find their server by the IP they connected to
+        conn.execute("UPDATE servers SET ip_address = ? WHERE name = 'MN0'", (host,))
+        # Drop the seeded demo lobbies so quick join only lands in simulated ones
+        conn.execute("DELETE FROM lobbies")
+        conn.execute("UPDATE channels SET player_count = 0")
+
+def _proc_stat(pid):
+    with open(f"/proc/{pid}/stat") as f:
+        return f.read().rsplit(")", 1)[1].split()
+
+def process_cpu_seconds(pid):
+    """CPU seconds of pid plus its live children (MN_WORKERS forks worker processes)."""
+    try:
+        fields = _proc_stat(pid)
+        # utime and stime are fields 14 and 15 (1-based) of the full line
+        ticks = int(fields[11]) + int(fields[12])
+        for entry in os.listdir("/proc"):
+            if entry.isdigit():
+                try:
+                    child = _proc_stat(entry)
+                except OSError:
+                    continue
+                if child[1] == str(pid):
+                    ticks += int(child[11]) + int(child[12])
+        return ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return None
+
+async def wait_for_port(host, port, proc, timeout=15.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"MN_SERVER.py exited early with code {proc.returncode}")
+        try:
+            _, writer = await asyncio.open_connection(host, port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError("MN_SERVER.py did not start listening in time")
+
+def add_server_arguments(parser):
+    mn_client_sim.add_arguments(parser)
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="extra environment for the server process (repeatable)")
+    parser.add_argument("--server-log", action="store_true", help="show server stdout/stderr")
+    parser.set_defaults(tcp_port=None, server_port=None)
+
+def run_bench(args, extra_env=()):
+    """Run one server + simulation; returns (SimStats, server CPU seconds or None)."""
+    args = argparse.Namespace(**vars(args))
+    args.tcp_port = args.tcp_port or free_port()
+    args.server_port = args.server_port or free_port()
+
+    tmp = tempfile.mkdtemp(prefix="mn_bench_")
+    db_path = os.path.join(tmp, "bench.db")
+    make_db(db_path, args.host)
+
+    env = dict(os.environ)
+    env.update({
+        "DB_TYPE": "sqlite",
+        "SQLITE_FILE": db_path,
+        "SQLITE_SCHEMA": os.path.join(REPO, "mn_sqlite_schema.sql"),
+        "MN_HOST": args.host,
+        "MN_TCP_PORT": str(args.tcp_port),
+        "MN_SERVER_PORT": str(args.server_port),
+    })
+    for item in list(args.env) + list(extra_env):
+        key, _, value = item.partition("=")
+        env[key] = value
+
+    output = None if args.server_log else subprocess.DEVNULL
+    proc = subprocess.Popen([sys.executable, os.path.join(REPO, "MN_SERVER.py")], cwd=REPO, env=env,
+                            stdin=subprocess.DEVNULL, stdout=output, stderr=output)
+    cpu = {}
+
+    def on_streaming(start):
+        cpu["start" if start else "end"] = process_cpu_seconds(proc.pid)
+
+    async def run():
+        await wait_for_port(args.host, args.server_port, proc)
+        return await mn_client_sim.run_simulation(args, on_streaming=on_streaming)
+
+    try:
+        stats = asyncio.run(run())
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    server_cpu = None
+    if cpu.get("start") is not None and cpu.get("end") is not None:
+        server_cpu = cpu["end"] - cpu["start"]
+    return stats, server_cpu
+
+def compare(args, variants):
+    """Run the same load once per (label, extra_env) variant and print a comparison table."""
+    rows = []
+    for label, extra_env in variants:
+        print(f"[BENCH] {label} ...")
+        stats, server_cpu = run_bench(args, extra_env=extra_env)
+        mn_client_sim.report(args, stats, server_cpu)
+        rows.append((label, stats, server_cpu))
+
+    lat = lambda stats, q: mn_client_sim.percentile([x * 1000 for x in stats.latencies], q)
+    print(f"{'variant':<12} {'delivered/s':>12} {'p50 ms':>8} {'p99 ms':>8} {'us/delivered':>13} {'pkts/CPU-s':>11}")
+    print("-" * 70)
+    for label, stats, server_cpu in rows:
+        rate = stats.delivered / stats.elapsed
+        if server_cpu:
+            per_pkt = f"{server_cpu / stats.delivered * 1e6:.1f}"
+            per_core = f"{stats.delivered / server_cpu:.0f}"
+        else:
+            per_pkt = per_core = "n/a"
+        print(f"{label:<12} {rate:>12.0f} {lat(stats, 50):>8.3f} {lat(stats, 99):>8.3f} {per_pkt:>13} {per_core:>11}")
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Mystic Nights server benchmark")
+    add_server_arguments(parser)
+    args = parser.parse_args()
+    stats, server_cpu = run_bench(args)
+    mn_client_sim.report(args, stats, server_cpu)
+
+if __name__ == "__main__":
+    main()
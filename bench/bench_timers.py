@@ -0,0 +1,90 @@
+"""
+Check + microbenchmark for SessionTimers (per-session deadlines behind the echo
+keepalive and quick join timeouts).
+
+1. Isolation: one callback stuck for SLOW seconds (like a disconnect waiting on a
+   client or the DB) must not delay another session's deadline. Exits non-zero if
+   the probe deadline fires more than --max-late seconds late.
+2. Cost: CPU per fired deadline with many idle sessions holding far deadlines,
+   which should stay flat as the idle count grows.
+
+Usage (from the repo root):
+    python bench/bench_timers.py [--idle 1000 100000] [--due 2000]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ["MN_DEBUG"] = "0"
+import MN_SERVER
+
+SessionTimers = MN_SERVER.SessionTimers
+SLOW = 3.0
+
+def reset():
+    SessionTimers._heap = []
+    SessionTimers._running = set()
+
+async def check_isolation(max_late):
+    reset()
+    fired = {}
+
+    async def stuck(session, now):
+        await asyncio.sleep(SLOW)
+
+    async def probe(session, now):
+        fired['at'] = time.time()
+
+    runner = asyncio.create_task(SessionTimers.run())
+    await asyncio.sleep(0)
+    start = time.time()
+    SessionTimers.schedule({'addr': 'stuck'}, 'keepalive', start + 0.05, stuck)
+    SessionTimers.schedule({'addr': 'probe'}, 'quick_join', start + 0.3, probe)
+    await asyncio.sleep(1.0)
+    runner.cancel()
+    late = fired['at'] - (start + 0.3) if 'at' in fired else float('inf')
+    print(f"[CHECK] probe deadline fired {late * 1000:.1f} ms late while another callback was stuck for {SLOW:.0f}s")
+    return late <= max_late
+
+async def bench_cost(idle, due):
+    reset()
+    count = [0]
+    done = asyncio.Event()
+
+    async def tick(session, now):
+        count[0] += 1
+        if count[0] == due:
+            done.set()
+
+    far = time.time() + 3600
+    for i in range(idle):
+        SessionTimers.schedule({'addr': i}, 'keepalive', far, tick)
+    runner = asyncio.create_task(SessionTimers.run())
+    await asyncio.sleep(0)
+    start = time.time()
+    for i in range(due):
+        SessionTimers.schedule({'addr': ('due', i)}, 'keepalive', start + 0.2 + i * 0.0002, tick)
+    cpu = time.process_time()
+    await done.wait()
+    cpu = time.process_time() - cpu
+    runner.cancel()
+    print(f"{idle:>10} {due:>8} {cpu / due * 1e6:>14.1f}")
+
+async def main(args):
+    ok = await check_isolation(args.max_late)
+    print(f"{'idle':>10} {'fired':>8} {'us/deadline':>14}")
+    print("-" * 34)
+    for idle in args.idle:
+        await bench_cost(idle, args.due)
+    if not ok:
+        sys.exit("[CHECK] FAILED: a slow timer callback delayed another session's deadline")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SessionTimers isolation check and cost benchmark")
+    parser.add_argument("--idle", type=int, nargs="+", default=[1000, 100000], help="idle sessions holding far deadlines")
+    parser.add_argument("--due", type=int, default=2000, help="deadlines fired per run")
+    parser.add_argument("--max-late", type=float, default=0.1, help="allowed probe lateness in seconds")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,352 @@
+"""
+Headless Mystic Nights PS2 client simulator (asyncio).
+
+Speaks the ICD.txt protocol: account create/login on the manager port, then
+login, channel join, lobby create / join / quick join, ready, game start,
+ready check (answering 0x03e9 echo challenges), and streams 0x1388 movement
+plus one other 0x13XX gameplay packet at configurable rates.
+
+Relay latency is measured by tagging every gameplay packet with the sender
+number and a sequence number; all clients share one clock (one process).
+
+Usage against a running server (see bench_server.py for a self-contained run):
+    python bench/mn_client_sim.py --host 127.0.0.1 --lobbies 4 --duration 10
+"""
+import argparse
+import asyncio
+import os
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import mn_codec
+
+# ========== CLIENT PACKETS ==========
+CREDENTIALS = struct.Struct('<12sx12sx')    # 0x07d0 / 0x07d1: player_id, password
+PLAYER_ID = struct.Struct('<13s')           # 0x07d7 / 0x07d8 / 0x07d9 / 0x07da / 0x03f0 / 0x03f2
+CHANNEL_JOIN = struct.Struct('<16sH2x')     # 0x07d4: player_id, channel_index
+LOBBY_CREATE = struct.Struct('<13s12s5x8s2x')  # 0x07d5: player_id, name, password
+LOBBY_JOIN = struct.Struct('<20s12s4x')     # 0x07d6: player_id, name
+GAME_RESULT = struct.Struct('<16sI')        # 0x03f3: player_id, victory flag
+MOVE = struct.Struct('<ffff2sBBI')          # 0x1388: y, x, heading, cam, unknown1, lr, ud, player_idx
+TAG = struct.Struct('<HI')                  # sender number + sequence, carried in gameplay payloads
+
+AUX_PAYLOAD_LEN = 8
+
+def packet(pkt_id, payload=b''):
+    return mn_codec.HEADER.pack(pkt_id, len(payload)) + payload
+
+def percentile(samples, pct):
+    if not samples:
+        return float('nan')
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+class SimStats:
+    def __init__(self):
+        self.sent = {}          # {(pkt_id, sender, seq): perf_counter at send}
+        self.latencies = []     # seconds, one per delivered gameplay packet
+        self.sent_count = 0
+        self.delivered = 0
+        self.errors = 0
+
+    def record_send(self, pkt_id, sender, seq):
+        self.sent[(pkt_id, sender, seq)] = time.perf_counter()
+        self.sent_count += 1
+
+    def record_recv(self, pkt_id, sender, seq):
+        sent_at = self.sent.get((pkt_id, sender, seq))
+        if sent_at is not None:
+            self.latencies.append(time.perf_counter() - sent_at)
+            self.delivered += 1
+
+class SimClient:
+    def __init__(self, number, player_id, password, stats):
+        self.number = number
+        self.player_id = player_id
+        self.password = password
+        self.stats = stats
+        self.reader = None
+        self.writer = None
+        self.inbox = asyncio.Queue()
+        self.read_task = None
+        self.seq = 0
+
+    async def connect(self, host, port):
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        self.read_task = asyncio.create_task(self._read_loop())
+
+    async def close(self):
+        if self.writer:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except Exception:
+                pass
+        if self.read_task:
+            self.read_task.cancel()
+            self.read_task = None
+
+    def send(self, pkt_id, payload=b''):
+        self.writer.write(packet(pkt_id, payload))
+
+    async def _read_loop(self):
+        header_size = mn_codec.HEADER.size
+        try:
+            while True:
+                header = await self.reader.readexactly(header_size)
+                pkt_id, payload_len = mn_codec.HEADER.unpack(header)
+                payload = await self.reader.readexactly(payload_len)
+                if pkt_id == mn_codec.ECHO_CHALLENGE:
+                    # Echo back whatever the server sent
+                    self.send(mn_codec.ECHO_REPLY, payload[:4])
+                elif pkt_id == mn_codec.MOVE_UPDATE:
+                    _, _, _, _, unknown1, _, _, seq = MOVE.unpack_from(payload)
+                    self.stats.record_recv(pkt_id, struct.unpack('<H', unknown1)[0], seq)
+                elif pkt_id >> 8 == 0x13:
+                    sender, seq = TAG.unpack_from(payload)
+                    self.stats.record_recv(pkt_id, sender, seq)
+                else:
+                    self.inbox.put_nowait((pkt_id, payload))
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+
+    async def expect(self, *pkt_ids, timeout=10.0):
+        """Wait for the next packet with one of pkt_ids; other packets are discarded."""
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"{self.player_id}: timed out waiting for {[hex(p) for p in pkt_ids]}")
+            pkt_id, payload = await asyncio.wait_for(self.inbox.get(), remaining)
+            if pkt_id in pkt_ids:
+                return pkt_id, payload
+
+    async def request(self, pkt_id, payload, reply_id, timeout=10.0):
+        self.send(pkt_id, payload)
+        return await self.expect(reply_id, timeout=timeout)
+
+    # ----- protocol steps -----
+    def _id(self, size):
+        return self.player_id.encode('ascii')[:size]
+
+    async def manager_login(self, host, port):
+        """Account create + login + server list on the manager port, like the real client."""
+        await self.connect(host, port)
+        creds = CREDENTIALS.pack(self._id(12), self.password.encode('ascii'))
+        await self.request(mn_codec.ACCOUNT_CREATE, creds, mn_codec.ACCOUNT_CREATE_RESULT)
+        _, result = await self.request(mn_codec.LOGIN, creds, mn_codec.LOGIN_RESULT)
+        if result[0] != 1:
+            raise RuntimeError(f"{self.player_id}: login failed ({result.hex()})")
+        await self.request(mn_codec.SERVER_LIST_REQ, b'', mn_codec.SERVER_LIST)
+        await self.close()
+
+    async def server_login(self, host, port, channel_index):
+        await self.connect(host, port)
+        creds = CREDENTIALS.pack(self._id(12), self.password.encode('ascii'))
+        _, result = await self.request(mn_codec.LOGIN, creds, mn_codec.LOGIN_RESULT)
+        if result[0] != 1:
+            raise RuntimeError(f"{self.player_id}: login failed ({result.hex()})")
+        await self.request(mn_codec.CHANNEL_LIST_REQ, b'', mn_codec.CHANNEL_LIST)
+        await self.request(mn_codec.CHANNEL_JOIN, CHANNEL_JOIN.pack(self._id(8), channel_index), mn_codec.CHANNEL_JOIN_ACK)
+
+    async def create_lobby(self, name):
+        _, result = await self.request(mn_codec.LOBBY_CREATE, LOBBY_CREATE.pack(self._id(8), name.encode('ascii'), b''),
+                                       mn_codec.LOBBY_CREATE_ACK)
+        if result[0] != 1:
+            raise RuntimeError(f"{self.player_id}: lobby create '{name}' failed ({result.hex()})")
+
+    async def join_lobby(self, name):
+        _, result = await self.request(mn_codec.LOBBY_JOIN, LOBBY_JOIN.pack(self._id(8), name.encode('ascii')),
+                                       mn_codec.LOBBY_JOIN_ACK)
+        return result[0] == 1
+
+    async def quick_join(self, retries=50):
+        for _ in range(retries):
+            _, result = await self.request(mn_codec.QUICK_JOIN, PLAYER_ID.pack(self._id(8)), mn_codec.QUICK_JOIN_ACK)
+            if result[0] == 1:
+                idx = struct.unpack_from('<H', result, 4)[0]
+                _, listing = await self.request(mn_codec.LOBBY_LIST_REQ, b'', mn_codec.LOBBY_LIST)
+                entry = mn_codec.LOBBY_ENTRY.unpack_from(listing, 4 + idx * mn_codec.LOBBY_ENTRY.size)
+                name = entry[3].rstrip(b'\x00').decode('ascii')
+                if await self.join_lobby(name):
+                    return name
+            await asyncio.sleep(1.1)  # server blocks joins for 1s after a failed quick join
+        raise RuntimeError(f"{self.player_id}: quick join gave up")
+
+    async def wait_room(self, players=4, ready=3, timeout=30.0):
+        """Leader side: wait for a 0x03ee showing `players` members, `ready` of them ready."""
+        deadline = time.monotonic() + timeout
+        while True:
+            _, room = await self.expect(mn_codec.LOBBY_ROOM, timeout=max(0.1, deadline - time.monotonic()))
+            # Payload offsets: players start at 0x24 (0x28 in the full packet), 28 bytes each
+            members = [room[0x24 + i * 28:0x24 + i * 28 + 8] for i in range(4)]
+            statuses = [room[0x24 + i * 28 + 0x0E] for i in range(4)]
+            joined = sum(1 for m in members if m.strip(b'\x00'))
+            if joined >= players and sum(statuses) >= ready:
+                return
+
+    async def stream(self, slot, end_at, move_rate, aux_rate, aux_id):
+        """Send 0x1388 at move_rate Hz and aux_id at aux_rate Hz until end_at (perf_counter)."""
+        move_interval = 1.0 / move_rate if move_rate else None
+        aux_interval = 1.0 / aux_rate if aux_rate else None
+        now = time.perf_counter()
+        next_move = now if move_interval else float('inf')
+        next_aux = now if aux_interval else float('inf')
+        tag = struct.pack('<H', self.number)
+        while True:
+            now = time.perf_counter()
+            if now >= end_at:
+                return
+            if now >= next_move:
+                self.seq += 1
+                self.stats.record_send(mn_codec.MOVE_UPDATE, self.number, self.seq)
+                self.send(mn_codec.MOVE_UPDATE, MOVE.pack(1.0, 2.0, 0.5, 0.5, tag, 0, 1, self.seq))
+                next_move += move_interval
+            if now >= next_aux:
+                self.seq += 1
+                self.stats.record_send(aux_id, self.number, self.seq)
+                self.send(aux_id, TAG.pack(self.number, self.seq).ljust(AUX_PAYLOAD_LEN, b'\x00'))
+                next_aux += aux_interval
+            await asyncio.sleep(max(0.0, min(next_move, next_aux, end_at) - time.perf_counter()))
+
+async def open_lobby(lobby_no, clients, args):
+    """Log all 4 clients into the lobby's channel and have the leader create it."""
+    channel_index = lobby_no // 20 % 12  # 20 lobbies per channel
+    for c in clients:
+        await c.manager_login(args.host, args.tcp_port)
+        await c.server_login(args.host, args.server_port, channel_index)
+    await clients[0].create_lobby(f"{args.prefix}{lobby_no:03d}")
+
+async def fill_lobby(lobby_no, clients, args):
+    """Join + ready the 3 joiners, start the game and run the countdown to GO."""
+    name = f"{args.prefix}{lobby_no:03d}"
+    leader, joiners = clients[0], clients[1:]
+    for c in joiners:
+        if args.quick_join:
+            await c.quick_join()
+        elif not await c.join_lobby(name):
+            raise RuntimeError(f"{c.player_id}: join '{name}' failed")
+        c.send(mn_codec.PLAYER_READY, PLAYER_ID.pack(c._id(8)))
+        await c.expect(mn_codec.PLAYER_READY_ACK)
+    await leader.wait_room(players=4, ready=3)
+    leader.send(mn_codec.GAME_START_REQ, PLAYER_ID.pack(leader._id(8)))
+    # With quick join a joiner may sit in another lobby, so its start can come from another leader
+    for c in clients:
+        await c.expect(mn_codec.GAME_START_ACK, timeout=30.0)
+    if args.skip_countdown:
+        return
+    for c in clients:
+        c.send(mn_codec.GAME_READY_CHECK, PLAYER_ID.pack(c._id(8)))
+    for c in clients:
+        while True:
+            _, payload = await c.expect(mn_codec.COUNTDOWN_PKT, timeout=30.0)
+            if payload[0] == 0:
+                break
+
+async def finish_lobby(clients):
+    leader = clients[0]
+    leader.send(mn_codec.GAME_OVER, PLAYER_ID.pack(leader._id(8)))
+    for i, c in enumerate(clients):
+        c.send(mn_codec.GAME_RESULT, GAME_RESULT.pack(c._id(8), 1 if i == 0 else 0))
+    await asyncio.sleep(0.2)
+    for c in clients:
+        await c.close()
+
+async def run_simulation(args, on_streaming=None):
+    """
+    Set up args.lobbies full lobbies, stream gameplay for args.duration seconds and return SimStats.
+    on_streaming(start: bool) is called right before and after the measured window.
+    """
+    stats = SimStats()
+    lobbies = []
+    for lobby_no in range(args.lobbies):
+        clients = [
+            SimClient(lobby_no * 4 + slot, f"{args.prefix[:2]}{lobby_no:03d}{slot}", "0", stats)
+            for slot in range(4)
+        ]
+        lobbies.append(clients)
+
+    setup_started = time.perf_counter()
+    # Lobbies are set up concurrently, bounded to avoid a login storm
+    gate = asyncio.Semaphore(args.setup_concurrency)
+    async def guarded(step, lobby_no, clients):
+        async with gate:
+            await step(lobby_no, clients, args)
+    if args.quick_join:
+        # Quick join lands joiners in any waiting lobby of the channel: open every lobby
+        # first, then fill them all at once so no leader waits on a gated joiner
+        await asyncio.gather(*[guarded(open_lobby, n, c) for n, c in enumerate(lobbies)])
+        await asyncio.gather(*[fill_lobby(n, c, args) for n, c in enumerate(lobbies)])
+    else:
+        async def setup(lobby_no, clients, args):
+            await open_lobby(lobby_no, clients, args)
+            await fill_lobby(lobby_no, clients, args)
+        await asyncio.gather(*[guarded(setup, n, c) for n, c in enumerate(lobbies)])
+    setup_time = time.perf_counter() - setup_started
+
+    if on_streaming:
+        on_streaming(True)
+    started = time.perf_counter()
+    end_at = started + args.duration
+    await asyncio.gather(*[
+        c.stream(slot, end_at, args.move_rate, args.aux_rate, args.aux_id)
+        for clients in lobbies for slot, c in enumerate(clients)
+    ])
+    await asyncio.sleep(args.drain)
+    elapsed = time.perf_counter() - started
+    if on_streaming:
+        on_streaming(False)
+
+    await asyncio.gather(*[finish_lobby(clients) for clients in lobbies])
+    stats.setup_time = setup_time
+    stats.elapsed = elapsed
+    return stats
+
+def report(args, stats, server_cpu=None):
+    lat_ms = [x * 1000 for x in stats.latencies]
+    # Expected deliveries: 0x1388 goes to all 4 (incl. sender); to_self=False aux ids go to 3
+    aux_fanout = 3 if args.aux_id in (0x138c, 0x139c, 0x1390) else 4
+    print("=" * 60)
+    print(f"lobbies={args.lobbies} clients={args.lobbies * 4} move_rate={args.move_rate}Hz "
+          f"aux=0x{args.aux_id:04x}@{args.aux_rate}Hz (fan-out {aux_fanout}) duration={args.duration}s")
+    print(f"setup time          : {stats.setup_time:.2f}s")
+    print(f"packets sent        : {stats.sent_count} ({stats.sent_count / stats.elapsed:.0f}/s)")
+    print(f"packets delivered   : {stats.delivered} ({stats.delivered / stats.elapsed:.0f}/s)")
+    print(f"relay latency p50   : {percentile(lat_ms, 50):.3f} ms")
+    print(f"relay latency p99   : {percentile(lat_ms, 99):.3f} ms")
+    print(f"relay latency max   : {max(lat_ms) if lat_ms else float('nan'):.3f} ms")
+    if server_cpu is not None:
+        per_in = server_cpu / stats.sent_count * 1e6 if stats.sent_count else float('nan')
+        per_out = server_cpu / stats.delivered * 1e6 if stats.delivered else float('nan')
+        print(f"server CPU          : {server_cpu:.2f}s ({server_cpu / stats.elapsed * 100:.0f}% of one core)")
+        print(f"server CPU / packet : {per_in:.1f} us per inbound, {per_out:.1f} us per delivered")
+        if server_cpu > 0:
+            print(f"packets / CPU-second: {stats.sent_count / server_cpu:.0f} inbound, {stats.delivered / server_cpu:.0f} delivered")
+    print("=" * 60)
+
+def add_arguments(parser):
+    parser.add_argument("--host", default=os.environ.get("MN_HOST", "127.0.0.1"))
+    parser.add_argument("--tcp-port", type=int, default=int(os.environ.get("MN_TCP_PORT", 18000)))
+    parser.add_argument("--server-port", type=int, default=int(os.environ.get("MN_SERVER_PORT", 18001)))
+    parser.add_argument("--lobbies", type=int, default=4, help="number of 4-player lobbies")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of gameplay streaming")
+    parser.add_argument("--move-rate", type=float, default=20.0, help="0x1388 packets per second per client")
+    parser.add_argument("--aux-rate", type=float, default=5.0, help="aux 0x13XX packets per second per client")
+    parser.add_argument("--aux-id", type=lambda v: int(v, 0), default=0x138c, help="aux gameplay packet id")
+    parser.add_argument("--quick-join", action="store_true", help="joiners use quick join instead of join by name")
+    parser.add_argument("--skip-countdown", action="store_true", help="stream right after 0x0bc0 (no ready check)")
+    parser.add_argument("--setup-concurrency", type=int, default=16, help="lobbies set up concurrently")
+    parser.add_argument("--drain", type=float, default=0.5, help="seconds to wait for in-flight relays")
+    parser.add_argument("--prefix", default="SIM", help="lobby name / player id prefix")
+
+def main():
+    parser = argparse.ArgumentParser(description="Mystic Nights client simulator")
+    add_arguments(parser)
+    args = parser.parse_args()
+    stats = asyncio.run(run_simulation(args))
+    report(args, stats)
+
+if __name__ == "__main__":
+    main()
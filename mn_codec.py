@@ -0,0 +1,280 @@
+"""
+Mystic Nights packet codec.
+
+Precompiled struct.Struct layouts for the packets documented in ICD.txt.
+Encoders return immutable bytes that can be handed straight to a transport.
+Fixed-count lists are packed by one whole-packet layout and the lobby list is
+filled in place in one preallocated buffer, instead of concatenating
+per-entry packs. Decoders read fields in place with unpack_from, so
+the receive buffer is never sliced for numeric fields, and PacketFramer
+frames received chunks into memoryview packets without copying.
+"""
+import functools
+import struct
+
+# ========== LAYOUTS ==========
+HEADER = struct.Struct('<HH')            # packet_id, payload_len
+U16 = struct.Struct('<H')
+U32 = struct.Struct('<I')
+
+# Generic result/ACK: flag is 01 00 00 00 on success, a single 00 on failure, then uint16 val
+RESULT_OK = struct.Struct('<HHIH')
+RESULT_FAIL = struct.Struct('<HHBH')
+
+LIST_HEAD = struct.Struct('<HHI')        # header + 01 00 00 00 flag
+CHANNEL_ENTRY = 'III'                    # channel_index, cur_players, max_players
+LOBBY_ENTRY = struct.Struct('<III16sx12sxBx')  # idx, player_count, max_players, name, password, status
+SERVER_ENTRY = '16s5x16s3xi'             # name, ip_address, availability
+
+PLAYER_BLOCK = '8s5xBBxIII'              # player_id, character, status, rank, unknown2, unknown3 (28 bytes)
+CHAR_SETUP = struct.Struct('<HHI' + PLAYER_BLOCK + '4x')
+ROOM = struct.Struct('<HHB3x16s16x' + PLAYER_BLOCK * 4 + 'II')
+DC = struct.Struct('<HHB3x')
+COUNTDOWN = struct.Struct('<HHB')
+ECHO = struct.Struct('<HH4s')
+
+# 0x1388: y, x, player_heading, cam_heading, unknown1, left_right, up_down, player_idx
+MOVE = struct.Struct('<HHffff2sBB4s')
+
+# ========== PACKET IDS ==========
+# Client -> Server
+LOGIN = 0x07d0
+ACCOUNT_CREATE = 0x07d1
+ACCOUNT_DELETE = 0x07d2
+CHANNEL_LIST_REQ = 0x07d3
+CHANNEL_JOIN = 0x07d4
+LOBBY_CREATE = 0x07d5
+LOBBY_JOIN = 0x07d6
+QUICK_JOIN = 0x07d7
+GAME_START_REQ = 0x07d8
+PLAYER_READY = 0x07d9
+LOBBY_LEAVE = 0x07da
+KICK_PLAYER = 0x07db
+CHAR_SELECT_QUERY = 0x07dc
+CHAR_SELECT_COMMIT = 0x07dd
+MAP_SELECT = 0x07de
+SERVER_LIST_REQ = 0x07df
+LOBBY_LIST_REQ = 0x07e0
+ECHO_REPLY = 0x03ea
+GAME_READY_CHECK = 0x03f0
+PLAYER_DISCONNECT = 0x03f1
+GAME_OVER = 0x03f2
+GAME_RESULT = 0x03f3
+MOVE_UPDATE = 0x1388
+
+# Server -> Client
+LOGIN_RESULT = 0x0bb8
+ACCOUNT_DELETE_RESULT = 0x0bb9
+ACCOUNT_CREATE_RESULT = 0x0bba
+CHANNEL_LIST = 0x0bbb
+CHANNEL_JOIN_ACK = 0x0bbc
+LOBBY_CREATE_ACK = 0x0bbd
+LOBBY_JOIN_ACK = 0x0bbe
+QUICK_JOIN_ACK = 0x0bbf
+GAME_START_ACK = 0x0bc0
+PLAYER_READY_ACK = 0x0bc1
+LOBBY_LEAVE_ACK = 0x0bc2
+KICK_PLAYER_ACK = 0x0bc3
+CHAR_SELECT_SETUP = 0x0bc4
+CHAR_SELECT_ACK = 0x0bc5
+MAP_SELECT_ACK = 0x0bc6
+SERVER_LIST = 0x0bc7
+LOBBY_LIST = 0x0bc8
+ECHO_CHALLENGE = 0x03e9
+LOBBY_ROOM = 0x03ee
+COUNTDOWN_PKT = 0x03ef
+PLAYER_DC = 0x03f4
+
+MAX_CHANNELS = 12
+MAX_LOBBIES = 20
+MAX_SERVERS = 10
+
+# Fixed-count lists are packed by one whole-packet layout
+CHANNEL_LIST_PKT = struct.Struct('<HHI' + CHANNEL_ENTRY * MAX_CHANNELS)
+SERVER_LIST_PKT = struct.Struct('<HHI' + SERVER_ENTRY * MAX_SERVERS)
+LOBBY_LIST_SIZE = LIST_HEAD.size + LOBBY_ENTRY.size * MAX_LOBBIES
+
+# ========== ENCODERS ==========
+def _pack_result(packet_id, success, val):
+    if success:
+        return RESULT_OK.pack(packet_id, 6, 1, val)
+    return RESULT_FAIL.pack(packet_id, 3, 0, val)
+
+# Every result/ACK packet the server sends, prebuilt for the vals it uses
+# (1 or an idx_in_channel 0-19 on success, small error codes on failure).
+RESULT_PACKET_IDS = (
+    LOGIN_RESULT, ACCOUNT_DELETE_RESULT, ACCOUNT_CREATE_RESULT, CHANNEL_JOIN_ACK,
+    LOBBY_CREATE_ACK, LOBBY_JOIN_ACK, QUICK_JOIN_ACK, GAME_START_ACK, PLAYER_READY_ACK,
+    LOBBY_LEAVE_ACK, KICK_PLAYER_ACK, CHAR_SELECT_ACK, MAP_SELECT_ACK,
+)
+RESULT_TABLE = {
+    (packet_id, success, val): _pack_result(packet_id, success, val)
+    for packet_id in RESULT_PACKET_IDS
+    for success in (True, False)
+    for val in range(32)
+}
+COUNTDOWN_PACKETS = tuple(COUNTDOWN.pack(COUNTDOWN_PKT, 1, n) for n in range(5))
+DC_PACKETS = tuple(DC.pack(PLAYER_DC, 4, idx) for idx in range(4))
+ECHO_DEFAULT = ECHO.pack(ECHO_CHALLENGE, 4, b'\x01\x00\x00\x00')
+
+def encode_result(packet_id, success=True, val=1):
+    packet = RESULT_TABLE.get((packet_id, success, val))
+    if packet is None:
+        packet = _pack_result(packet_id, success, val)
+    return packet
+
+def encode_channel_list(entries):
+    """entries: 12 (channel_index, cur_players) tuples in channel order."""
+    args = [CHANNEL_LIST, CHANNEL_LIST_PKT.size - HEADER.size, 1]
+    for channel_index, cur_players in entries:
+        args += (channel_index, cur_players, 80)
+    return CHANNEL_LIST_PKT.pack(*args)
+
+def _empty_lobby_entry(idx):
+    return LOBBY_ENTRY.pack(idx, 0, 4, f"Lobby{idx+1}".encode('euc-kr'), b'', 0)
+
+EMPTY_LOBBY_ENTRIES = tuple(_empty_lobby_entry(idx) for idx in range(MAX_LOBBIES))
+
+def encode_lobby_entry(idx, player_count, name, password, status):
+    """name/password are already-encoded bytes (truncated/padded by the layout)."""
+    return LOBBY_ENTRY.pack(idx, player_count, 4, name, password, status)
+
+def encode_lobby_list(entries):
+    """entries: {idx_in_channel: 44-byte entry}; missing slots are filled with placeholders."""
+    buf = bytearray(LOBBY_LIST_SIZE)
+    LIST_HEAD.pack_into(buf, 0, LOBBY_LIST, LOBBY_LIST_SIZE - HEADER.size, 1)
+    size = LOBBY_ENTRY.size
+    for idx in range(MAX_LOBBIES):
+        offset = LIST_HEAD.size + idx * size
+        buf[offset:offset + size] = entries.get(idx) or EMPTY_LOBBY_ENTRIES[idx]
+    return bytes(buf)
+
+# (name, ip, availability) of the offline placeholder for each server slot
+OFFLINE_SERVERS = tuple((f"MN{idx}".encode('euc-kr'), b'0.0.0.0', -1) for idx in range(MAX_SERVERS))
+
+def encode_server_list(servers):
+    """servers: (name_bytes, ip_bytes, availability) tuples; padded to 10 with offline placeholders."""
+    args = [SERVER_LIST, SERVER_LIST_PKT.size - HEADER.size, 1]
+    for entry in servers[:MAX_SERVERS]:
+        args += entry
+    for entry in OFFLINE_SERVERS[len(servers):]:
+        args += entry
+    return SERVER_LIST_PKT.pack(*args)
+
+def encode_character_setup(player_id, character, status, rank):
+    return CHAR_SETUP.pack(CHAR_SELECT_SETUP, 36, 1, player_id, character, status, rank, 0, 0)
+
+@functools.lru_cache(maxsize=None)
+def _game_start_struct(player_count):
+    return struct.Struct('<HHI' + 'B3x' * player_count + 'H2xH2xH')
+
+def encode_game_start(start_positions, vampire_id, vampire_gender, map_id):
+    layout = _game_start_struct(len(start_positions))
+    return layout.pack(GAME_START_ACK, layout.size - HEADER.size, 1,
+                       *start_positions, vampire_id, vampire_gender, map_id)
+
+def encode_room(leader_idx, name, players, map_select, lobby_status):
+    """players: 4 (player_id_bytes, character, status, rank) tuples."""
+    args = [LOBBY_ROOM, ROOM.size - HEADER.size, leader_idx, name]
+    for player_id, character, status, rank in players:
+        args += (player_id, character, status, rank, 0, 0)
+    args += (map_select, lobby_status)
+    return ROOM.pack(*args)
+
+def encode_dc(player_index):
+    if 0 <= player_index < len(DC_PACKETS):
+        return DC_PACKETS[player_index]
+    return DC.pack(PLAYER_DC, 4, player_index)
+
+def encode_countdown(number):
+    if 0 <= number < len(COUNTDOWN_PACKETS):
+        return COUNTDOWN_PACKETS[number]
+    return COUNTDOWN.pack(COUNTDOWN_PKT, 1, number)
+
+def encode_echo(payload=None):
+    if payload is None:
+        return ECHO_DEFAULT
+    return ECHO.pack(ECHO_CHALLENGE, len(payload), payload[:4])
+
+# ========== FRAMING ==========
+class PacketFramer:
+    """
+    Splits a TCP byte stream into whole packets. Packets come back as memoryview
+    slices of the received chunk, so nothing is copied; only the bytes of a packet
+    split across two reads are carried over (and copied) into the next feed().
+    Each chunk must be a fresh object (it is never overwritten), so the views stay
+    valid for as long as anything holds on to them.
+    """
+    __slots__ = ('tail',)
+
+    def __init__(self):
+        self.tail = b''
+
+    def feed(self, chunk):
+        if self.tail:
+            chunk = self.tail + chunk
+            self.tail = b''
+        view = memoryview(chunk)
+        end = len(chunk)
+        pos = 0
+        packets = []
+        unpack_len = U16.unpack_from
+        while end - pos >= HEADER.size:
+            pkt_end = pos + HEADER.size + unpack_len(chunk, pos + 2)[0]
+            if pkt_end > end:
+                break
+            packets.append(view[pos:pkt_end])
+            pos = pkt_end
+        if pos < end:
+            self.tail = bytes(view[pos:])
+        return packets
+
+# ========== DECODERS ==========
+def cstr(data, start, end, errors='strict'):
+    """Decode a zero-padded ASCII field (tolerates short packets like the slicing it replaces)."""
+    return bytes(data[start:end]).decode('ascii', errors).rstrip('\x00')
+
+def decode_header(data):
+    if len(data) < HEADER.size:
+        return None, None
+    return HEADER.unpack_from(data)
+
+def decode_u32(data, offset=4):
+    return U32.unpack_from(data, offset)[0]
+
+def decode_account(data):
+    packet_id, payload_len = HEADER.unpack_from(data)
+    return packet_id, payload_len, cstr(data, 4, 12), cstr(data, 17, 29)
+
+def decode_channel_join(data):
+    packet_id, payload_len = HEADER.unpack_from(data)
+    return {
+        "packet_id": packet_id,
+        "payload_len": payload_len,
+        "player_id": cstr(data, 4, 12),
+        "channel_index": U16.unpack_from(data, 20)[0]
+    }
+
+def decode_lobby_create(data):
+    return cstr(data, 4, 12), cstr(data, 17, 29), cstr(data, 34, 42)
+
+def decode_lobby_join(data):
+    return cstr(data, 4, 12), cstr(data, 24, 36)
+
+def decode_move(data):
+    if len(data) < MOVE.size:
+        raise ValueError("Packet too short for 0x1388 movement update")
+    (pkt_id, pkt_len, y_pos, x_pos, player_heading, cam_heading,
+     unknown1, left_right, up_down, player_idx) = MOVE.unpack_from(data)
+    return {
+        "pkt_id": pkt_id,
+        "pkt_len": pkt_len,
+        "x_pos": x_pos,
+        "y_pos": y_pos,
+        "player_heading": player_heading,
+        "cam_heading": cam_heading,
+        "unknown1": unknown1,
+        "left_right": left_right,
+        "up_down": up_down,
+        "player_idx": player_idx,
+    }
@@ -177,6 +177,35 @@ CREATE TABLE public.servers (
 
 ALTER TABLE public.servers OWNER TO postgres;
 
+--
+-- Name: nodes; Type: TABLE; Schema: public; Owner: postgres
+-- Cluster mode: which node serves each servers row, and when it last heartbeated
+--
+
+CREATE TABLE public.nodes (
+    server_id integer NOT NULL,
+    node_id text NOT NULL,
+    host text NOT NULL,
+    last_seen double precision NOT NULL
+);
+
+
+ALTER TABLE public.nodes OWNER TO postgres;
+
+--
+-- Name: player_sessions; Type: TABLE; Schema: public; Owner: postgres
+-- Cluster mode: one active session per player (owner = node id, plus worker index)
+--
+
+CREATE TABLE public.player_sessions (
+    player_id text NOT NULL,
+    owner text NOT NULL,
+    lease_until double precision NOT NULL
+);
+
+
+ALTER TABLE public.player_sessions OWNER TO postgres;
+
 --
 -- TOC entry 217 (class 1259 OID 16389)
 -- Name: servers_id_seq; Type: SEQUENCE; Schema: public; Owner: postgres
@@ -288,6 +317,37 @@ ALTER TABLE ONLY public.servers
     ADD CONSTRAINT servers_pkey PRIMARY KEY (id);
 
 
+--
+-- Name: nodes nodes_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
+--
+
+ALTER TABLE ONLY public.nodes
+    ADD CONSTRAINT nodes_pkey PRIMARY KEY (server_id);
+
+
+--
+-- Name: player_sessions player_sessions_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
+--
+
+ALTER TABLE ONLY public.player_sessions
+    ADD CONSTRAINT player_sessions_pkey PRIMARY KEY (player_id);
+
+
+--
+-- Name: idx_player_sessions_owner; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX idx_player_sessions_owner ON public.player_sessions USING btree (owner);
+
+
+--
+-- Name: nodes nodes_server_id_fkey; Type: FK CONSTRAINT; Schema: public; Owner: postgres
+--
+
+ALTER TABLE ONLY public.nodes
+    ADD CONSTRAINT nodes_server_id_fkey FOREIGN KEY (server_id) REFERENCES public.servers(id);
+
+
 --
 -- TOC entry 4786 (class 2606 OID 16510)
 -- Name: channels channels_server_id_fkey; Type: FK CONSTRAINT; Schema: public; Owner: postgres
@@ -55,10 +55,27 @@ CREATE TABLE lobbies (
     FOREIGN KEY (player4_id) REFERENCES players(player_id)
 );
 
+-- Cluster mode: which node serves each servers row, and when it last heartbeated
+CREATE TABLE nodes (
+    server_id INTEGER PRIMARY KEY,
+    node_id TEXT NOT NULL,
+    host TEXT NOT NULL,
+    last_seen DOUBLE PRECISION NOT NULL,
+    FOREIGN KEY (server_id) REFERENCES servers(id)
+);
+
+-- Cluster mode: one active session per player (owner = node id, plus worker index)
+CREATE TABLE player_sessions (
+    player_id TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    lease_until DOUBLE PRECISION NOT NULL
+);
+
 -- Add indices for fast lookups (optional but recommended)
 CREATE INDEX idx_channels_server_id ON channels(server_id);
 CREATE INDEX idx_lobbies_channel_id ON lobbies(channel_id);
 CREATE INDEX idx_players_player_id ON players(player_id);
+CREATE INDEX idx_player_sessions_owner ON player_sessions(owner);
 
 INSERT INTO servers (id, name, ip_address, player_count, availability) VALUES
   (1, 'MN0', '211.233.10.5', 0, 0),